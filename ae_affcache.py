@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent affiliate-link cache shared by main.py, enrich_csv and /aff_test.
+
+Key = canonical product (item:<id> when the URL/value carries an item id,
+else the URL without query/fragment) + tracking id. Each entry records where
+the link came from:
+    api      -> AFF_CACHE_TTL_DAYS (default 30 days)
+    s.click  -> AFF_CACHE_SCLICK_TTL_HOURS (default 24h; the API may work later)
+    no-aff   -> AFF_CACHE_NOAFF_TTL_MIN (default 60 min; negative cache)
+Reads touch last_used; above AFF_CACHE_MAX entries the least recently used
+are evicted.
+"""
+import os, re, time, sqlite3, threading
+from urllib.parse import urlsplit, urlunsplit
+
+AFF_CACHE_DB = os.getenv("AFF_CACHE_DB") or os.path.join(os.getenv("BOT_DATA_DIR") or os.getenv("DATA_DIR") or "data", "aff_cache.db")
+TTL_SEC = {
+    "api": float(os.getenv("AFF_CACHE_TTL_DAYS", "30")) * 86400,
+    "s.click": float(os.getenv("AFF_CACHE_SCLICK_TTL_HOURS", "24")) * 3600,
+    "no-aff": float(os.getenv("AFF_CACHE_NOAFF_TTL_MIN", "60")) * 60,
+}
+MAX_ENTRIES = int(os.getenv("AFF_CACHE_MAX", "50000"))
+
+_ID_RE = re.compile(r"/item/(\d{8,})\.html|^(\d{8,})$")
+
+def canonical(value: str) -> str:
+    v = str(value or "").strip()
+    m = _ID_RE.search(v)
+    if m:
+        return "item:" + (m.group(1) or m.group(2))
+    p = urlsplit(v)
+    if p.scheme and p.netloc:
+        return urlunsplit((p.scheme.lower(), p.netloc.lower(), p.path.rstrip("/"), "", ""))
+    return v
+
+class AffLinkCache:
+    def __init__(self, path: str = AFF_CACHE_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            c = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("""CREATE TABLE IF NOT EXISTS aff_links (
+                key TEXT NOT NULL, tracking_id TEXT NOT NULL, link TEXT NOT NULL, source TEXT NOT NULL,
+                created_at REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (key, tracking_id))""")
+            c.execute("CREATE INDEX IF NOT EXISTS aff_links_lru ON aff_links(last_used)")
+            self._conn = c
+        return self._conn
+
+    def get_many(self, values, tracking_id: str = "") -> dict:
+        """{value: (link, source)} for fresh entries; misses are simply absent."""
+        keys = {}
+        for v in values:
+            if v:
+                keys.setdefault(canonical(v), []).append(v)
+        if not keys:
+            return {}
+        now = time.time()
+        out, fresh = {}, []
+        with self._lock:
+            db = self._db()
+            ks = list(keys)
+            for i in range(0, len(ks), 500):
+                part = ks[i:i+500]
+                q = f"SELECT key, link, source, created_at FROM aff_links WHERE tracking_id=? AND key IN ({','.join('?' * len(part))})"
+                for key, link, source, created in db.execute(q, [tracking_id] + part):
+                    if now - created > TTL_SEC.get(source, TTL_SEC["api"]):
+                        continue
+                    fresh.append(key)
+                    for v in keys[key]:
+                        out[v] = (link, source)
+            if fresh:
+                with db:
+                    db.executemany("UPDATE aff_links SET last_used=? WHERE key=? AND tracking_id=?",
+                                   [(now, k, tracking_id) for k in fresh])
+            self.hits += len(out)
+            self.misses += sum(len(vs) for k, vs in keys.items() if k not in fresh)
+        return out
+
+    def get(self, value: str, tracking_id: str = ""):
+        return self.get_many([value], tracking_id).get(value)
+
+    def put_many(self, entries, tracking_id: str = ""):
+        """entries: iterable of (value, link, source) with source in api / s.click / no-aff."""
+        now = time.time()
+        rows = [(canonical(v), tracking_id, link or "", source, now, now) for v, link, source in entries if v]
+        if not rows:
+            return
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO aff_links VALUES (?,?,?,?,?,?)", rows)
+                n = db.execute("SELECT COUNT(*) FROM aff_links").fetchone()[0]
+                if n > MAX_ENTRIES:
+                    # LRU eviction, with 10% headroom so we don't evict on every insert
+                    drop = n - int(MAX_ENTRIES * 0.9)
+                    db.execute("DELETE FROM aff_links WHERE rowid IN "
+                               "(SELECT rowid FROM aff_links ORDER BY last_used LIMIT ?)", (drop,))
+
+    def put(self, value: str, link: str, source: str, tracking_id: str = ""):
+        self.put_many([(value, link, source)], tracking_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db().execute("SELECT source, COUNT(*) FROM aff_links GROUP BY source").fetchall()
+        return {"hits": self.hits, "misses": self.misses, **{s: n for s, n in rows}}
+
+AFF_CACHE = AffLinkCache()
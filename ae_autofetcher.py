@@ -3,12 +3,17 @@
 Auto-fetcher for AliExpress Affiliates: pulls products for given keywords
 and appends them to the queue CSV. Designed to be imported by your bot's main.py.
 """
-import os, time, csv, threading
+import os, time, csv, inspect, threading
 from datetime import datetime
 from urllib.parse import urlparse
 
 IL_TZ_NAME = "Asia/Jerusalem"
 
+try:
+    import ae_catalog   # local catalog: answer keywords locally first, network tops up
+except Exception:
+    ae_catalog = None
+
 def _now_il():
     try:
         from zoneinfo import ZoneInfo
@@ -45,33 +50,71 @@ def read_keywords(keywords_path: str):
         pass
     return keys
 
+# (method, keyword arg, size arg) in probe order
+_SEARCH_CANDIDATES = [
+    ("search_products", "keyword", "page_size"),
+    ("search", "keyword", "page_size"),
+    ("product_search", "keyword", "page_size"),
+    ("get_products", "query", "limit"),
+    ("fetch_products", "query", "limit"),
+]
+_ADAPTERS = {}          # id(AE) -> (AE, adapter or None)
+_ADAPTERS_LOCK = threading.Lock()
+
+def _accepts(fn, **kw) -> bool:
+    """Whether fn can be called with these keyword args (decided from its signature, not by calling it)."""
+    try:
+        inspect.signature(fn).bind(**kw)
+    except TypeError:
+        return False
+    except ValueError:
+        return True   # no introspectable signature (C / wrapped callables): assume it fits
+    return True
+
+def _probe_search(AE):
+    """First search method AE has whose signature takes (keyword, page size) -> direct adapter, or None."""
+    for name, kw_arg, size_arg in _SEARCH_CANDIDATES:
+        fn = getattr(AE, name, None)
+        if not callable(fn) or not _accepts(fn, **{kw_arg: "", size_arg: 1}):
+            continue
+        def adapter(keyword, page_size, fn=fn, kw_arg=kw_arg, size_arg=size_arg):
+            return fn(**{kw_arg: keyword, size_arg: page_size})
+        adapter.method = name
+        print(f"[AUTO] AE search via AE.{name}", flush=True)
+        return adapter
+    return None
+
+def _search_adapter(AE):
+    """Probed once per client instance; later keywords / cycles call the cached adapter directly."""
+    ent = _ADAPTERS.get(id(AE))
+    if ent is None or ent[0] is not AE:
+        with _ADAPTERS_LOCK:
+            ent = _ADAPTERS.get(id(AE))
+            if ent is None or ent[0] is not AE:
+                ent = _ADAPTERS[id(AE)] = (AE, _probe_search(AE))
+    return ent[1]
+
 def _call_ae_search(AE, keyword: str, page_size: int = 5):
     """
-    Best-effort search over common method names.
+    Search through the client's probed search method.
     Returns: list of dict-like product objects, or [] on failure.
     """
     if AE is None:
         return []
-    candidates = [
-        ("search_products", {"keyword": keyword, "page_size": page_size}),
-        ("search", {"keyword": keyword, "page_size": page_size}),
-        ("product_search", {"keyword": keyword, "page_size": page_size}),
-        ("get_products", {"query": keyword, "limit": page_size}),
-        ("fetch_products", {"query": keyword, "limit": page_size}),
-    ]
-    for name, params in candidates:
-        try:
-            fn = getattr(AE, name, None)
-            if callable(fn):
-                res = fn(**params)
-                if isinstance(res, dict) and res.get("items"):
-                    return res["items"]
-                if isinstance(res, (list, tuple)):
-                    return list(res)
-        except Exception as e:
-            print(f"[AUTO] AE.{name} failed for '{keyword}': {e}", flush=True)
-            continue
-    print(f"[AUTO] No suitable AE search method found for '{keyword}'", flush=True)
+    fn = _search_adapter(AE)
+    if fn is None:
+        print(f"[AUTO] No suitable AE search method found for '{keyword}'", flush=True)
+        return []
+    try:
+        res = fn(keyword, page_size)
+    except Exception as e:
+        # the signature was checked at probe time: this is a runtime failure, the method stays
+        print(f"[AUTO] AE.{fn.method} failed for '{keyword}': {e}", flush=True)
+        return []
+    if isinstance(res, dict):
+        return res.get("items") or []
+    if isinstance(res, (list, tuple)):
+        return list(res)
     return []
 
 def _norm_item(obj):
@@ -137,6 +180,16 @@ def _dedupe(existing, new_items):
             seen_links.add(ln)
     return out
 
+def _catalog_items(keyword: str, limit: int, existing):
+    if ae_catalog is None:
+        return []
+    queued = {(r.get("ItemId") or "").strip() for r in existing}
+    hits = ae_catalog.safe_search(keyword, limit=limit, exclude_ids=queued, require_aff=True)
+    if hits:
+        print(f"[AUTO] '{keyword}': {len(hits)} from local catalog", flush=True)
+    return [{"ItemId": h["item_id"], "Title": h["title"], "Image Url": h["image"], "Video Url": h["video"],
+             "BuyLink": h["aff_url"], "Opening": "", "Strengths": ""} for h in hits]
+
 def fetch_once(AE, pending_csv: str, keywords_path: str, max_per_keyword: int = 3):
     kws = read_keywords(keywords_path)
     if not kws:
@@ -147,15 +200,21 @@ def fetch_once(AE, pending_csv: str, keywords_path: str, max_per_keyword: int =
     existing = _read_queue(pending_csv)
 
     for kw in kws:
-        raw = _call_ae_search(AE, kw, page_size=max_per_keyword)
-        if not raw:
+        local = _catalog_items(kw, max_per_keyword, existing)
+        need = max_per_keyword - len(local)
+        raw = _call_ae_search(AE, kw, page_size=need) if need > 0 else []
+        if raw and ae_catalog:
+            ae_catalog.safe_upsert(raw, source="autofetch")
+        if not raw and not local:
             print(f"[AUTO] No results for '{kw}'", flush=True)
             continue
-        norm = [_norm_item(x) for x in raw]
+        norm = local + [_norm_item(x) for x in raw]
         norm = [n for n in norm if n.get("BuyLink")]  # must have link
         to_add = _dedupe(existing, norm)[:max_per_keyword]
         if not to_add:
             continue
+        if ae_catalog:
+            ae_catalog.safe_mark_queued([n["ItemId"] for n in to_add])
         existing.extend(to_add)
         added += len(to_add)
 
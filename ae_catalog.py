@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Local product catalog (SQLite + FTS5) fed by every pull / ingest path.
+
+Keyword requests are answered from here first (milliseconds) and the
+network is only used to top up:
+
+    from ae_catalog import CATALOG
+    CATALOG.upsert(rows, source="pull")          # any of the repo's row shapes
+    hits = CATALOG.search("bluetooth earbuds", limit=10, exclude_ids=queued)
+    CATALOG.mark_queued([h["item_id"] for h in hits])
+
+Rows are normalized from the CSV/API field names used across the repo
+(ItemId/ProductId/product_id, Title/Product Desc, SalePrice/Discount Price,
+Promotion Url/BuyLink, Sales180Day/Orders, Positive Feedback/Rating, ...).
+Items queued within CATALOG_REQUEUE_DAYS are skipped by search() so the
+same product isn't re-posted every time it matches.
+
+CLI:
+    python ae_catalog.py import posts_full.csv products.csv
+    python ae_catalog.py search "led strip" [--limit 10]
+"""
+import os, re, csv, time, sqlite3, hashlib, threading
+
+CATALOG_DB = os.getenv("CATALOG_DB") or os.path.join(os.getenv("BOT_DATA_DIR") or os.getenv("DATA_DIR") or "data", "catalog.db")
+REQUEUE_DAYS = float(os.getenv("CATALOG_REQUEUE_DAYS", "14"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    item_id     TEXT PRIMARY KEY,
+    title       TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    url         TEXT NOT NULL DEFAULT '',
+    aff_url     TEXT NOT NULL DEFAULT '',
+    image       TEXT NOT NULL DEFAULT '',
+    video       TEXT NOT NULL DEFAULT '',
+    price       REAL,
+    orig_price  REAL,
+    currency    TEXT NOT NULL DEFAULT '',
+    discount    REAL,
+    orders      INTEGER,
+    rating      REAL,
+    category    TEXT NOT NULL DEFAULT '',
+    source      TEXT NOT NULL DEFAULT '',
+    updated_at  REAL NOT NULL,
+    queued_at   REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS products_price ON products(price);
+CREATE INDEX IF NOT EXISTS products_orders ON products(orders);
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    title, description, category, content='products', content_rowid='rowid', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS products_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts(rowid, title, description, category) VALUES (new.rowid, new.title, new.description, new.category);
+END;
+CREATE TRIGGER IF NOT EXISTS products_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, title, description, category) VALUES ('delete', old.rowid, old.title, old.description, old.category);
+END;
+CREATE TRIGGER IF NOT EXISTS products_au AFTER UPDATE OF title, description, category ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, title, description, category) VALUES ('delete', old.rowid, old.title, old.description, old.category);
+    INSERT INTO products_fts(rowid, title, description, category) VALUES (new.rowid, new.title, new.description, new.category);
+END;
+"""
+
+_TEXT_COLS = ("title", "description", "url", "aff_url", "image", "video", "currency", "category", "source")
+_NUM_COLS = ("price", "orig_price", "discount", "orders", "rating")
+
+# ---- normalization ----
+def _first(row, *names):
+    for n in names:
+        v = row.get(n)
+        if v not in (None, ""):
+            return v
+    return ""
+
+_NUM_RE = re.compile(r"-?\d+(?:[.,]\d+)*")
+
+def _num(v):
+    """'ILS 22.80' -> 22.8, '96.40%' -> 96.4, '1,234' -> 1234, '' -> None."""
+    if v in (None, ""):
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    m = _NUM_RE.search(str(v))
+    if not m:
+        return None
+    s = m.group(0)
+    if "," in s:
+        # thousands separators ("1,234", "1,234.5") vs decimal comma ("22,80")
+        s = s.replace(",", "") if ("." in s or re.fullmatch(r"-?\d{1,3}(,\d{3})+", s)) else s.replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def _item_id(v, url=""):
+    s = str(v or "").strip()
+    if s.endswith(".0"):             # ids mangled to floats by spreadsheet exports
+        s = s[:-2]
+    if not s.isdigit() or re.fullmatch(r"\d+0{6}", s):   # ...and rounded: 1005010000000000
+        m = re.search(r"/item/(\d{8,})\.html", url or "")
+        s = m.group(1) if m else ""
+    return s
+
+def normalize(row: dict, source: str = "") -> dict:
+    url = str(_first(row, "Url", "url", "product_detail_url", "productDetailUrl", "Product Url", "Product Detail Url", "target_url"))
+    aff = str(_first(row, "Promotion Url", "promotion_link", "promotionUrl", "promotion_url", "BuyLink", "aff_url"))
+    if not url and aff and "/item/" in aff:
+        url, aff = aff, ""
+    if url and "s.click.aliexpress.com" in url:   # main.py stores the affiliate link as "url"
+        url, aff = "", aff or url
+    pid = _item_id(_first(row, "ItemId", "ProductId", "product_id", "productId", "item_id", "itemId", "id"), url or aff)
+    title = str(_first(row, "Title", "title", "product_title", "productTitle", "subject", "Product Desc")).strip()
+    if not pid and (aff or title):
+        # no usable id (rounded export, s.click-only row): key by link/title instead
+        pid = "x" + hashlib.md5((aff or title).encode("utf-8")).hexdigest()[:15]
+    desc = str(_first(row, "Product Desc", "description", "Opening", "פתיח", "Strengths", "פוסט")).strip()
+    price = _num(_first(row, "SalePrice", "Discount Price", "app_sale_price", "sale_price", "Price", "price"))
+    orig = _num(_first(row, "OriginalPrice", "Origin Price", "original_price", "target_original_price"))
+    disc = _num(_first(row, "Discount", "הנחה", "discount"))
+    if disc is None and price and orig and orig > price:
+        disc = round(100 * (1 - price / orig), 1)
+    cur = str(_first(row, "Currency", "currency", "app_sale_price_currency", "target_sale_price_currency"))
+    if not cur:
+        m = re.match(r"\s*([A-Z]{3})\b", str(_first(row, "SalePrice", "Discount Price", "Price", "price")))
+        cur = m.group(1) if m else ""
+    orders = _num(_first(row, "Orders", "Sales180Day", "lastest_volume", "latest_volume", "volume"))
+    return {
+        "item_id": pid,
+        "title": title,
+        "description": desc if desc != title else "",
+        "url": url or (f"https://www.aliexpress.com/item/{pid}.html" if pid.isdigit() else ""),
+        "aff_url": aff,
+        "image": str(_first(row, "Image Url", "Image", "ImageURL", "image_url", "imageUrl", "product_main_image_url", "image")),
+        "video": str(_first(row, "Video Url", "Video", "VideoURL", "video_url", "product_video_url")),
+        "price": price,
+        "orig_price": orig,
+        "currency": cur,
+        "discount": disc,
+        "orders": int(orders) if orders is not None else None,
+        "rating": _num(_first(row, "Rating", "Positive Feedback", "evaluate_rate", "rating")),
+        "category": str(_first(row, "Category", "category", "first_level_category_name")),
+        "source": source,
+    }
+
+def _fts_query(text: str, any_term: bool = False) -> str:
+    terms = re.findall(r"\w+", text or "", re.UNICODE)
+    return (" OR " if any_term else " ").join(f'"{t}"*' for t in terms)
+
+class Catalog:
+    def __init__(self, path: str = CATALOG_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            c = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            c.row_factory = sqlite3.Row
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.executescript(_SCHEMA)
+            self._conn = c
+        return self._conn
+
+    def upsert(self, rows, source: str = "") -> int:
+        """Insert/refresh rows; empty incoming fields never overwrite known values."""
+        now = time.time()
+        recs = [r for r in (normalize(x, source) for x in rows or []) if r["item_id"] and r["title"]]
+        if not recs:
+            return 0
+        cols = ("item_id",) + _TEXT_COLS + _NUM_COLS
+        keep = ", ".join(
+            [f"{c}=COALESCE(NULLIF(excluded.{c},''), products.{c})" for c in _TEXT_COLS] +
+            [f"{c}=COALESCE(excluded.{c}, products.{c})" for c in _NUM_COLS])
+        sql = (f"INSERT INTO products ({', '.join(cols)}, updated_at) VALUES ({', '.join('?' * len(cols))}, ?) "
+               f"ON CONFLICT(item_id) DO UPDATE SET {keep}, updated_at=excluded.updated_at")
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany(sql, [tuple(r[c] for c in cols) + (now,) for r in recs])
+        return len(recs)
+
+    def search(self, query: str, limit: int = 10, exclude_ids=None, min_price=None, max_price=None,
+               min_rating=None, min_orders=None, require_aff: bool = False) -> list:
+        """Best matches for query (all terms first, then any term), most-ordered first among equals."""
+        exclude = {str(x) for x in (exclude_ids or ())}
+        where = ["p.queued_at < ?"]
+        args = [time.time() - REQUEUE_DAYS * 86400]
+        for col, op, val in (("price", ">=", min_price), ("price", "<=", max_price),
+                             ("rating", ">=", min_rating), ("orders", ">=", min_orders)):
+            if val is not None:
+                where.append(f"p.{col} {op} ?"); args.append(val)
+        if require_aff:
+            where.append("p.aff_url != ''")
+        out, seen = [], set(exclude)
+        with self._lock:
+            db = self._db()
+            for any_term in (False, True):
+                q = _fts_query(query, any_term)
+                if not q or len(out) >= limit:
+                    break
+                rows = db.execute(
+                    "SELECT p.* FROM products_fts f JOIN products p ON p.rowid = f.rowid "
+                    f"WHERE products_fts MATCH ? AND {' AND '.join(where)} "
+                    "ORDER BY bm25(products_fts, 10.0, 2.0, 1.0), COALESCE(p.orders, 0) DESC LIMIT ?",
+                    [q] + args + [limit + len(seen)]).fetchall()
+                for r in rows:
+                    if r["item_id"] in seen:
+                        continue
+                    seen.add(r["item_id"]); out.append(dict(r))
+                    if len(out) >= limit:
+                        break
+        return out
+
+    def mark_queued(self, item_ids):
+        ids = [str(i) for i in item_ids or () if i]
+        if not ids:
+            return
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("UPDATE products SET queued_at=? WHERE item_id=?", [(time.time(), i) for i in ids])
+
+    def import_csv(self, path: str, source: str = None) -> int:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        n = self.upsert(rows, source=source or os.path.basename(path))
+        print(f"[CATALOG] imported {n}/{len(rows)} rows from {path}", flush=True)
+        return n
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+CATALOG = Catalog()
+
+def safe_upsert(rows, source: str = "") -> int:
+    """upsert() for hot paths: the catalog must never break a pull or an enqueue."""
+    try:
+        return CATALOG.upsert(rows, source=source)
+    except Exception as e:
+        print(f"[CATALOG][WARN] upsert failed: {e}", flush=True)
+        return 0
+
+def safe_mark_queued(item_ids):
+    try:
+        CATALOG.mark_queued(item_ids)
+    except Exception as e:
+        print(f"[CATALOG][WARN] mark_queued failed: {e}", flush=True)
+
+def safe_search(query: str, limit: int = 10, **kw) -> list:
+    try:
+        return CATALOG.search(query, limit=limit, **kw)
+    except Exception as e:
+        print(f"[CATALOG][WARN] search failed: {e}", flush=True)
+        return []
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Local product catalog")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_imp = sub.add_parser("import"); p_imp.add_argument("paths", nargs="+")
+    p_s = sub.add_parser("search"); p_s.add_argument("query"); p_s.add_argument("--limit", type=int, default=10)
+    a = ap.parse_args()
+    if a.cmd == "import":
+        for pth in a.paths:
+            CATALOG.import_csv(pth)
+        print(f"catalog size: {CATALOG.count()}")
+    else:
+        t0 = time.time()
+        hits = CATALOG.search(a.query, limit=a.limit)
+        for h in hits:
+            print(f"{h['item_id']}  {h['price'] or '-':>8} {h['currency']:<4} orders={h['orders'] or 0:<6} {h['title'][:70]}")
+        print(f"{len(hits)} hits in {(time.time() - t0) * 1000:.1f} ms")
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Deadline carried through a multi-stage pull (discover -> meta -> affiliate).
+Deadline(None) never expires, so callers can pass one unconditionally.
+"""
+import time
+
+class Deadline:
+    def __init__(self, seconds=None):
+        self.t_end = (time.monotonic() + float(seconds)) if seconds else None
+
+    def remaining(self) -> float:
+        if self.t_end is None:
+            return float("inf")
+        return max(0.0, self.t_end - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def sub(self, fraction: float) -> "Deadline":
+        """A child deadline ending after `fraction` of the time left (for an early stage)."""
+        d = Deadline()
+        if self.t_end is not None:
+            d.t_end = time.monotonic() + self.remaining() * fraction
+        return d
+
+    def clip(self, timeout, floor: float = 1.0):
+        """Shrink a requests timeout (float or (connect, read)) to the time left, never below floor."""
+        rem = self.remaining()
+        if rem == float("inf"):
+            return timeout
+        cap = max(floor, rem)
+        if isinstance(timeout, tuple):
+            return tuple(min(t, cap) for t in timeout)
+        return min(timeout, cap)
+
+    def __repr__(self):
+        rem = self.remaining()
+        return "Deadline(inf)" if rem == float("inf") else f"Deadline({rem:.1f}s left)"
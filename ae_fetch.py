@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Guarded page fetches for scraping.
+
+fetch_capped() streams the body (compression negotiated via ae_http's
+Accept-Encoding) and stops early when:
+  - Content-Length or the decoded body exceeds SCRAPE_MAX_BODY_KB  -> BodyTooLarge
+  - the first SCRAPE_SNIFF_KB (or the redirect target) look like a
+    captcha / punish / anomaly interstitial                         -> BlockedPage
+Outcomes per search source (host + first path segment) are counted in
+SOURCES so /netstats shows which sources are hitting, missing or blocked.
+"""
+import os, re, time, threading
+from urllib.parse import urlparse
+from ae_proxies import PROXIES
+
+MAX_BODY = int(os.getenv("SCRAPE_MAX_BODY_KB", "3072")) * 1024
+SNIFF = int(os.getenv("SCRAPE_SNIFF_KB", "16")) * 1024
+CHUNK = 16 * 1024
+
+# AliExpress (baxia / x5 slider), generic captcha walls, DuckDuckGo anomaly page
+_BLOCK_RE = re.compile(
+    r"_____tmd_____|x5secdata|baxia-punish|/punish\?|nc_1_n1z|slide to verify|"
+    r"g-recaptcha|hcaptcha|cf-challenge|anomaly-modal|unusual traffic",
+    re.I)
+
+class BlockedPage(Exception):
+    pass
+
+class BodyTooLarge(Exception):
+    pass
+
+def is_blocked(text: str, final_url: str = "") -> bool:
+    return bool(_BLOCK_RE.search(final_url or "") or _BLOCK_RE.search(text or ""))
+
+def _penalize_proxy(r):
+    proxy = getattr(r, "proxy_used", None)
+    if proxy:
+        PROXIES.penalize(proxy, r.url)
+
+def fetch_capped(s, url, max_bytes=None, **kw):
+    """GET url via session s; returns the Response with its body read (r.content / r.text work)."""
+    max_bytes = max_bytes or MAX_BODY
+    r = s.get(url, stream=True, **kw)
+    try:
+        r.raise_for_status()
+        if is_blocked("", r.url):
+            _penalize_proxy(r)
+            raise BlockedPage(f"redirected to {r.url[:120]}")
+        cl = r.headers.get("Content-Length")
+        if cl and cl.isdigit() and int(cl) > max_bytes:
+            raise BodyTooLarge(f"Content-Length {int(cl)//1024}KB > {max_bytes//1024}KB")
+        buf = bytearray()
+        sniffed = False
+        for chunk in r.iter_content(CHUNK):   # decoded (gzip/deflate/br) chunks
+            buf += chunk
+            if not sniffed and len(buf) >= SNIFF:
+                sniffed = True
+                if is_blocked(bytes(buf[:SNIFF]).decode("latin-1")):
+                    _penalize_proxy(r)
+                    raise BlockedPage(f"captcha/interstitial in first {SNIFF//1024}KB")
+            if len(buf) > max_bytes:
+                raise BodyTooLarge(f"body > {max_bytes//1024}KB")
+        if not sniffed and is_blocked(bytes(buf).decode("latin-1")):
+            _penalize_proxy(r)
+            raise BlockedPage("captcha/interstitial page")
+        r._content = bytes(buf)
+        return r
+    finally:
+        r.close()  # early abort drops the connection instead of draining the rest
+
+# ---- per-source statistics ----
+def source_key(url: str) -> str:
+    p = urlparse(url)
+    seg = (p.path or "/").lstrip("/").split("/", 1)[0]
+    seg = re.sub(r"[-_].*", "", seg)   # wholesale-phone.html -> wholesale
+    return f"{p.hostname or ''}/{seg}"
+
+class SourceStats:
+    FIELDS = ("hit", "miss", "blocked", "too_large", "error")
+
+    def __init__(self):
+        self._d = {}
+        self._lock = threading.Lock()
+
+    def record(self, url: str, outcome: str, nbytes: int = 0):
+        key = source_key(url)
+        with self._lock:
+            st = self._d.setdefault(key, dict.fromkeys(self.FIELDS, 0) | {"bytes": 0, "last_blocked": 0.0})
+            st[outcome] = st.get(outcome, 0) + 1
+            st["bytes"] += nbytes
+            if outcome == "blocked":
+                st["last_blocked"] = time.time()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self._d.items()}
+
+    def format_stats(self) -> str:
+        lines = []
+        for key, st in sorted(self.stats().items()):
+            lines.append(f"{key}: hit={st['hit']} miss={st['miss']} blocked={st['blocked']} "
+                         f"big={st['too_large']} err={st['error']} {st['bytes']//1024}KB")
+        return "\n".join(lines) or "no sources fetched yet"
+
+SOURCES = SourceStats()
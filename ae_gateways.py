@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Hedged calls with per-gateway latency tracking and circuit breakers.
+
+GatewayPool.call(fn) runs fn(gateway_url) on the healthiest gateway first.
+If it has not answered within that gateway's recent p95 latency, the next
+gateway is fired in parallel and the first success wins (the loser finishes
+in the background and only updates the stats). A gateway that fails
+AE_CB_FAILURES times in a row is skipped for AE_CB_COOLDOWN_SEC, then gets
+a single half-open trial.
+Each call() is one operation with one retry budget (ae_timeouts): fail-over
+to the next gateway and the HTTP retries inside fn share it.
+"""
+import os, time, threading, contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ae_timeouts import retry_budget, take_retry
+
+CB_FAILURES = int(os.getenv("AE_CB_FAILURES", "3"))
+CB_COOLDOWN_SEC = float(os.getenv("AE_CB_COOLDOWN_SEC", "60"))
+HEDGE_DEFAULT_SEC = float(os.getenv("AE_HEDGE_DEFAULT_SEC", "2.0"))  # until we have samples
+HEDGE_MIN_SEC = float(os.getenv("AE_HEDGE_MIN_SEC", "0.3"))
+HEDGE_MIN_SAMPLES = 5
+WINDOW = 50
+
+_EXEC = ThreadPoolExecutor(max_workers=int(os.getenv("AE_HEDGE_WORKERS", "8")), thread_name_prefix="ae-gw")
+
+class GatewayStats:
+    def __init__(self):
+        self.lat = deque(maxlen=WINDOW)   # successful call latencies (sec)
+        self.fails = 0                    # consecutive failures
+        self.open_until = 0.0
+        self.trial_inflight = False
+        self.ok = 0
+        self.err = 0
+        self.hedged = 0
+        self.won = 0
+
+    def percentile(self, q: float):
+        if not self.lat:
+            return None
+        xs = sorted(self.lat)
+        return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+    def state(self, now: float) -> str:
+        if self.open_until <= 0:
+            return "closed"
+        return "open" if now < self.open_until else "half-open"
+
+class GatewayPool:
+    def __init__(self, name: str, gateways):
+        self.name = name
+        self.gateways = [g for g in gateways if g]
+        self._stats = {g: GatewayStats() for g in self.gateways}
+        self._lock = threading.Lock()
+
+    # ---- health ----
+    def hedge_delay(self, gw: str) -> float:
+        st = self._stats[gw]
+        if len(st.lat) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_SEC
+        return max(HEDGE_MIN_SEC, st.percentile(0.95))
+
+    def _order(self):
+        """Usable gateways: closed ones by p50 (config order breaks ties), then one half-open trial."""
+        now = time.time()
+        closed, half = [], []
+        with self._lock:
+            for i, gw in enumerate(self.gateways):
+                st = self._stats[gw]
+                s = st.state(now)
+                if s == "closed":
+                    closed.append((st.percentile(0.5) or 0.0, i, gw))
+                elif s == "half-open" and not st.trial_inflight:
+                    half.append(gw)
+            if not closed and not half:
+                # everything is open: try the one whose cool-down ends first instead of failing outright
+                gw = min(self.gateways, key=lambda g: self._stats[g].open_until)
+                return [gw]
+        return [gw for _, _, gw in sorted(closed)] + half[:1]
+
+    def _claim(self, gw: str) -> bool:
+        """Called when a request is actually issued: a half-open gateway takes one trial at a time."""
+        with self._lock:
+            st = self._stats[gw]
+            if st.state(time.time()) != "half-open":
+                return True
+            if st.trial_inflight:
+                return False
+            st.trial_inflight = True
+            return True
+
+    def _record(self, gw: str, ok: bool, latency: float):
+        with self._lock:
+            st = self._stats[gw]
+            st.trial_inflight = False
+            if ok:
+                st.ok += 1
+                st.fails = 0
+                st.open_until = 0.0
+                st.lat.append(latency)
+            else:
+                st.err += 1
+                st.fails += 1
+                if st.fails >= CB_FAILURES:
+                    st.open_until = time.time() + CB_COOLDOWN_SEC
+                    print(f"[GW] {self.name}: circuit OPEN for {gw} ({st.fails} fails, {CB_COOLDOWN_SEC:.0f}s)", flush=True)
+
+    def _timed(self, gw: str, fn):
+        t0 = time.time()
+        try:
+            res = fn(gw)
+        except Exception:
+            self._record(gw, False, time.time() - t0)
+            raise
+        self._record(gw, True, time.time() - t0)
+        return res
+
+    # ---- call ----
+    def call(self, fn):
+        order = self._order()
+        if not order:
+            raise RuntimeError(f"{self.name}: no gateways configured")
+        pending = {}
+        state = {"next": 0, "last_gw": None}
+        last_err = None
+
+        def launch():
+            """Issue the next ordered gateway that may take a request now; False if none is left."""
+            while state["next"] < len(order):
+                gw = order[state["next"]]
+                state["next"] += 1
+                if not self._claim(gw):
+                    continue   # another call is running this half-open gateway's trial
+                state["last_gw"] = gw
+                # copy the caller's context so the retry budget follows into the worker thread
+                pending[_EXEC.submit(contextvars.copy_context().run, self._timed, gw, fn)] = gw
+                return True
+            return False
+
+        with retry_budget():
+            if not launch():
+                raise RuntimeError(f"{self.name}: no gateway available")
+            while pending:
+                more = state["next"] < len(order)
+                timeout = self.hedge_delay(state["last_gw"]) if more else None
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    slow = state["last_gw"]
+                    if launch():
+                        with self._lock:
+                            self._stats[slow].hedged += 1
+                        print(f"[GW] {self.name}: hedging {slow} after {timeout:.2f}s -> {state['last_gw']}", flush=True)
+                    continue
+                for f in done:
+                    gw = pending.pop(f)
+                    try:
+                        res = f.result()
+                    except Exception as e:
+                        last_err = e
+                        print(f"[GW] {self.name}: {gw} failed: {e}", flush=True)
+                        if state["next"] < len(order) and not pending and take_retry():
+                            launch()
+                        continue
+                    with self._lock:
+                        self._stats[gw].won += 1
+                    return res
+        raise RuntimeError(f"{self.name}: all gateways failed: {last_err}")
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {gw: {"state": st.state(now), "p50": st.percentile(0.5), "p95": st.percentile(0.95),
+                         "ok": st.ok, "err": st.err, "hedged": st.hedged, "won": st.won}
+                    for gw, st in self._stats.items()}
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(name: str, gateways) -> GatewayPool:
+    gateways = list(gateways)
+    with _POOLS_LOCK:
+        p = _POOLS.get(name)
+        if p is None or p.gateways != [g for g in gateways if g]:
+            p = _POOLS[name] = GatewayPool(name, gateways)
+        return p
+
+def format_stats() -> str:
+    lines = []
+    for name, p in list(_POOLS.items()):
+        for gw, st in p.stats().items():
+            p95 = f"{st['p95']:.2f}s" if st["p95"] is not None else "-"
+            lines.append(f"{name} {gw}: {st['state']} p95={p95} ok={st['ok']} err={st['err']} hedged={st['hedged']} won={st['won']}")
+    return "\n".join(lines) or "no gateway calls yet"
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide pooled HTTP sessions, one per purpose:
+    scrape    — AliExpress / DuckDuckGo HTML pages
+    ae_api    — AliExpress / TOP gateways (JSON APIs)
+    tg_media  — downloading product images/videos before Telegram upload
+
+All sessions share one retry policy, one cookie jar (AliExpress locale cookie
+pre-set) and the AE_* proxy env. Connection reuse is visible via pool_stats().
+Every request passes the per-host token bucket in ae_ratelimit; 429s are
+handled there (wait for Retry-After, then resend) instead of urllib3 backoff.
+Response latencies feed ae_timeouts (adaptive per-host timeouts) and every
+retry is drawn from the calling operation's retry budget.
+"""
+import os, time, threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from ae_ratelimit import LIMITER
+import ae_timeouts
+from ae_proxies import PROXIES, BAD_STATUS
+from ae_timeouts import BudgetRetry
+
+PURPOSES = ("scrape", "ae_api", "tg_media")
+
+# per-purpose (pool_connections = distinct hosts kept, pool_maxsize = keep-alive sockets per host)
+_POOL_DEFAULTS = {
+    "scrape":   (16, 16),
+    "ae_api":   (4, 8),
+    "tg_media": (8, 8),
+}
+
+_DEFAULT_HEADERS = {
+    "scrape": {
+        "User-Agent": os.getenv("AE_UA", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"),
+        "Accept-Language": os.getenv("AE_ACCEPT_LANG", "he-IL,he;q=0.9,en-US;q=0.8,en;q=0.7"),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        # explicit: gzip/deflate, plus br/zstd when urllib3 has the decoders installed
+        "Accept-Encoding": os.getenv("SCRAPE_ACCEPT_ENCODING", ACCEPT_ENCODING),
+    },
+    "ae_api": {
+        "User-Agent": os.getenv("AE_API_UA", "TelegramPostBot/1.0"),
+        "Cache-Control": "no-cache",
+    },
+    "tg_media": {
+        "User-Agent": "TelegramPostBot/1.0",
+    },
+}
+
+LOCALE_COOKIE = os.getenv("AE_LOCALE_COOKIE", "x_lan=he_IL&x_locale=he_IL&region=IL&b_locale=he_IL")
+
+_LOCK = threading.Lock()
+_SESSIONS = {}
+COOKIE_JAR = requests.cookies.RequestsCookieJar()
+COOKIE_JAR.set("xman_us_f", LOCALE_COOKIE, domain=".aliexpress.com", path="/")
+COOKIE_JAR.set("xman_us_f", LOCALE_COOKIE, domain=".aliexpress.us", path="/")
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+def shared_retry() -> BudgetRetry:
+    total = _env_int("AE_RETRY_TOTAL", 2)
+    # 429 is left to the rate limiter (see CountingAdapter.send)
+    status = [int(x) for x in (os.getenv("AE_RETRY_STATUS", "500,502,503,504").split(",")) if x.strip().isdigit()]
+    return BudgetRetry(total=total, connect=total, read=total,
+                 backoff_factor=float(os.getenv("AE_RETRY_BACKOFF", "1.2")),
+                 status_forcelist=status, allowed_methods=frozenset(["GET", "POST"]),
+                 respect_retry_after_header=True)
+
+def env_proxies() -> dict:
+    http_proxy = os.getenv("AE_HTTP_PROXY") or os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
+    https_proxy = os.getenv("AE_HTTPS_PROXY") or os.getenv("HTTPS_PROXY") or os.getenv("https_proxy") or http_proxy
+    proxies = {}
+    if http_proxy: proxies["http"] = http_proxy
+    if https_proxy: proxies["https"] = https_proxy
+    return proxies
+
+RATE_429_RETRIES = _env_int("RATE_429_RETRIES", 3)
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts requests so pool_stats() can report connection reuse,
+    and gates every send through the shared per-host rate limiter.
+    """
+    def __init__(self, *a, proxy_pool=None, **kw):
+        self.sent = 0
+        self.proxy_pool = proxy_pool   # ae_proxies.ProxyPool: per-request proxy choice
+        self._count_lock = threading.Lock()
+        super().__init__(*a, **kw)
+
+    def send(self, request, **kw):
+        with self._count_lock:
+            self.sent += 1
+        attempt = 0
+        pool = self.proxy_pool
+        while True:
+            LIMITER.acquire(request.url)
+            proxy = pool.choose(request.url) if pool else None
+            if proxy:
+                kw["proxies"] = pool.as_requests(proxy)
+            t0 = time.monotonic()
+            try:
+                resp = super().send(request, **kw)
+            except (requests.ConnectionError, requests.Timeout):
+                ae_timeouts.record(request.url, ok=False)  # dead/unreachable, not merely erroring
+                if proxy: pool.report(proxy, request.url, ok=False)
+                raise
+            except Exception:
+                if proxy: pool.report(proxy, request.url, ok=False)
+                raise
+            latency = time.monotonic() - t0
+            ae_timeouts.record(request.url, latency)
+            if proxy:
+                pool.report(proxy, request.url, ok=resp.status_code not in BAD_STATUS, latency=latency)
+                resp.proxy_used = proxy
+            LIMITER.feedback(request.url, resp.status_code, resp.headers.get("Retry-After"))
+            if resp.status_code != 429 or attempt >= RATE_429_RETRIES or not ae_timeouts.take_retry():
+                return resp
+            attempt += 1
+            resp.close()
+
+    def stats(self) -> dict:
+        pools = self.poolmanager.pools
+        conns = reqs = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            conns += getattr(pool, "num_connections", 0)
+            reqs += getattr(pool, "num_requests", 0)
+        return {"sent": self.sent, "wire_requests": reqs, "new_connections": conns,
+                "reuse_ratio": round(1 - conns / reqs, 3) if reqs else 0.0, "host_pools": len(pools)}
+
+def _build(purpose: str) -> requests.Session:
+    conns, maxsize = _POOL_DEFAULTS.get(purpose, (10, 10))
+    up = purpose.upper()
+    conns = _env_int(f"HTTP_POOL_CONNECTIONS_{up}", conns)
+    maxsize = _env_int(f"HTTP_POOL_MAXSIZE_{up}", maxsize)
+    s = requests.Session()
+    use_pool = purpose in ("scrape", "ae_api") and bool(PROXIES)
+    ad = CountingAdapter(max_retries=shared_retry(), pool_connections=conns, pool_maxsize=maxsize,
+                         proxy_pool=PROXIES if use_pool else None)
+    s.mount("https://", ad); s.mount("http://", ad)
+    s.cookies = COOKIE_JAR
+    s.headers.update(_DEFAULT_HEADERS.get(purpose, {}))
+    if use_pool:
+        print(f"[HTTP][PROXY] {purpose}: pool of {len(PROXIES.proxies)} proxies", flush=True)
+    elif purpose in ("scrape", "ae_api"):
+        proxies = env_proxies()
+        if proxies:
+            s.proxies.update(proxies)
+            print(f"[HTTP][PROXY] {purpose}: http={'ON' if 'http' in proxies else 'OFF'} https={'ON' if 'https' in proxies else 'OFF'}", flush=True)
+    print(f"[HTTP] session '{purpose}' ready (pools={conns}, maxsize={maxsize})", flush=True)
+    return s
+
+def get_session(purpose: str = "scrape") -> requests.Session:
+    s = _SESSIONS.get(purpose)
+    if s is not None:
+        return s
+    with _LOCK:
+        s = _SESSIONS.get(purpose)
+        if s is None:
+            s = _SESSIONS[purpose] = _build(purpose)
+        return s
+
+def pool_stats() -> dict:
+    out = {}
+    for purpose, s in list(_SESSIONS.items()):
+        ad = s.get_adapter("https://")
+        out[purpose] = ad.stats() if isinstance(ad, CountingAdapter) else {}
+    return out
+
+def format_pool_stats() -> str:
+    lines = []
+    for purpose, st in pool_stats().items():
+        lines.append(f"{purpose}: sent={st.get('sent',0)} wire={st.get('wire_requests',0)} "
+                     f"new_conns={st.get('new_connections',0)} reuse={st.get('reuse_ratio',0.0):.0%}")
+    return "\n".join(lines) or "no sessions yet"
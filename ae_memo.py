@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Short-lived response memo + single-flight for AE API calls.
+
+memoized(scope, method, params, fn) keys the call on scope (endpoint / app),
+method and the business params — timestamp and sign are left out, they change
+on every call. A fresh answer (AE_MEMO_TTL_SEC, default 60s) is returned
+without touching the network; while one call for a key is in flight, identical
+concurrent calls wait for it and share its result or its exception.
+Exceptions and gateway error envelopes are never stored. AE_MEMO_TTL_SEC=0
+turns memoization off (single-flight stays on).
+"""
+import os, json, copy, time, threading
+from collections import OrderedDict
+
+MEMO_TTL_SEC = float(os.getenv("AE_MEMO_TTL_SEC", "60"))
+MEMO_MAX = int(os.getenv("AE_MEMO_MAX", "2000"))
+VOLATILE = ("timestamp", "sign")
+
+def memo_key(scope: str, method: str, params: dict) -> str:
+    biz = {k: v for k, v in (params or {}).items() if k not in VOLATILE}
+    return json.dumps([scope, method, biz], sort_keys=True, ensure_ascii=False, default=str)
+
+def _cacheable(value) -> bool:
+    return not (isinstance(value, dict) and "error_response" in value)
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class Memo:
+    def __init__(self, ttl: float = MEMO_TTL_SEC, max_entries: int = MEMO_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._d = OrderedDict()      # key -> (stored_at, value)
+        self._inflight = {}          # key -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def call(self, key: str, fn, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            ent = self._d.get(key)
+            if ent is not None and now - ent[0] <= ttl:
+                self._d.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(ent[1])   # callers may mutate what they get
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.value)
+        try:
+            flight.value = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None and ttl > 0 and _cacheable(flight.value):
+                    self._d[key] = (time.monotonic(), flight.value)
+                    self._d.move_to_end(key)
+                    while len(self._d) > self.max_entries:
+                        self._d.popitem(last=False)
+            flight.done.set()
+        return copy.deepcopy(flight.value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                    "entries": len(self._d), "inflight": len(self._inflight)}
+
+MEMO = Memo()
+
+def memoized(scope: str, method: str, params: dict, fn, ttl: float = None):
+    return MEMO.call(memo_key(scope, method, params), fn, ttl)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+CPU-heavy parsing of AliExpress search pages, optionally offloaded to a
+process pool so regex scans and multi-hundred-KB json.loads don't hold the
+GIL of the process serving the webhook / poster loop.
+
+    PARSE_POOL_WORKERS=0      -> always parse inline (default)
+    PARSE_POOL_WORKERS=N      -> N worker processes for bodies >= PARSE_INLINE_MAX_KB
+    PARSE_POOL_START=forkserver|spawn|fork
+
+Workers get raw response bytes and return compact lists (links / items),
+so only small results cross the process boundary. Keep this module free of
+heavy imports: it is what worker processes load. With spawn / forkserver the
+workers (the fork server, for forkserver) also re-import the entry script as
+__mp_main__, so entry scripts keep their module-level side effects guarded
+(see main.PARSE_WORKER).
+"""
+import os, re, json, hashlib, threading
+
+PARSE_POOL_WORKERS = int(os.getenv("PARSE_POOL_WORKERS", "0") or "0")
+PARSE_INLINE_MAX_KB = int(os.getenv("PARSE_INLINE_MAX_KB", "96") or "96")
+PARSE_POOL_START = os.getenv("PARSE_POOL_START", "forkserver" if os.name == "posix" else "spawn")
+
+def _decode(raw, encoding=None) -> str:
+    if isinstance(raw, str):
+        return raw
+    return raw.decode(encoding or "utf-8", errors="replace")
+
+# ---- search page -> item links ----
+# Accept any xx.aliexpress.(com|us|...)/item/....html and also protocol-relative links
+_ITEM_RE = re.compile(r'(?:https?:)?//[a-z\-]*\.?aliexpress\.(?:com|us)/item/[^\s"<>]*?(\d{8,})\.html[^\s"<>]*', re.I)
+_MOBILE_HREF_RE = re.compile(r'href=["\'](/item/(\d{8,})\.html)["\']')
+_DATA_HREF_RE = re.compile(r'data-href=["\'](//[^"\']*?/item/(\d{8,})\.html[^"\']*)["\']')
+_PRODUCT_ID_RE = re.compile(r'["\']productId["\']\s*:\s*["\'](\d{8,})["\']')
+
+def item_links(raw, encoding=None):
+    html = _decode(raw, encoding)
+    out, seen = [], set()
+    # Normal absolute or protocol-relative item URLs
+    for m in _ITEM_RE.finditer(html):
+        url, pid = m.group(0), m.group(1)
+        if url.startswith("//"):
+            url = "https:" + url
+        if url in seen:
+            continue
+        seen.add(url)
+        out.append({"id": pid, "url": url})
+    # Mobile relative hrefs
+    for m in _MOBILE_HREF_RE.finditer(html):
+        pid = m.group(2); url = f"https://m.aliexpress.com/item/{pid}.html"
+        if url in seen: continue
+        seen.add(url); out.append({"id": pid, "url": url})
+    # data-href attributes commonly used in grid items
+    for m in _DATA_HREF_RE.finditer(html):
+        url, pid = m.group(1), m.group(2)
+        if url.startswith("//"): url = "https:" + url
+        if url in seen: continue
+        seen.add(url); out.append({"id": pid, "url": url})
+    # productId JSON — reconstruct URL
+    for m in _PRODUCT_ID_RE.finditer(html):
+        pid = m.group(1); url = f"https://www.aliexpress.com/item/{pid}.html"
+        if url in seen: continue
+        seen.add(url); out.append({"id": pid, "url": url})
+    return out
+
+# ---- search page -> embedded product JSON (runParams / __AER_DATA__) ----
+_EMBEDDED_RES = [re.compile(r"window\.__AER_DATA__\s*=\s*(\{.*?\});", re.S),
+                 re.compile(r"window\.runParams\s*=\s*(\{.*?\});", re.S)]
+_ANCHOR_RE = re.compile(r'href="(https://www\.aliexpress\.com/item/[^"]+)"[^>]*>([^<]{10,120})</a>')
+_URL_ID_RE = re.compile(r'/item/(?:[^/"?]*?)(\d{8,})\.html')
+
+def _anchor_id(url: str) -> str:
+    """Product id from the URL; otherwise a digest that is the same in every process (hash() is salted)."""
+    m = _URL_ID_RE.search(url)
+    return m.group(1) if m else str(int(hashlib.sha1(url.encode("utf-8")).hexdigest()[:15], 16))
+
+def extract_items_from_json(obj):
+    found=[]
+    def rec(o):
+        if isinstance(o, dict):
+            id_key=None
+            for k in ["productId","product_id","itemId","item_id","id"]:
+                if k in o: id_key=k; break
+            title = o.get("title") or o.get("productTitle") or o.get("product_title")
+            url = o.get("productDetailUrl") or o.get("product_detail_url") or o.get("productUrl") or o.get("url")
+            img = o.get("image") or o.get("imageUrl") or o.get("productMainImageUrl") or o.get("product_main_image_url") or ""
+            price = o.get("appSalePrice") or o.get("salePrice") or o.get("price") or ""
+            cur = o.get("currency") or o.get("currencyCode") or os.getenv("BOT_CURRENCY","ILS")
+            if id_key and title and url:
+                found.append({"ItemId": str(o[id_key]), "Title": title, "Price": price, "Currency": cur, "Url": url, "Image": img, "Category": ""})
+            for v in o.values(): rec(v)
+        elif isinstance(o, list):
+            for it in o: rec(it)
+    rec(obj)
+    uniq={}
+    for it in found: uniq[it["ItemId"]]=it
+    return list(uniq.values())
+
+def embedded_items(raw, encoding=None, limit=None):
+    """Items from the page's embedded JSON (falls back to anchor scraping); deduped, capped at limit."""
+    html = _decode(raw, encoding)
+    items=[]
+    for rx in _EMBEDDED_RES:
+        m=rx.search(html)
+        if not m: continue
+        blob=m.group(1).strip().rstrip(";")
+        try:
+            items.extend(extract_items_from_json(json.loads(blob)))
+        except Exception:
+            continue
+    if not items:
+        for m in _ANCHOR_RE.finditer(html):
+            url, title = m.group(1), m.group(2).strip()
+            items.append({"ItemId": _anchor_id(url), "Title": title, "Price":"", "Currency": os.getenv("BOT_CURRENCY","ILS"), "Url": url, "Image":"", "Category":""})
+    seen=set(); out=[]
+    for it in items:
+        pid=it.get("ItemId"); title=it.get("Title"); url=it.get("Url")
+        if not pid or not title or not url: continue
+        if pid in seen: continue
+        seen.add(pid); out.append(it)
+        if limit and len(out)>=limit: break
+    return out
+
+# ---- dispatch ----
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            ctx = multiprocessing.get_context(PARSE_POOL_START)
+            if PARSE_POOL_START == "forkserver":
+                # ae_parse is loaded once in the server and inherited by every forked worker;
+                # the entry script is still imported there as __mp_main__ (its side effects are guarded)
+                ctx.set_forkserver_preload(["ae_parse"])
+            _POOL = ProcessPoolExecutor(max_workers=PARSE_POOL_WORKERS, mp_context=ctx)
+            print(f"[PARSE] process pool started ({PARSE_POOL_WORKERS} workers, {PARSE_POOL_START})", flush=True)
+        return _POOL
+
+def _reset_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+def parse(fn, raw, encoding=None, **kw):
+    """Run fn(raw, encoding, **kw) inline for small bodies / disabled pool, otherwise in a worker process."""
+    if PARSE_POOL_WORKERS <= 0 or len(raw) < PARSE_INLINE_MAX_KB * 1024:
+        return fn(raw, encoding, **kw)
+    try:
+        return _pool().submit(fn, raw, encoding, **kw).result()
+    except Exception as e:
+        # broken/unavailable pool: parse inline rather than lose the page
+        print(f"[PARSE][WARN] pool failed ({e}); parsing inline", flush=True)
+        if e.__class__.__name__ == "BrokenProcessPool":
+            _reset_pool()
+        return fn(raw, encoding, **kw)
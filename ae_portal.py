@@ -1,12 +1,16 @@
 
 # -*- coding: utf-8 -*-
 # AliExpress Open Platform (Portal) Gateway adapter — TOP protocol (MD5 signature)
-import os, time, json, hashlib, requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import os, time, json, hashlib
 from datetime import datetime
+from ae_http import get_session
+from ae_gateways import get_pool
+from ae_timeouts import timeout_for
+from ae_memo import memoized
 
 GATEWAY = os.getenv("AE_GATEWAY_URL", "https://gw.api.taobao.com/router/rest")
+# Extra gateways for hedging/failover (comma separated); GATEWAY stays first
+GATEWAYS = list(dict.fromkeys([GATEWAY] + [g.strip() for g in (os.getenv("AE_GATEWAY_LIST") or "").split(",") if g.strip()]))
 APP_KEY = os.getenv("AE_APP_KEY") or os.getenv("AE_API_APP_KEY") or ""
 APP_SECRET = os.getenv("AE_APP_SECRET") or os.getenv("AE_API_APP_SECRET") or ""
 TRACKING_ID = os.getenv("AE_TRACKING_ID", "")
@@ -29,6 +33,11 @@ def _call(method: str, biz_params: dict) -> dict:
     if not APP_KEY or not APP_SECRET:
         raise RuntimeError("חסרים AE_APP_KEY / AE_APP_SECRET ב־ENV")
 
+    flat = {k: ("" if v is None else v) for k, v in biz_params.items()}
+    # identical calls within AE_MEMO_TTL_SEC (or in flight) share one gateway round-trip
+    return memoized(APP_KEY, method, flat, lambda: _send(method, flat))
+
+def _send(method: str, flat: dict) -> dict:
     p = {
         "app_key": APP_KEY,
         "method": method,
@@ -37,20 +46,23 @@ def _call(method: str, biz_params: dict) -> dict:
         "v": "2.0",
         "timestamp": _timestamp(),
     }
-    flat = {k: ("" if v is None else v) for k, v in biz_params.items()}
     payload = {**p, **flat}
     payload["sign"] = _sign(payload, APP_SECRET)
     sess = _make_session()
 
-    try:
-        r = sess.post(GATEWAY, data=payload, timeout=(float(os.getenv('AE_CONNECT_TIMEOUT','15')), float(os.getenv('AE_READ_TIMEOUT','25'))))
-        r.raise_for_status()
-        data = r.json()
-    except ValueError:
-        preview = (r.text or "")[:400].replace("\n", " ")
-        raise RuntimeError(f"לא הצלחתי לקרוא JSON מה־Gateway (preview={preview})")
-    except Exception as e:
-        raise RuntimeError(f"שגיאת רשת/HTTP בקריאה ל־Gateway: {e}")
+    def post_to(gw):
+        try:
+            r = sess.post(gw, data=payload, timeout=timeout_for(gw, (float(os.getenv('AE_CONNECT_TIMEOUT','15')), float(os.getenv('AE_READ_TIMEOUT','25')))))
+            r.raise_for_status()
+        except Exception as e:
+            raise RuntimeError(f"שגיאת רשת/HTTP בקריאה ל־Gateway: {e}")
+        try:
+            return r.json()
+        except ValueError:
+            preview = (r.text or "")[:400].replace("\n", " ")
+            raise RuntimeError(f"לא הצלחתי לקרוא JSON מה־Gateway (preview={preview})")
+
+    data = get_pool("ae_portal", GATEWAYS).call(post_to)
 
     if isinstance(data, dict) and "error_response" in data:
         err = data["error_response"]
@@ -115,24 +127,5 @@ def affiliate_product_query_by_category(category_id: str, page_no=1, page_size=1
 
 
 def _make_session():
-    s = requests.Session()
-    # Retries with backoff
-    total = int(os.getenv("AE_RETRY_TOTAL", "3"))
-    backoff = float(os.getenv("AE_RETRY_BACKOFF", "1.5"))
-    status = [int(x) for x in (os.getenv("AE_RETRY_STATUS", "429,500,502,503,504").split(",")) if x.strip().isdigit()]
-    retry = Retry(total=total, connect=total, read=total, backoff_factor=backoff,
-                  status_forcelist=status, allowed_methods=frozenset(["GET","POST"]))
-    adapter = HTTPAdapter(max_retries=retry)
-    s.mount("https://", adapter)
-    s.mount("http://", adapter)
-
-    # Proxies (prefer AE_* then standard env)
-    http_proxy = os.getenv("AE_HTTP_PROXY") or os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
-    https_proxy = os.getenv("AE_HTTPS_PROXY") or os.getenv("HTTPS_PROXY") or os.getenv("https_proxy") or http_proxy
-    proxies = {}
-    if http_proxy: proxies["http"] = http_proxy
-    if https_proxy: proxies["https"] = https_proxy
-    if proxies:
-        s.proxies.update(proxies)
-        print(f"[AE][PROXY] Using proxies: http={'ON' if 'http' in proxies else 'OFF'} https={'ON' if 'https' in proxies else 'OFF'}", flush=True)
-    return s
+    # Shared pooled session: retries/backoff (AE_RETRY_*) and proxies (AE_*_PROXY) are set up in ae_http
+    return get_session("ae_api")
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Health-scored proxy pool for the scrape / ae_api sessions.
+
+Proxies come from PROXY_FILE (one URL per line, # comments) and/or
+PROXY_LIST (comma separated). The token "direct" means no proxy.
+Health is tracked per (proxy, host): a success EWMA and a latency EWMA.
+Each request picks a proxy at random weighted by
+    success^2 / (1 + latency) / (1 + in-flight)
+so concurrent discovery workers spread out and slow / blocked proxies get
+less traffic. PROXY_QUARANTINE_FAILS consecutive failures (network error,
+403/407/429, captcha page) quarantine the proxy for that host with
+exponential backoff from PROXY_BACKOFF_SEC up to PROXY_BACKOFF_MAX_SEC.
+An empty pool leaves the static AE_HTTPS_PROXY / HTTPS_PROXY behaviour alone.
+"""
+import os, time, random, threading
+from urllib.parse import urlparse
+
+QUARANTINE_FAILS = int(os.getenv("PROXY_QUARANTINE_FAILS", "3"))
+BACKOFF_SEC = float(os.getenv("PROXY_BACKOFF_SEC", "30"))
+BACKOFF_MAX_SEC = float(os.getenv("PROXY_BACKOFF_MAX_SEC", "600"))
+ALPHA = 0.2  # EWMA weight of the newest sample
+BAD_STATUS = (403, 407, 429)
+
+def load_proxies(path: str = None, env: str = None) -> list:
+    out = []
+    path = path if path is not None else os.getenv("PROXY_FILE", "")
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            out += [ln.split("#", 1)[0].strip() for ln in f]
+    env = env if env is not None else os.getenv("PROXY_LIST", "")
+    out += [p.strip() for p in env.split(",")]
+    seen, uniq = set(), []
+    for p in out:
+        if p and p not in seen:
+            seen.add(p); uniq.append(p)
+    return uniq
+
+class ProxyHealth:
+    def __init__(self):
+        self.success = 0.7      # optimistic start so new proxies get tried
+        self.latency = 1.0
+        self.fails = 0          # consecutive
+        self.quarantines = 0
+        self.until = 0.0
+        self.ok = 0
+        self.err = 0
+
+class ProxyPool:
+    def __init__(self, proxies):
+        self.proxies = list(proxies)
+        self._health = {}       # (proxy, host) -> ProxyHealth
+        self._inflight = {p: 0 for p in self.proxies}
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.proxies)
+
+    def _h(self, proxy, host) -> ProxyHealth:
+        h = self._health.get((proxy, host))
+        if h is None:
+            h = self._health[(proxy, host)] = ProxyHealth()
+        return h
+
+    def choose(self, url: str) -> str:
+        host = (urlparse(url).hostname or "").lower()
+        now = time.time()
+        with self._lock:
+            live, weights = [], []
+            for p in self.proxies:
+                h = self._h(p, host)
+                if h.until > now:
+                    continue
+                live.append(p)
+                weights.append(max(0.01, h.success) ** 2 / (1 + h.latency) / (1 + self._inflight[p]))
+            if live:
+                p = random.choices(live, weights=weights)[0]
+            else:
+                # all quarantined for this host: use the one released soonest
+                p = min(self.proxies, key=lambda x: self._h(x, host).until)
+            self._inflight[p] += 1
+            return p
+
+    def report(self, proxy: str, url: str, ok: bool, latency: float = None, release: bool = True):
+        host = (urlparse(url).hostname or "").lower()
+        with self._lock:
+            if release:
+                self._inflight[proxy] = max(0, self._inflight.get(proxy, 0) - 1)
+            h = self._h(proxy, host)
+            h.success = (1 - ALPHA) * h.success + ALPHA * (1.0 if ok else 0.0)
+            if latency is not None:
+                h.latency = (1 - ALPHA) * h.latency + ALPHA * latency
+            if ok:
+                h.ok += 1
+                h.fails = 0
+                h.quarantines = 0
+                h.until = 0.0
+                return
+            h.err += 1
+            h.fails += 1
+            if h.fails >= QUARANTINE_FAILS:
+                h.quarantines += 1
+                h.fails = 0
+                h.until = time.time() + min(BACKOFF_MAX_SEC, BACKOFF_SEC * 2 ** (h.quarantines - 1))
+                print(f"[PROXY] quarantine {_label(proxy)} for {host} ({h.until - time.time():.0f}s)", flush=True)
+
+    def penalize(self, proxy: str, url: str):
+        """Late failure signal (e.g. captcha page found after the response came back)."""
+        self.report(proxy, url, ok=False, release=False)
+
+    @staticmethod
+    def as_requests(proxy: str) -> dict:
+        if proxy == "direct":
+            return {}
+        return {"http": proxy, "https": proxy}
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {f"{_label(p)} {host}": {"success": round(h.success, 2), "latency": round(h.latency, 2),
+                                            "ok": h.ok, "err": h.err,
+                                            "quarantined": max(0, round(h.until - now))}
+                    for (p, host), h in self._health.items()}
+
+    def format_stats(self) -> str:
+        lines = []
+        for key, st in sorted(self.stats().items()):
+            q = f" Q{st['quarantined']}s" if st["quarantined"] else ""
+            lines.append(f"{key}: ok={st['ok']} err={st['err']} succ={st['success']} lat={st['latency']}s{q}")
+        return "\n".join(lines) or ("no proxy traffic yet" if self.proxies else "no proxy pool")
+
+def _label(proxy: str) -> str:
+    # never print credentials
+    if proxy == "direct":
+        return proxy
+    p = urlparse(proxy)
+    return f"{p.hostname}:{p.port}" if p.hostname else proxy
+
+PROXIES = ProxyPool(load_proxies())
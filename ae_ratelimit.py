@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Per-host token-bucket rate limiter shared by every outbound caller.
+
+Rules come from RATE_LIMITS ("host=rate/burst,..." — rate in requests/sec),
+matched by the longest host suffix (api-sg.aliexpress.com beats aliexpress.com).
+Callers reserve a slot in arrival order (FIFO) and sleep until it is due.
+A 429 halves the bucket's rate and blocks it for Retry-After; successes
+recover the rate additively back to the configured value.
+Hosts without a rule are not limited.
+"""
+import os, time, threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+DEFAULT_RULES = (
+    "aliexpress.com=3/6,aliexpress.us=2/4,duckduckgo.com=0.5/2,"
+    "api-sg.aliexpress.com=5/10,gw.api.taobao.com=5/10,eco.taobao.com=5/10"
+)
+MIN_RATE = 0.05          # never throttle a bucket below 1 request / 20 s
+DEFAULT_PENALTY_SEC = 2.0  # 429 without Retry-After
+
+def parse_retry_after(value) -> float:
+    """Retry-After as seconds (delta-seconds or HTTP date). Unparseable -> 0."""
+    if value is None:
+        return 0.0
+    s = str(value).strip()
+    try:
+        return max(0.0, float(s))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(s).timestamp() - time.time())
+    except Exception:
+        return 0.0
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.ts = time.monotonic()
+        self.blocked_until = 0.0
+        self.waited = 0.0
+        self.acquired = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def reserve(self) -> float:
+        """Take one token (possibly going negative = queued) and return seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            self.acquired += 1
+            wait = (-self.tokens / self.rate) if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        slept = 0.0
+        while wait > 0:
+            time.sleep(wait)
+            slept += wait
+            with self._lock:
+                wait = self.blocked_until - time.monotonic()  # a 429 may have arrived while we slept
+        if slept:
+            with self._lock:
+                self.waited += slept
+        return slept
+
+    def penalize(self, retry_after: float):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.blocked_until = max(self.blocked_until, now + (retry_after or DEFAULT_PENALTY_SEC))
+            self.tokens = min(self.tokens, 0.0)
+
+    def reward(self):
+        if self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rate": round(self.rate, 3), "base_rate": self.base_rate, "burst": self.burst,
+                    "acquired": self.acquired, "throttled": self.throttled, "waited_sec": round(self.waited, 1)}
+
+class HostRateLimiter:
+    def __init__(self, rules: str = ""):
+        self._rules = {}     # host suffix -> (rate, burst)
+        self._buckets = {}   # host suffix -> TokenBucket
+        self._lock = threading.Lock()
+        self.load_rules(rules)
+
+    def load_rules(self, rules: str):
+        for part in (rules or "").split(","):
+            if "=" not in part:
+                continue
+            host, spec = part.split("=", 1)
+            rate, _, burst = spec.partition("/")
+            try:
+                self.configure(host.strip().lower(), float(rate), float(burst or rate or 1))
+            except ValueError:
+                print(f"[RATE][WARN] bad rule '{part}'", flush=True)
+
+    def configure(self, host: str, rate: float, burst: float = None):
+        host = (urlparse(host).hostname or host) if "://" in host else host
+        with self._lock:
+            self._rules[host] = (rate, burst or max(1.0, rate))
+            self._buckets.pop(host, None)
+
+    def _rule_for(self, url: str):
+        host = (urlparse(url).hostname or "").lower()
+        best = None
+        for suffix in self._rules:
+            if host == suffix or host.endswith("." + suffix):
+                if best is None or len(suffix) > len(best):
+                    best = suffix
+        return best
+
+    def bucket(self, url: str):
+        key = self._rule_for(url)
+        if key is None:
+            return None
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                rate, burst = self._rules[key]
+                b = self._buckets[key] = TokenBucket(rate, burst)
+            return b
+
+    def acquire(self, url: str) -> float:
+        b = self.bucket(url)
+        return b.acquire() if b else 0.0
+
+    def feedback(self, url: str, status: int, retry_after=None):
+        b = self.bucket(url)
+        if b is None:
+            return
+        if status == 429 or (status == 503 and retry_after):
+            ra = parse_retry_after(retry_after)
+            b.penalize(ra)
+            print(f"[RATE] {status} from {urlparse(url).hostname} -> rate {b.rate:.2f}/s, pause {ra or DEFAULT_PENALTY_SEC:.1f}s", flush=True)
+        elif status < 400:
+            b.reward()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {k: b.stats() for k, b in self._buckets.items()}
+
+    def format_stats(self) -> str:
+        lines = []
+        for host, st in self.stats().items():
+            lines.append(f"{host}: {st['rate']}/{st['base_rate']} rps, acquired={st['acquired']} "
+                         f"429s={st['throttled']} waited={st['waited_sec']}s")
+        return "\n".join(lines) or "no limited hosts hit yet"
+
+LIMITER = HostRateLimiter(DEFAULT_RULES)
+LIMITER.load_rules(os.getenv("RATE_LIMITS", ""))  # env overrides / adds hosts
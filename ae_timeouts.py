@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Latency-adaptive per-host timeouts and per-operation retry budgets.
+
+timeout_for(url, default) turns the caller's hard-coded timeout into one
+derived from that host's recent time-to-response: read = p95 * TIMEOUT_P95_MULT
+clamped to [TIMEOUT_FLOOR_SEC, TIMEOUT_CEIL_SEC]. Until TIMEOUT_MIN_SAMPLES
+responses are seen the default is used; after TIMEOUT_DEAD_AFTER consecutive
+network failures the host gets the floor (fail fast) until it answers again.
+Every TIMEOUT_PROBE_SEC one call to a "dead" host is let through with the
+full adaptive timeout, so a host that is slow but alive can recover.
+ae_http's adapter feeds every response / failure in via record().
+
+retry_budget(n) opens a budget for one top-level operation. Every retry
+below it — urllib3 retries (BudgetRetry), 429 resends, gateway fail-over —
+draws from the same counter, so nested layers can't multiply attempts.
+Nested retry_budget() calls reuse the outer budget.
+"""
+import os, time, threading, contextvars
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError, ResponseError
+
+TIMEOUT_FLOOR_SEC = float(os.getenv("TIMEOUT_FLOOR_SEC", "3"))
+TIMEOUT_CEIL_SEC = float(os.getenv("TIMEOUT_CEIL_SEC", "30"))
+TIMEOUT_P95_MULT = float(os.getenv("TIMEOUT_P95_MULT", "2.5"))
+TIMEOUT_MIN_SAMPLES = int(os.getenv("TIMEOUT_MIN_SAMPLES", "5"))
+TIMEOUT_DEAD_AFTER = int(os.getenv("TIMEOUT_DEAD_AFTER", "3"))
+TIMEOUT_PROBE_SEC = float(os.getenv("TIMEOUT_PROBE_SEC", "30"))
+RETRY_BUDGET = int(os.getenv("RETRY_BUDGET", "3"))
+WINDOW = 50
+
+class HostLatency:
+    def __init__(self):
+        self.lat = deque(maxlen=WINDOW)   # seconds until response headers
+        self.fails = 0                    # consecutive network failures / timeouts
+        self.next_probe = 0.0             # monotonic time a dead host gets its next full-timeout call
+        self.ok = 0
+        self.err = 0
+
+    def p(self, q: float):
+        if not self.lat:
+            return None
+        xs = sorted(self.lat)
+        return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+_HOSTS = {}
+_LOCK = threading.Lock()
+
+def _host(url: str) -> str:
+    return (urlparse(url).hostname or url or "").lower()
+
+def _get(host: str) -> HostLatency:
+    h = _HOSTS.get(host)
+    if h is None:
+        with _LOCK:
+            h = _HOSTS.setdefault(host, HostLatency())
+    return h
+
+def record(url: str, latency: float = None, ok: bool = True):
+    h = _get(_host(url))
+    with _LOCK:
+        if ok:
+            h.ok += 1
+            h.fails = 0
+            if latency is not None:
+                h.lat.append(latency)
+        else:
+            h.err += 1
+            h.fails += 1
+            if h.fails == TIMEOUT_DEAD_AFTER:
+                h.next_probe = time.monotonic() + TIMEOUT_PROBE_SEC
+
+def _clamp(x: float) -> float:
+    return max(TIMEOUT_FLOOR_SEC, min(TIMEOUT_CEIL_SEC, x))
+
+def timeout_for(url: str, default=(10, 20), probe: bool = True):
+    """
+    (connect, read) for this host; `default` (float or tuple) until there is data.
+    probe=False only looks (stats): it never spends a dead host's probe.
+    """
+    connect, read = default if isinstance(default, tuple) else (default, default)
+    h = _get(_host(url))
+    with _LOCK:
+        if h.fails >= TIMEOUT_DEAD_AFTER:
+            now = time.monotonic()
+            if not probe or now < h.next_probe:
+                return (TIMEOUT_FLOOR_SEC, TIMEOUT_FLOOR_SEC)
+            h.next_probe = now + TIMEOUT_PROBE_SEC   # this call is the probe
+        if len(h.lat) < TIMEOUT_MIN_SAMPLES:
+            return (connect, read)
+        p95 = h.p(0.95)
+    read = _clamp(p95 * TIMEOUT_P95_MULT)
+    return (min(connect, read), read)
+
+def stats() -> dict:
+    with _LOCK:
+        return {host: {"p50": h.p(0.5), "p95": h.p(0.95), "ok": h.ok, "err": h.err, "fails": h.fails}
+                for host, h in _HOSTS.items()}
+
+def format_stats() -> str:
+    lines = []
+    for host, st in stats().items():
+        to = timeout_for(host if "://" in host else "https://" + host, probe=False)
+        p95 = f"{st['p95']:.2f}s" if st["p95"] is not None else "-"
+        lines.append(f"{host}: p95={p95} timeout={to[0]:.1f}/{to[1]:.1f}s ok={st['ok']} err={st['err']}")
+    return "\n".join(lines) or "no hosts timed yet"
+
+# ---- retry budget ----
+class RetryBudget:
+    def __init__(self, n: int):
+        self.left = int(n)
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            self.used += 1
+            return True
+
+_BUDGET = contextvars.ContextVar("retry_budget", default=None)
+
+def current_budget():
+    return _BUDGET.get()
+
+@contextmanager
+def retry_budget(n: int = None):
+    b = _BUDGET.get()
+    if b is not None:          # already inside an operation: share its budget
+        yield b
+        return
+    b = RetryBudget(RETRY_BUDGET if n is None else n)
+    token = _BUDGET.set(b)
+    try:
+        yield b
+    finally:
+        _BUDGET.reset(token)
+
+def take_retry() -> bool:
+    """Spend one retry from the current operation's budget (always allowed outside one)."""
+    b = _BUDGET.get()
+    return True if b is None else b.take()
+
+class BudgetRetry(Retry):
+    """urllib3 Retry that also draws every retry from the operation's budget."""
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if not take_retry():
+            raise MaxRetryError(_pool, url, error or ResponseError("retry budget exhausted"))
+        return super().increment(method=method, url=url, response=response, error=error,
+                                 _pool=_pool, _stacktrace=_stacktrace)
@@ -0,0 +1,197 @@
+"""
+Category warmer: one buffer of ready-to-enqueue candidates per category key,
+so a category tap can be answered from memory instead of a cold pull.
+
+A daemon thread refills a buffer (pull_fn(queries), merged with the still-fresh
+old items, up to `capacity`) when it drops below `low_water` or is older than
+`max_age_sec`. A refill that comes back short puts the key into exponential
+backoff (backoff_sec doubling to backoff_max_sec) so a dead category doesn't
+spin. take() drains a buffer, skipping ids already queued or handed out, and
+schedules that key for an early refill.
+"""
+import os, time, threading
+
+class CategoryWarmer:
+    """
+    pull_fn(queries) -> list of ready items (each with "id").
+    known_ids_fn() -> set of ids already queued (skipped when buffering/draining).
+    """
+    def __init__(self, pull_fn, known_ids_fn=None, capacity: int = 12, low_water: int = 4,
+                 max_age_sec: int = 3600, pause_sec: float = 5.0, served_cap: int = 5000,
+                 backoff_sec: float = 60.0, backoff_max_sec: float = 3600.0):
+        self.pull_fn = pull_fn
+        self.known_ids_fn = known_ids_fn or (lambda: set())
+        self.capacity = capacity
+        self.low_water = low_water
+        self.max_age_sec = max_age_sec
+        self.pause_sec = pause_sec
+        self.served_cap = served_cap
+        self.backoff_sec = backoff_sec
+        self.backoff_max_sec = backoff_max_sec
+        self._queries = {}      # key -> queries (insertion order = warm priority)
+        self._buf = {}          # key -> {"items": [...], "ts": float}
+        self._refilling = set()
+        self._served = {}       # id -> ts handed out (dict keeps insertion order for trimming)
+        self._urgent = []       # keys to refill before the regular sweep
+        self._backoff = {}      # key -> (short refills in a row, monotonic time it may refill again)
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+
+    def register(self, key: str, queries):
+        with self._lock:
+            self._queries[key] = list(queries)
+            self._buf.setdefault(key, {"items": [], "ts": 0.0})
+
+    # ---- state ----
+    def _is_stale(self, key: str) -> bool:
+        b = self._buf.get(key) or {}
+        return (time.time() - b.get("ts", 0.0)) > self.max_age_sec
+
+    def needs_refill(self, key: str) -> bool:
+        with self._lock:
+            b = self._buf.get(key)
+            if b is None or key in self._refilling or self._backing_off(key):
+                return False
+            return len(b["items"]) < self.low_water or self._is_stale(key)
+
+    def _backing_off(self, key: str) -> bool:
+        return time.monotonic() < self._backoff.get(key, (0, 0.0))[1]
+
+    def _note_refill(self, key: str, n: int):
+        """Short or failed refill -> wait backoff_sec * 2^(k-1) before the next one (capped); a full one resets it."""
+        with self._lock:
+            if n >= self.low_water:
+                self._backoff.pop(key, None)
+                return
+            k = self._backoff.get(key, (0, 0.0))[0] + 1
+            delay = min(self.backoff_max_sec, self.backoff_sec * 2 ** (k - 1))
+            self._backoff[key] = (k, time.monotonic() + delay)
+        print(f"[WARM] '{key}' short refill ({n}/{self.low_water}); next try in {delay:.0f}s", flush=True)
+
+    def size(self, key: str) -> int:
+        with self._lock:
+            b = self._buf.get(key)
+            return len(b["items"]) if b else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {k: len(b["items"]) for k, b in self._buf.items()}
+
+    # ---- fill / drain ----
+    def refill(self, key: str) -> int:
+        with self._lock:
+            queries = self._queries.get(key)
+            if not queries or key in self._refilling:
+                return 0
+            self._refilling.add(key)
+        try:
+            t0 = time.time()
+            items = self.pull_fn(queries) or []
+            try:
+                known = set(self.known_ids_fn() or ())
+            except Exception:
+                known = set()
+            with self._lock:
+                b = self._buf[key]
+                stale = self._is_stale(key)
+                fresh_ids = {str(it.get("id") or "") for it in items}
+                # keep still-fresh old candidates only if the new pull didn't return them
+                kept = [] if stale else [it for it in b["items"] if str(it.get("id") or "") not in fresh_ids]
+                merged, seen = [], set()
+                for it in items + kept:
+                    iid = str(it.get("id") or "")
+                    if not iid or iid in seen or iid in known or iid in self._served:
+                        continue
+                    seen.add(iid); merged.append(it)
+                    if len(merged) >= self.capacity:
+                        break
+                b["items"] = merged
+                b["ts"] = time.time()
+                n = len(merged)
+            print(f"[WARM] '{key}' -> {n} buffered ({time.time()-t0:.1f}s)", flush=True)
+            self._note_refill(key, n)
+            return n
+        except Exception as e:
+            print(f"[WARM] refill '{key}' failed: {e}", flush=True)
+            self._note_refill(key, 0)
+            return 0
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    def take(self, key: str, n: int = None):
+        """Drain up to n (default: all) buffered items for key and schedule an async refill."""
+        try:
+            known = set(self.known_ids_fn() or ())
+        except Exception:
+            known = set()
+        with self._lock:
+            b = self._buf.get(key)
+            if b is None:
+                return []
+            out, rest = [], []
+            for it in b["items"]:
+                iid = str(it.get("id") or "")
+                if iid in known or iid in self._served:
+                    continue
+                (out if (n is None or len(out) < n) else rest).append(it)
+            b["items"] = rest
+            now = time.time()
+            for it in out:
+                self._served[str(it.get("id") or "")] = now
+            while len(self._served) > self.served_cap:
+                self._served.pop(next(iter(self._served)))
+            if key not in self._urgent:
+                self._urgent.append(key)
+        self._wake.set()
+        return out
+
+    # ---- background loop ----
+    def _next_key(self):
+        with self._lock:
+            while self._urgent:
+                key = self._urgent.pop(0)
+                if key in self._queries and key not in self._refilling and not self._backing_off(key):
+                    return key
+        for key in list(self._queries):
+            if self.needs_refill(key):
+                return key
+        return None
+
+    def run_forever(self):
+        print(f"[WARM] Warmer thread started ({len(self._queries)} buffers, low_water={self.low_water})", flush=True)
+        while True:
+            try:
+                key = self._next_key()
+                if key is None:
+                    self._wake.wait(timeout=30)
+                    self._wake.clear()
+                    continue
+                self.refill(key)
+            except Exception as e:
+                print(f"[WARM] cycle error: {e}", flush=True)
+            time.sleep(self.pause_sec)
+
+    def start(self):
+        t = threading.Thread(target=self.run_forever, name="AECategoryWarmer", daemon=True)
+        t.start()
+        return t
+
+def start_category_warmer(pull_fn, cats, known_ids_fn=None):
+    """
+    cats: [(key, label, queries)] as in main.CATS. Only keys a caller take()s are
+    registered: an undrained buffer would just burn scrape / API quota on refreshes.
+    """
+    w = CategoryWarmer(
+        pull_fn, known_ids_fn=known_ids_fn,
+        capacity=int(os.getenv("WARM_BUFFER_SIZE", "12")),
+        low_water=int(os.getenv("WARM_LOW_WATER", "4")),
+        max_age_sec=int(os.getenv("WARM_MAX_AGE_MIN", "60")) * 60,
+        pause_sec=float(os.getenv("WARM_PAUSE_SEC", "5")),
+        backoff_sec=float(os.getenv("WARM_BACKOFF_SEC", "60")),
+        backoff_max_sec=float(os.getenv("WARM_BACKOFF_MAX_SEC", "3600")),
+    )
+    for key, _, queries in cats:
+        w.register(key, queries)
+    w.start()
+    return w
@@ -3,9 +3,12 @@ import os, time, csv, json, re
 from datetime import datetime
 from urllib.parse import urlencode
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from ae_http import get_session
+from ae_gateways import get_pool
+import ae_parse
+from ae_timeouts import timeout_for, retry_budget
+from ae_fetch import fetch_capped, BlockedPage, BodyTooLarge, SOURCES
+from ae_catalog import safe_upsert
 
 BASE_DIR = os.environ.get("BOT_DATA_DIR", "./data")
 os.makedirs(BASE_DIR, exist_ok=True)
@@ -51,28 +54,13 @@ def _append_items(items):
             known.add(pid); added += 1
     return added
 
-def _make_sess():
-    s = requests.Session()
-    retry = Retry(total=int(os.getenv("AE_RETRY_TOTAL","2")),
-                  connect=int(os.getenv("AE_RETRY_TOTAL","2")),
-                  read=int(os.getenv("AE_RETRY_TOTAL","2")),
-                  backoff_factor=float(os.getenv("AE_RETRY_BACKOFF","1.2")),
-                  status_forcelist=[429,500,502,503,504],
-                  allowed_methods=frozenset(["GET","POST"]))
-    ad = HTTPAdapter(max_retries=retry, pool_maxsize=10)
-    s.mount("https://", ad); s.mount("http://", ad)
-    http_proxy = os.getenv("AE_HTTP_PROXY") or os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
-    https_proxy = os.getenv("AE_HTTPS_PROXY") or os.getenv("HTTPS_PROXY") or os.getenv("https_proxy") or http_proxy
-    proxies = {}
-    if http_proxy: proxies["http"] = http_proxy
-    if https_proxy: proxies["https"] = https_proxy
-    if proxies: s.proxies.update(proxies)
-    s.headers.update({
-        "User-Agent": os.getenv("AE_UA","Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome Safari"),
-        "Accept-Language": os.getenv("AE_ACCEPT_LANG","he-IL,he;q=0.9,en-US;q=0.8,en;q=0.7"),
-        "Cache-Control": "no-cache",
-    })
-    return s
+def _env_timeout():
+    # default until ae_timeouts has latency samples for the host
+    return (float(os.getenv("AE_CONNECT_TIMEOUT","10")), float(os.getenv("AE_READ_TIMEOUT","20")))
+
+def _make_sess(purpose="scrape"):
+    # pooled, process-wide session (retries/proxies/locale cookie configured in ae_http)
+    return get_session(purpose)
 
 def _api_fetch(category_or_query, limit=12):
     APP_KEY = os.getenv("AE_APP_KEY") or os.getenv("AE_API_APP_KEY") or ""
@@ -93,97 +81,64 @@ def _api_fetch(category_or_query, limit=12):
         "page_size": str(limit),
         "sort": "sale_price_asc"
     }
-    sess = _make_sess()
+    sess = _make_sess("ae_api")
     gateways = [g.strip() for g in (os.getenv("AE_GATEWAY_LIST") or "https://gw.api.taobao.com/router/rest,https://eco.taobao.com/router/rest").split(",") if g.strip()]
-    last = None
-    for gw in gateways:
-        try:
-            r = sess.post(gw, data=payload, timeout=(float(os.getenv("AE_CONNECT_TIMEOUT","10")), float(os.getenv("AE_READ_TIMEOUT","20"))))
-            r.raise_for_status()
-            data = r.json()
-            # Try dig a list of products
-            def find_products(obj):
-                if isinstance(obj, dict):
-                    if "products" in obj and isinstance(obj["products"], list):
-                        return obj["products"]
-                    for v in obj.values():
-                        res = find_products(v)
-                        if res is not None: return res
-                return None
-            products = find_products(data) or []
-            out = []
-            for p in products:
-                pid = str(p.get("product_id") or p.get("item_id") or "")
-                if not pid: continue
-                out.append({
-                    "ItemId": pid,
-                    "Title": p.get("product_title") or p.get("title") or "",
-                    "Price": p.get("app_sale_price") or p.get("sale_price") or "",
-                    "Currency": p.get("app_sale_price_currency") or p.get("currency") or os.getenv("BOT_CURRENCY","ILS"),
-                    "Url": p.get("product_detail_url") or p.get("url") or "",
-                    "Image": p.get("product_main_image_url") or p.get("image_url") or "",
-                    "Category": str(category_or_query)
-                })
-            return out
-        except Exception as e:
-            last = e
-            continue
-    raise RuntimeError(f"AE API failed: {last}")
+    def fetch_from(gw):
+        r = sess.post(gw, data=payload, timeout=timeout_for(gw, _env_timeout()))
+        r.raise_for_status()
+        data = r.json()
+        # Try dig a list of products
+        def find_products(obj):
+            if isinstance(obj, dict):
+                if "products" in obj and isinstance(obj["products"], list):
+                    return obj["products"]
+                for v in obj.values():
+                    res = find_products(v)
+                    if res is not None: return res
+            return None
+        products = find_products(data) or []
+        out = []
+        for p in products:
+            pid = str(p.get("product_id") or p.get("item_id") or "")
+            if not pid: continue
+            out.append({
+                "ItemId": pid,
+                "Title": p.get("product_title") or p.get("title") or "",
+                "Price": p.get("app_sale_price") or p.get("sale_price") or "",
+                "Currency": p.get("app_sale_price_currency") or p.get("currency") or os.getenv("BOT_CURRENCY","ILS"),
+                "Url": p.get("product_detail_url") or p.get("url") or "",
+                "Image": p.get("product_main_image_url") or p.get("image_url") or "",
+                "Category": str(category_or_query)
+            })
+        return out
+    # hedged across gateways, with per-gateway circuit breakers (ae_gateways)
+    try:
+        return get_pool("aliexpress", gateways).call(fetch_from)
+    except Exception as e:
+        raise RuntimeError(f"AE API failed: {e}")
 
-def _extract_items_from_json(obj):
-    found=[]
-    def rec(o):
-        if isinstance(o, dict):
-            id_key=None
-            for k in ["productId","product_id","itemId","item_id","id"]:
-                if k in o: id_key=k; break
-            title = o.get("title") or o.get("productTitle") or o.get("product_title")
-            url = o.get("productDetailUrl") or o.get("product_detail_url") or o.get("productUrl") or o.get("url")
-            img = o.get("image") or o.get("imageUrl") or o.get("productMainImageUrl") or o.get("product_main_image_url") or ""
-            price = o.get("appSalePrice") or o.get("salePrice") or o.get("price") or ""
-            cur = o.get("currency") or o.get("currencyCode") or os.getenv("BOT_CURRENCY","ILS")
-            if id_key and title and url:
-                found.append({"ItemId": str(o[id_key]), "Title": title, "Price": price, "Currency": cur, "Url": url, "Image": img, "Category": ""})
-            for v in o.values(): rec(v)
-        elif isinstance(o, list):
-            for it in o: rec(it)
-    rec(obj)
-    uniq={}
-    for it in found: uniq[it["ItemId"]]=it
-    return list(uniq.values())
+_extract_items_from_json = ae_parse.extract_items_from_json
 
 def _scrape_fetch(category_or_query, limit=12):
     query=str(category_or_query)
     params={"SearchText": query, "ShipCountry": os.getenv("AE_SHIP_TO","IL"), "SortType":"total_tranpro_desc", "g":"y"}
     url="https://www.aliexpress.com/wholesale?"+urlencode(params, doseq=True)
-    sess=_make_sess()
-    sess.headers.update({"Referer":"https://www.aliexpress.com/"})
-    cookies={"xman_us_f":"x_lan=he_IL&x_locale=he_IL&region=IL&b_locale=he_IL"}
-    r=sess.get(url, timeout=(float(os.getenv("AE_CONNECT_TIMEOUT","10")), float(os.getenv("AE_READ_TIMEOUT","20"))), cookies=cookies)
-    r.raise_for_status()
-    html=r.text
-    items=[]
-    for pat in [r"window\.__AER_DATA__\s*=\s*(\{.*?\});", r"window\.runParams\s*=\s*(\{.*?\});"]:
-        m=re.search(pat, html, re.S)
-        if not m: continue
-        raw=m.group(1).strip().rstrip(";")
-        try:
-            data=json.loads(raw)
-            items.extend(_extract_items_from_json(data))
-        except Exception:
-            continue
-    if not items:
-        for m in re.finditer(r'href="(https://www\.aliexpress\.com/item/[^"]+)"[^>]*>([^<]{10,120})</a>', html):
-            url, title = m.group(1), m.group(2).strip()
-            items.append({"ItemId": str(abs(hash(url))), "Title": title, "Price":"", "Currency": os.getenv("BOT_CURRENCY","ILS"), "Url": url, "Image":"", "Category":""})
-    # Dedup & limit
-    seen=set(); out=[]
-    for it in items:
-        pid=it.get("ItemId"); title=it.get("Title"); url=it.get("Url")
-        if not pid or not title or not url: continue
-        if pid in seen: continue
-        seen.add(pid); it["Category"]=query; out.append(it)
-        if len(out)>=limit: break
+    sess=_make_sess("scrape")
+    headers={"Referer":"https://www.aliexpress.com/", "Cache-Control":"no-cache"}
+    # locale cookie (xman_us_f) lives in the shared ae_http cookie jar
+    try:
+        with retry_budget():
+            r=fetch_capped(sess, url, headers=headers, timeout=timeout_for(url, _env_timeout()))
+    except (BlockedPage, BodyTooLarge) as e:
+        SOURCES.record(url, "blocked" if isinstance(e, BlockedPage) else "too_large")
+        raise
+    except Exception:
+        SOURCES.record(url, "error")
+        raise
+    # regex + json.loads over the whole page: offloaded to a worker process when large (ae_parse)
+    out=ae_parse.parse(ae_parse.embedded_items, r.content, r.encoding or "utf-8", limit=limit)
+    SOURCES.record(url, "hit" if out else "miss", len(r.content))
+    for it in out: it["Category"]=query
     return out
 
 def fetch_products_by_category(category_id_or_query, limit=12):
@@ -200,4 +155,5 @@ def fetch_products_by_category(category_id_or_query, limit=12):
             print(f"[AE][SCRAPE][ERR] {e}")
             items=[]
     if not items: return 0
+    safe_upsert(items, source="aliexpress")
     return _append_items(items)
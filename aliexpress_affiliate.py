@@ -11,17 +11,62 @@ AliExpress Affiliates helper for Telegram bot/CSV pipelines.
 
 Usage (standalone CLI):
     python aliexpress_affiliate.py enrich --in products.csv --out products_enriched.csv
+        (resumable: an interrupted run leaves products_enriched.csv.ckpt; rerun the same command)
     python aliexpress_affiliate.py hot --keyword "Bluetooth" --out hot.csv --count 10 --min_discount 40
 
 Env vars (or pass explicitly when creating the client):
     AE_APP_KEY, AE_APP_SECRET, AE_TRACKING_ID, AE_TARGET_CURRENCY, AE_TARGET_LANGUAGE, AE_SHIP_TO_COUNTRY
 """
 from __future__ import annotations
-import os, time, csv, hmac, hashlib, requests
+import os, re, time, csv, hmac, math, hashlib
 from typing import Any, Dict, List, Optional
+from ae_http import get_session
+from ae_ratelimit import LIMITER
+from ae_timeouts import timeout_for, retry_budget
+from ae_affcache import AFF_CACHE
+from ae_memo import memoized
 
 REST_BASE = "https://api-sg.aliexpress.com/rest/"
 DEFAULT_TIMEOUT = 20
+LINK_BATCH_SIZE = int(os.getenv("AE_LINK_BATCH_SIZE", "50"))  # source_values per link.generate call
+DETAIL_BATCH_SIZE = int(os.getenv("AE_DETAIL_BATCH_SIZE", "20"))  # product_ids per productdetail/get call
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "4"))  # concurrent API calls in enrich_csv (<= ae_api pool size)
+ENRICH_BLOCK_ROWS = int(os.getenv("ENRICH_BLOCK_ROWS", "200"))  # rows held in memory / per checkpoint
+MAX_PAGE_SIZE = 50   # product/query page_size limit
+HOT_PREFETCH = int(os.getenv("AE_HOT_PREFETCH", "3"))  # product/query pages fetched concurrently
+# projection for product/query: only what query_products maps
+QUERY_FIELDS = os.getenv("AE_QUERY_FIELDS") or (
+    "product_id,product_title,product_main_image_url,target_original_price,target_sale_price,"
+    "discount,evaluate_rate,lastest_volume,product_detail_url")
+DETAIL_FIELDS = ("Origin Price", "Discount Price", "Discount", "Positive Feedback", "Orders", "Image Url")
+
+_ITEM_ID_RE = re.compile(r"(\d{8,})")
+
+def _item_key(value: str) -> str:
+    """Match key for a source value: the product id when there is one, else the raw string."""
+    m = _ITEM_ID_RE.search(str(value or ""))
+    return m.group(1) if m else str(value or "").strip()
+
+def match_links(values: List[str], pairs) -> Dict[str, Optional[str]]:
+    """
+    Map link.generate answers back to the source values that were sent: pairs are
+    (echoed source_value, promotion link). The echo may be normalized by the API, so an
+    exact match falls back to the product id; only when nothing is echoed and the
+    counts agree is the answer order trusted. Returns {value: link or None}.
+    """
+    pairs = list(pairs)
+    out: Dict[str, Optional[str]] = dict.fromkeys(values)
+    by_key = {_item_key(v): v for v in values}
+    for i, (src, link) in enumerate(pairs):
+        v = src if src in out else by_key.get(_item_key(src)) if src else None
+        if v is None and not src and len(pairs) == len(values):
+            v = values[i]     # no source_value echoed: rely on order
+        if v is not None and link:
+            out[v] = link
+    return out
+
+def _cents(price: Optional[float]) -> Optional[int]:
+    return None if price in (None, "") else int(round(float(price) * 100))
 
 def _now_ms() -> int:
     return int(time.time() * 1000)
@@ -60,15 +105,20 @@ class AliExpressAffiliateClient:
     def _rest(self, api_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
         q = dict(params)
         q.setdefault("app_key", self.app_key)
-        q.setdefault("timestamp", _now_ms())
         q.setdefault("sign_method", "sha256")
         if self.session:
             # Only if needed by that endpoint
             q.setdefault("session", self.session)
+        # identical business calls within AE_MEMO_TTL_SEC (or in flight) share one request
+        return memoized(REST_BASE, api_path, q, lambda: self._rest_send(api_path, q))
 
+    def _rest_send(self, api_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        q = dict(params)
+        q.setdefault("timestamp", _now_ms())
         q["sign"] = self._sign(q)
         url = REST_BASE + api_path.lstrip("/")
-        r = requests.get(url, params=q, timeout=DEFAULT_TIMEOUT)
+        with retry_budget():
+            r = get_session("ae_api").get(url, params=q, timeout=timeout_for(url, DEFAULT_TIMEOUT))
         r.raise_for_status()
         data = r.json()
         # normalize known envelope shapes
@@ -83,42 +133,56 @@ class AliExpressAffiliateClient:
 
     # ---- Public helpers ----
     def generate_affiliate_link(self, source_values: str, promotion_link_type: int = 0) -> Optional[str]:
-        api = "aliexpress/affiliate/link/generate"
-        params = {
-            "source_values": source_values,
+        return self.generate_affiliate_links([source_values], promotion_link_type).get(source_values)
+
+    def _link_generate(self, values: List[str], promotion_link_type: int) -> Dict[str, Optional[str]]:
+        res = self._rest("aliexpress/affiliate/link/generate", {
+            "source_values": ",".join(values),
             "promotion_link_type": promotion_link_type,
             "tracking_id": self.tracking_id,
-        }
-        res = self._rest(api, params)
+        })
         links = (res.get("promotion_links") if isinstance(res, dict) else None) or []
-        if links:
-            return links[0].get("promotion_link") or links[0].get("promotion_target_link") or links[0].get("promotion_short_link")
-        return None
+        if isinstance(links, dict):   # {"promotion_link": [...]} envelope
+            links = links.get("promotion_link") or []
+        return match_links(values, ((pl.get("source_value"),
+                                     pl.get("promotion_link") or pl.get("promotion_target_link") or pl.get("promotion_short_link"))
+                                    for pl in links if isinstance(pl, dict)))
 
-    def query_products(
-        self,
-        keywords: Optional[str] = None,
-        page_no: int = 1,
-        page_size: int = 20,
-        min_discount: Optional[int] = None,
-        min_rating: Optional[float] = None,
-    ) -> List[Dict[str, Any]]:
-        api = "aliexpress/affiliate/product/query"
-        params = {
-            "page_no": page_no,
-            "page_size": page_size,
-            "target_currency": self.target_currency,
-            "target_language": self.target_language,
-            "ship_to_country": self.ship_to_country,
-        }
-        if keywords:
-            params["keywords"] = keywords
-        res = self._rest(api, params)
-        products = res.get("products") or []
+    def generate_affiliate_links(self, urls: List[str], promotion_link_type: int = 0,
+                                 chunk_size: Optional[int] = None) -> Dict[str, Optional[str]]:
+        """
+        Promotion links for many source values in as few link.generate calls as possible.
+        Returns {input: link or None (answered, no link)}; inputs whose call failed are absent.
+        A chunk that fails as a whole is retried one by one, so a single bad URL can't cost
+        the others their links.
+        """
+        values = list(dict.fromkeys(str(u).strip() for u in urls if u and str(u).strip()))
+        size = max(1, chunk_size or LINK_BATCH_SIZE)
+        out: Dict[str, Optional[str]] = {}
+        for i in range(0, len(values), size):
+            chunk = values[i:i + size]
+            try:
+                out.update(self._link_generate(chunk, promotion_link_type))
+            except Exception as e:
+                if len(chunk) == 1:
+                    print(f"[AFF][WARN] link.generate failed for {chunk[0][:80]}: {e}", flush=True)
+                    continue
+                print(f"[AFF][WARN] batch of {len(chunk)} failed ({e}); retrying one by one", flush=True)
+                for v in chunk:
+                    out.update(self.generate_affiliate_links([v], promotion_link_type, chunk_size=1))
+        return out
+
+    def _query_page(self, params: Dict[str, Any], min_discount: Optional[int] = None,
+                    min_rating: Optional[float] = None):
+        """One product/query call -> (items returned by the API, items passing the client-side filters)."""
+        res = self._rest("aliexpress/affiliate/product/query", params)
+        products = (res.get("products") if isinstance(res, dict) else None) or []
+        if isinstance(products, dict):   # {"product": [...]} envelope
+            products = products.get("product") or []
         out = []
         for p in products:
-            discount = int(p.get("discount") or 0)
-            rating = float(p.get("evaluate_rate") or 0.0)
+            discount = int(str(p.get("discount") or 0).rstrip("%") or 0)
+            rating = float(str(p.get("evaluate_rate") or 0.0).rstrip("%") or 0.0)
             if min_discount is not None and discount < min_discount:
                 continue
             if min_rating is not None and rating < min_rating:
@@ -131,70 +195,286 @@ class AliExpressAffiliateClient:
                 "sale_price": p.get("target_sale_price"),
                 "discount": discount,
                 "rating": rating,
-                "orders": p.get("orders"),
+                "orders": p.get("orders") or p.get("lastest_volume"),
                 "detail_url": p.get("product_detail_url"),
             })
-        return out
+        return len(products), out
 
-    def product_detail(self, product_id: str) -> Dict[str, Any]:
+    def _query_params(self, keywords=None, page_no=1, page_size=20, min_sale_price=None,
+                      max_sale_price=None, sort=None, category_ids=None, fields=QUERY_FIELDS) -> Dict[str, Any]:
+        params = {
+            "page_no": page_no,
+            "page_size": min(int(page_size), MAX_PAGE_SIZE),
+            "target_currency": self.target_currency,
+            "target_language": self.target_language,
+            "ship_to_country": self.ship_to_country,
+        }
+        # everything the endpoint can filter on goes into the query; discount / rating
+        # have no server-side filter and stay client-side in _query_page.
+        # Prices are taken in whole target_currency units (10 = 10.00) and sent in cents,
+        # the unit product/query's min/max_sale_price expects.
+        for k, v in (("keywords", keywords), ("category_ids", category_ids), ("sort", sort),
+                     ("min_sale_price", _cents(min_sale_price)), ("max_sale_price", _cents(max_sale_price)),
+                     ("fields", fields)):
+            if v not in (None, ""):
+                params[k] = v
+        return params
+
+    def query_products(
+        self,
+        keywords: Optional[str] = None,
+        page_no: int = 1,
+        page_size: int = 20,
+        min_discount: Optional[int] = None,
+        min_rating: Optional[float] = None,
+        min_sale_price: Optional[float] = None,
+        max_sale_price: Optional[float] = None,
+        sort: Optional[str] = None,
+        category_ids: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        params = self._query_params(keywords, page_no, page_size, min_sale_price, max_sale_price, sort, category_ids)
+        return self._query_page(params, min_discount, min_rating)[1]
+
+    def query_hot(
+        self,
+        keywords: Optional[str] = None,
+        count: int = 10,
+        min_discount: Optional[int] = None,
+        min_rating: Optional[float] = None,
+        min_sale_price: Optional[float] = None,
+        max_sale_price: Optional[float] = None,
+        sort: Optional[str] = None,
+        category_ids: Optional[str] = None,
+        prefetch: Optional[int] = None,
+        max_pages: int = 50,
+    ) -> List[Dict[str, Any]]:
+        """
+        Up to `count` filtered products in as few calls as possible. The page size follows the
+        filters' observed pass rate (need / rate, capped at MAX_PAGE_SIZE) and, when more than one
+        page is still needed, up to HOT_PREFETCH pages are fetched concurrently (LIMITER paces them).
+        Changing the page size realigns page_no on the items already consumed; overlap is de-duplicated.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        prefetch = max(1, prefetch or HOT_PREFETCH)
+        filtered = min_discount is not None or min_rating is not None
+        out: List[Dict[str, Any]] = []
+        seen = set()
+        raw = passed = offset = calls = 0
+        done = False
+        with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="hot") as ex:
+            while not done and len(out) < count and calls < max_pages:
+                need = count - len(out)
+                # Laplace-smoothed pass rate; optimistic 1.0 without client-side filters
+                rate = (passed + 1) / (raw + 2) if filtered else 1.0
+                size = max(1, min(MAX_PAGE_SIZE, math.ceil(need / max(rate, 0.01))))
+                if filtered:
+                    size = max(size, min(MAX_PAGE_SIZE, 20))
+                n = max(1, min(prefetch, max_pages - calls, math.ceil(need / max(size * rate, 1))))
+                first = offset // size + 1
+                futs = [ex.submit(self._query_page,
+                                  self._query_params(keywords, first + k, size, min_sale_price, max_sale_price,
+                                                     sort, category_ids),
+                                  min_discount, min_rating)
+                        for k in range(n)]
+                calls += n
+                for k, fut in enumerate(futs):
+                    try:
+                        got, items = fut.result()
+                    except Exception as e:
+                        print(f"[HOT][WARN] page {first + k} failed: {e}", flush=True)
+                        done = True
+                        continue
+                    new = [it for it in items if str(it.get("product_id")) not in seen]
+                    seen.update(str(it.get("product_id")) for it in new)
+                    raw += got
+                    passed += len(items)
+                    out.extend(new)
+                    offset = max(offset, (first + k - 1) * size + got)
+                    if got < size:
+                        done = True     # last page of results
+        print(f"[HOT] {len(out[:count])}/{count} items in {calls} calls (pass rate {passed}/{raw})", flush=True)
+        return out[:count]
+
+    def _detail_chunk(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         api = "aliexpress/affiliate/productdetail/get"
         params = {
-            "product_ids": product_id,
+            "product_ids": ",".join(product_ids),
             "target_currency": self.target_currency,
             "target_language": self.target_language,
             "ship_to_country": self.ship_to_country,
         }
         res = self._rest(api, params)
+        # _rest doesn't know this envelope: {"..._productdetail_get_response": {"resp_result": {"result": {...}}}}
+        for key in ("aliexpress_affiliate_productdetail_get_response", "resp_result", "result"):
+            if isinstance(res, dict) and isinstance(res.get(key), dict):
+                res = res[key]
+        items = []
         if isinstance(res, dict):
             items = res.get("products") or res.get("product_detail_response") or []
-            if isinstance(items, list) and items:
-                return items[0]
-        return res
+            if isinstance(items, dict):   # {"product": [...]} envelope
+                items = items.get("product") or []
+        out = {}
+        for it in items if isinstance(items, list) else []:
+            if isinstance(it, dict) and it.get("product_id") is not None:
+                out[str(it.get("product_id"))] = it
+        if not out and len(product_ids) == 1 and isinstance(res, dict):
+            out[product_ids[0]] = items[0] if isinstance(items, list) and items else res
+        return out
 
-    def enrich_csv(self, in_path: str, out_path: str, rate_limit_sec: float = 0.6) -> int:
-        import csv, time
+    def product_details(self, product_ids: List[str], chunk_size: Optional[int] = None,
+                        strict: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        {product_id: detail} for many ids, DETAIL_BATCH_SIZE ids per productdetail/get call.
+        A failed chunk is logged and skipped; strict=True raises instead, so callers can tell
+        "not returned" (unavailable) from "not asked".
+        """
+        ids = list(dict.fromkeys(str(p).strip() for p in product_ids if p and str(p).strip()))
+        size = max(1, chunk_size or DETAIL_BATCH_SIZE)
+        out: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(ids), size):
+            try:
+                out.update(self._detail_chunk(ids[i:i + size]))
+            except Exception as e:
+                if strict:
+                    raise
+                print(f"[ENRICH][WARN] productdetail for {len(ids[i:i + size])} ids failed: {e}", flush=True)
+        return out
+
+    def product_detail(self, product_id: str) -> Dict[str, Any]:
+        return self._detail_chunk([str(product_id)]).get(str(product_id)) or {}
+
+    def _enrich_rows(self, rows: List[Dict[str, Any]], ex) -> int:
+        """Fill missing promotion links / detail fields of rows in place; returns the number changed."""
+        def _source(row):
+            return str(row.get("Product Detail Url") or row.get("ProductId") or row.get("Source Url") or "").strip()
+        # all missing promotion links in ceil(n / LINK_BATCH_SIZE) calls instead of one call per row,
+        # minus the ones the shared affiliate-link cache already knows
+        missing = [_source(r) for r in rows if not r.get("Promotion Url") and _source(r)]
+        cached = AFF_CACHE.get_many(missing, self.tracking_id) if missing else {}
+        links = {v: link for v, (link, src) in cached.items() if src != "no-aff"}
+        todo = list(dict.fromkeys(v for v in missing if v not in cached))
+        need = [r for r in rows if any(not r.get(k) for k in DETAIL_FIELDS)]
+        pids = list(dict.fromkeys(str(r.get("ProductId")).strip() for r in need
+                                  if r.get("ProductId") and str(r.get("ProductId")).strip().isdigit()))
+        # link and detail chunks run side by side on the pool; LIMITER still paces the host
+        link_futs = [ex.submit(self.generate_affiliate_links, todo[i:i + LINK_BATCH_SIZE])
+                     for i in range(0, len(todo), LINK_BATCH_SIZE)]
+        det_futs = [ex.submit(self.product_details, pids[i:i + DETAIL_BATCH_SIZE])
+                    for i in range(0, len(pids), DETAIL_BATCH_SIZE)]
+        fresh: Dict[str, Optional[str]] = {}
+        for fut in link_futs:
+            fresh.update(fut.result())
+        details: Dict[str, Dict[str, Any]] = {}
+        for fut in det_futs:
+            details.update(fut.result())
+        if fresh:
+            AFF_CACHE.put_many([(v, l or "", "api" if l else "no-aff") for v, l in fresh.items()], self.tracking_id)
+            links.update({v: l for v, l in fresh.items() if l})
+        if missing:
+            print(f"[ENRICH] links: {len(cached)} cached, {len(todo)} via API; details: {len(details)}/{len(pids)}", flush=True)
+        def _g(obj, key, default=None):
+            return (obj.get(key) if isinstance(obj, dict) else default) or default
         cnt = 0
-        with open(in_path, "r", encoding="utf-8-sig", newline="") as f:
-            rows = list(csv.DictReader(f))
-        headers = rows[0].keys() if rows else []
-        if "Promotion Url" not in headers:
-            headers = list(headers) + ["Promotion Url"]
-        new_rows = []
         for row in rows:
             changed = False
             if not row.get("Promotion Url"):
-                source = row.get("Product Detail Url") or row.get("ProductId") or row.get("Source Url")
-                if source:
-                    link = self.generate_affiliate_link(str(source))
-                    if link:
-                        row["Promotion Url"] = link
-                        changed = True
-                        time.sleep(rate_limit_sec)
-            need_detail = any(not row.get(k) for k in ("Origin Price", "Discount Price", "Discount", "Positive Feedback", "Orders", "Image Url"))
-            if need_detail:
-                pid = row.get("ProductId")
-                product_id = None
-                if pid and str(pid).strip().isdigit():
-                    product_id = str(pid).strip()
-                if product_id:
-                    d = self.product_detail(product_id)
-                    def _g(obj, key, default=None):
-                        return (obj.get(key) if isinstance(obj, dict) else default) or default
-                    row["Origin Price"] = row.get("Origin Price") or _g(d, "target_original_price")
-                    row["Discount Price"] = row.get("Discount Price") or _g(d, "target_sale_price")
-                    row["Discount"] = row.get("Discount") or _g(d, "discount")
-                    row["Positive Feedback"] = row.get("Positive Feedback") or _g(d, "evaluate_rate")
-                    row["Orders"] = row.get("Orders") or _g(d, "orders")
-                    row["Image Url"] = row.get("Image Url") or _g(d, "product_main_image_url")
+                link = links.get(_source(row))
+                if link:
+                    row["Promotion Url"] = link
                     changed = True
-                    time.sleep(rate_limit_sec)
-            new_rows.append(row)
+            d = details.get(str(row.get("ProductId") or "").strip())
+            if d and any(not row.get(k) for k in DETAIL_FIELDS):
+                row["Origin Price"] = row.get("Origin Price") or _g(d, "target_original_price")
+                row["Discount Price"] = row.get("Discount Price") or _g(d, "target_sale_price")
+                row["Discount"] = row.get("Discount") or _g(d, "discount")
+                row["Positive Feedback"] = row.get("Positive Feedback") or _g(d, "evaluate_rate")
+                row["Orders"] = row.get("Orders") or _g(d, "orders")
+                row["Image Url"] = row.get("Image Url") or _g(d, "product_main_image_url")
+                changed = True
             if changed:
                 cnt += 1
-        with open(out_path, "w", encoding="utf-8-sig", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(new_rows)
+        return cnt
+
+    def enrich_csv(self, in_path: str, out_path: str, rate_limit_sec: Optional[float] = None,
+                   workers: Optional[int] = None, block_rows: Optional[int] = None, restart: bool = False) -> int:
+        """
+        Stream in_path -> out_path in blocks of ENRICH_BLOCK_ROWS. After each block is
+        written, <out_path>.ckpt records rows done and the output byte offset, so a rerun
+        with the same --in/--out resumes after the last finished block. Returns rows changed.
+        """
+        import csv, json
+        from itertools import islice
+        from concurrent.futures import ThreadPoolExecutor
+        # Pacing is done by the shared per-host limiter (ae_ratelimit); an explicit
+        # rate_limit_sec only caps the API host at one call per that many seconds.
+        if rate_limit_sec:
+            LIMITER.configure(REST_BASE, rate=1.0 / rate_limit_sec, burst=1)
+        block = max(1, block_rows or ENRICH_BLOCK_ROWS)
+        ckpt_path = out_path + ".ckpt"
+        st = os.stat(in_path)
+        ident = {"in": os.path.abspath(in_path), "size": st.st_size, "mtime": int(st.st_mtime)}
+        ckpt = {}
+        if not restart and os.path.exists(ckpt_path) and os.path.exists(out_path):
+            try:
+                with open(ckpt_path, "r", encoding="utf-8") as f:
+                    ckpt = json.load(f)
+            except (OSError, ValueError):
+                ckpt = {}
+            if any(ckpt.get(k) != v for k, v in ident.items()):
+                print("[ENRICH] checkpoint is for another input; starting over", flush=True)
+                ckpt = {}
+        done, cnt = int(ckpt.get("done", 0)), int(ckpt.get("changed", 0))
+
+        def _save(offset):
+            tmp = ckpt_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(dict(ident, done=done, changed=cnt, offset=offset), f)
+            os.replace(tmp, ckpt_path)
+
+        t0 = time.time()
+        processed = 0
+        with open(in_path, "r", encoding="utf-8-sig", newline="") as fin, \
+             ThreadPoolExecutor(max_workers=max(1, workers or ENRICH_WORKERS), thread_name_prefix="enrich") as ex:
+            reader = csv.DictReader(fin)
+            headers = list(reader.fieldnames or [])
+            headers += [h for h in ("Promotion Url",) + DETAIL_FIELDS if h not in headers]
+            if ckpt:
+                fout = open(out_path, "r+", encoding="utf-8-sig", newline="")
+                fout.seek(int(ckpt.get("offset", 0)))
+                fout.truncate()    # drop a block written after the last checkpoint
+                for _ in islice(reader, done):
+                    pass
+                print(f"[ENRICH] resuming after {done} rows", flush=True)
+            else:
+                fout = open(out_path, "w", encoding="utf-8-sig", newline="")
+            with fout:
+                writer = csv.DictWriter(fout, fieldnames=headers)
+                if not ckpt:
+                    writer.writeheader()
+                while True:
+                    rows = list(islice(reader, block))
+                    if not rows:
+                        break
+                    cnt += self._enrich_rows(rows, ex)
+                    writer.writerows(rows)
+                    fout.flush()
+                    os.fsync(fout.fileno())
+                    done += len(rows)
+                    processed += len(rows)
+                    _save(fout.tell())
+                    try:
+                        from ae_catalog import safe_upsert
+                        safe_upsert(rows, source="enrich")
+                    except ImportError:
+                        pass
+                    dt = max(time.time() - t0, 1e-6)
+                    print(f"[ENRICH] {done} rows done ({processed / dt:.1f} rows/s), {cnt} changed", flush=True)
+        try:
+            os.remove(ckpt_path)
+        except OSError:
+            pass
+        dt = max(time.time() - t0, 1e-6)
+        print(f"[ENRICH] {processed} rows in {dt:.1f}s ({processed / dt:.1f} rows/s), {cnt} changed", flush=True)
         return cnt
 
 if __name__ == "__main__":
@@ -204,13 +484,20 @@ if __name__ == "__main__":
     p1 = sub.add_parser("enrich", help="Enrich existing CSV with affiliate links and missing fields")
     p1.add_argument("--in", dest="in_path", required=True)
     p1.add_argument("--out", dest="out_path", required=True)
-    p1.add_argument("--rate", dest="rate", type=float, default=0.6, help="Rate-limit seconds between calls")
+    p1.add_argument("--rate", dest="rate", type=float, default=None, help="Optional cap: min seconds between API calls (default: shared RATE_LIMITS)")
+    p1.add_argument("--workers", type=int, default=None, help="Concurrent API calls (default: ENRICH_WORKERS)")
+    p1.add_argument("--block", type=int, default=None, help="Rows per block / checkpoint (default: ENRICH_BLOCK_ROWS)")
+    p1.add_argument("--restart", action="store_true", help="Ignore an existing <out>.ckpt and start from the first row")
     p2 = sub.add_parser("hot", help="Fetch hot products into a CSV")
     p2.add_argument("--keyword", required=True)
     p2.add_argument("--out", dest="out_path", required=True)
     p2.add_argument("--count", type=int, default=10)
     p2.add_argument("--min_discount", type=int, default=30)
     p2.add_argument("--min_rating", type=float, default=4.6)
+    p2.add_argument("--min_price", type=float, default=None, help="Min sale price in target currency units, e.g. 10 = 10.00 (sent as cents)")
+    p2.add_argument("--max_price", type=float, default=None, help="Max sale price in target currency units, e.g. 50 = 50.00 (sent as cents)")
+    p2.add_argument("--sort", default=None, help="e.g. LAST_VOLUME_DESC, SALE_PRICE_ASC")
+    p2.add_argument("--prefetch", type=int, default=None, help="Pages fetched concurrently (default: AE_HOT_PREFETCH)")
     args = parser.parse_args()
 
     try:
@@ -220,27 +507,20 @@ if __name__ == "__main__":
         sys.exit(2)
 
     if args.cmd == "enrich":
-        changed = client.enrich_csv(args.in_path, args.out_path, rate_limit_sec=args.rate)
+        changed = client.enrich_csv(args.in_path, args.out_path, rate_limit_sec=args.rate, workers=args.workers,
+                                   block_rows=args.block, restart=args.restart)
         print(json.dumps({"ok": True, "changed_rows": changed}, ensure_ascii=False))
     elif args.cmd == "hot":
-        remaining = args.count
-        page = 1
-        all_items: List[Dict[str, Any]] = []
-        while remaining > 0 and page < 50:
-            page_size = min(20, remaining)
-            batch = client.query_products(
-                keywords=args.keyword,
-                page_no=page,
-                page_size=page_size,
-                min_discount=args.min_discount,
-                min_rating=args.min_rating
-            )
-            if not batch:
-                break
-            all_items.extend(batch)
-            remaining -= len(batch)
-            page += 1
-            time.sleep(0.4)
+        all_items: List[Dict[str, Any]] = client.query_hot(
+            keywords=args.keyword,
+            count=args.count,
+            min_discount=args.min_discount,
+            min_rating=args.min_rating,
+            min_sale_price=args.min_price,
+            max_sale_price=args.max_price,
+            sort=args.sort,
+            prefetch=args.prefetch,
+        )
         headers = ["product_id","title","image","orig_price","sale_price","discount","rating","orders","detail_url"]
         with open(args.out_path, "w", encoding="utf-8-sig", newline="") as f:
             w = csv.DictWriter(f, fieldnames=headers)
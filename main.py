@@ -5,12 +5,30 @@ v7e: discovery fix — remove /af endpoints (404), add mobile search URLs,
      add he/aliexpress.us domains, and richer parsers (data-href, productId).
 """
 import os, time, csv, random, re, threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from urllib.parse import quote_plus
-import requests
 import telebot
 from telebot import types
 from flask import Flask, request
+from ae_http import get_session, format_pool_stats
+from ae_ratelimit import LIMITER
+import ae_gateways
+from ae_deadline import Deadline
+import ae_parse
+from ae_timeouts import timeout_for, retry_budget
+import ae_timeouts
+from ae_fetch import fetch_capped, BlockedPage, BodyTooLarge, SOURCES
+from ae_proxies import PROXIES
+from ae_catalog import CATALOG, safe_upsert, safe_search, safe_mark_queued
+from ae_affcache import AFF_CACHE
+from aliexpress_affiliate import match_links
+from ae_memo import MEMO
+from tg_send import ScheduledBot, SCHEDULER, PRIO_CHANNEL, PRIO_ADMIN
+
+# ae_parse's worker processes (spawn / forkserver) re-import this script as __mp_main__. They
+# only need ae_parse: module-level code below must not touch disk, print or talk to Telegram there.
+PARSE_WORKER = __name__ == "__mp_main__"
 
 # ======= ENV / CONFIG =======
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("BOT_TOKEN") or ""
@@ -21,6 +39,8 @@ USE_WEBHOOK = os.getenv("USE_WEBHOOK","1") == "1"
 PUBLIC_CHANNEL = os.getenv("PUBLIC_CHANNEL", "").strip()  # e.g. -100...
 TARGET_CHAT_ID = int(PUBLIC_CHANNEL) if PUBLIC_CHANNEL.lstrip("-").isdigit() else None
 CURRENCY = os.getenv("AE_TARGET_CURRENCY", "₪")
+# ISO code for the API (prices come back in it); CURRENCY may be a display symbol
+AE_CURRENCY_CODE = {"₪": "ILS", "$": "USD", "€": "EUR", "£": "GBP"}.get(CURRENCY, CURRENCY).upper()
 SHIP_TO = os.getenv("AE_SHIP_TO_COUNTRY", "IL")
 LANG = (os.getenv("AE_TARGET_LANGUAGE", "EN") or "EN").upper()
 REQUIRE_AFFILIATE = os.getenv("REQUIRE_AFFILIATE","1") == "1"
@@ -31,22 +51,45 @@ AE_APP_SECRET = os.getenv("AE_APP_SECRET", "").strip()
 AE_TRACKING_ID = os.getenv("AE_TRACKING_ID", "").strip()
 AE_AFF_SHORT_KEY = os.getenv("AE_AFF_SHORT_KEY","").strip()  # optional fallback
 
+# Category warmer (pre-pulled candidate buffers per category)
+WARM_ENABLED = os.getenv("WARM_ENABLED","1") == "1"
+WARM_WORKERS = int(os.getenv("WARM_WORKERS","2") or "2")  # warmer's own item-scrape pool (user taps keep theirs)
+
 # Timing
 POST_DELAY_SECONDS = int(os.getenv("POST_DELAY_SECONDS","12") or "12")
 
+# Discovery concurrency
+DISCOVER_WORKERS = int(os.getenv("DISCOVER_WORKERS","4") or "4")  # parallel queries per category pull
+META_WORKERS = int(os.getenv("META_WORKERS","6") or "6")  # parallel item-page scrapes
+PULL_DEADLINE_SEC = float(os.getenv("PULL_DEADLINE_SEC","20") or "20")  # category tap -> enqueue budget
+PROGRESS_EDIT_SEC = float(os.getenv("PROGRESS_EDIT_SEC","2") or "2")  # min gap between status-message edits
+LINK_STAGE_SHARE = 0.4  # share of the pull deadline the search-page stage may use
+AFF_BATCH_SIZE = int(os.getenv("AE_LINK_BATCH_SIZE","50") or "50")  # source_values per link.generate call
+LAZY_AFFILIATE = os.getenv("LAZY_AFFILIATE","0") == "1"  # enqueue canonical URLs, wrap just before posting
+AFF_LOOKAHEAD = int(os.getenv("AFF_LOOKAHEAD","3") or "3")  # queue slots resolved ahead of the next post
+PRICE_REFRESH_WINDOW = int(os.getenv("PRICE_REFRESH_WINDOW","10") or "0")  # queue slots re-checked per productdetail call (0 = off)
+PRICE_REFRESH_AGE_MIN = float(os.getenv("PRICE_REFRESH_AGE_MIN","60") or "60")  # price older than this gets re-checked
+DETAIL_BATCH_SIZE = 20  # product_ids per productdetail.get call
+
 # Storage
 DATA_DIR = Path(os.getenv("DATA_DIR","data"))
-DATA_DIR.mkdir(parents=True, exist_ok=True)
+if not PARSE_WORKER:
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
 PENDING_CSV = DATA_DIR / "pending.csv"
 LOCK_PATH = DATA_DIR / "bot.lock"
 
 # ======= Bot / Web =======
-if not BOT_TOKEN:
+if not BOT_TOKEN and not PARSE_WORKER:
     print("[BOOT][ERR] Missing bot token", flush=True)
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")  # no network until a handler / __main__ uses it
+# outbound sends go through the rate-limit-aware scheduler (tg_send); channel posts first
+POST = ScheduledBot(bot, PRIO_CHANNEL)
+OUT = ScheduledBot(bot)
 app = Flask(__name__)
 
 # ======= Helpers (lock & queue) =======
+_PENDING_LOCK = threading.RLock()  # pulls enqueue from worker threads
+
 def is_locked() -> bool:
     return LOCK_PATH.exists()
 
@@ -72,7 +115,18 @@ def pending_count():
     with PENDING_CSV.open("r", encoding="utf-8") as f:
         return max(0, sum(1 for _ in f) - 1)
 
+def pending_ids():
+    if not PENDING_CSV.exists():
+        return set()
+    with PENDING_CSV.open("r", newline="", encoding="utf-8") as f:
+        return {r[0] for i, r in enumerate(csv.reader(f)) if i and r and r[0]}
+
 def append_rows(rows):
+    with _PENDING_LOCK:
+        _append_rows(rows)
+    safe_mark_queued([r.get("id") for r in rows])  # don't offer them again from the catalog
+
+def _append_rows(rows):
     ensure_pending_csv()
     with PENDING_CSV.open("a", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
@@ -88,6 +142,146 @@ def append_rows(rows):
             ])
 
 def pop_next_pending():
+    with _PENDING_LOCK:
+        return _pop_next_pending()
+
+def _canonical_item_url(url):
+    m = re.search(r'/item/(\d{8,})\.html', url or "")
+    return f"https://www.aliexpress.com/item/{m.group(1)}.html" if m else (url or "").strip()
+
+_RESOLVE_LOCK = threading.Lock()
+
+def resolve_ahead(n=None, blocking=True):
+    """Pre-send stage: wrap the next n unwrapped queue rows (one batched, cached call). Returns rows updated."""
+    if not _RESOLVE_LOCK.acquire(blocking=blocking):
+        return 0  # a background pass is already on it
+    try:
+        return _resolve_ahead(AFF_LOOKAHEAD if n is None else n)
+    finally:
+        _RESOLVE_LOCK.release()
+
+def _resolve_ahead(n):
+    with _PENDING_LOCK:
+        if not PENDING_CSV.exists():
+            return 0
+        with PENDING_CSV.open("r", newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+    todo = [r[2] for r in rows[1:1+n] if len(r) >= 7 and r[6] != "1" and r[2]]
+    if not todo:
+        return 0
+    res = to_affiliate_many(todo)   # network outside the queue lock
+    done = 0
+    with _PENDING_LOCK:
+        with PENDING_CSV.open("r", newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        for r in rows[1:]:
+            if len(r) >= 7 and r[6] != "1" and r[2] in res and res[r[2]][1]:
+                r[2], r[6] = res[r[2]][0], "1"
+                done += 1
+        if done:
+            with PENDING_CSV.open("w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(rows)
+    return done
+
+_REFRESH_LOCK = threading.Lock()
+
+def refresh_ahead(n=None):
+    """
+    Pre-send price check: when the next row's price is older than PRICE_REFRESH_AGE_MIN, re-read
+    every stale row of the next n slots with one productdetail.get, reprice them in place and drop
+    the affiliate rows AliExpress no longer returns (unwrapped scraped rows are kept as they were).
+    The ts column doubles as "price as of". Returns rows touched.
+    """
+    with _REFRESH_LOCK:
+        return _refresh_ahead(PRICE_REFRESH_WINDOW if n is None else n)
+
+def _refresh_ahead(n):
+    details_many = _ae_client()[1] if n > 0 else None
+    if not details_many:
+        return 0
+    with _PENDING_LOCK:
+        if not PENDING_CSV.exists():
+            return 0
+        with PENDING_CSV.open("r", newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+    now = time.time()
+    def stale(r):
+        ts = r[5] if len(r) > 5 else ""
+        return not ts.isdigit() or now - int(ts) > PRICE_REFRESH_AGE_MIN * 60
+    window = rows[1:1+n]
+    if not window or not stale(window[0]):
+        return 0  # the next post is fresh enough; check again when it isn't
+    ids = list(dict.fromkeys(r[0] for r in window if r and r[0].isdigit() and stale(r)))
+    if not ids:
+        return 0
+    try:
+        res = details_many(ids)   # network outside the queue lock
+    except Exception as e:
+        print(f"[REFRESH][WARN] productdetail for {len(ids)} items: {e}", flush=True)
+        return 0
+    repriced = dropped = 0
+    with _PENDING_LOCK:
+        with PENDING_CSV.open("r", newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        keep = rows[:1]
+        for r in rows[1:]:
+            if not r or r[0] not in res:
+                keep.append(r)
+                continue
+            p = res[r[0]]
+            r += [""] * (7 - len(r))
+            if p is None and r[6] != "1":
+                # scraped, not (yet) affiliate-wrapped: productdetail doesn't know it; keep it as it was
+                r[5] = str(int(now))
+                keep.append(r)
+                continue
+            if p is None:
+                print(f"[REFRESH] dropped {r[0]}: no longer available", flush=True)
+                dropped += 1
+                continue
+            price = str(getattr(p, "target_sale_price", "") or "").strip()
+            if price and price != r[3]:
+                r[3] = price
+                repriced += 1
+            r[5] = str(int(now))
+            keep.append(r)
+        with PENDING_CSV.open("w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(keep)
+    print(f"[REFRESH] {len(ids)} items in one call: {repriced} repriced, {dropped} dropped", flush=True)
+    return repriced + dropped
+
+def pop_next_ready():
+    """
+    Next item to publish. Prices of the next slots are re-checked first (refresh_ahead).
+    With LAZY_AFFILIATE the next slots are wrapped in one batch first; any row still unwrapped is resolved here;
+    with REQUIRE_AFFILIATE an item that still has no affiliate link is dropped, never posted.
+    """
+    while True:
+        try:
+            refresh_ahead()
+        except Exception as e:
+            print(f"[REFRESH][WARN] refresh_ahead: {e}", flush=True)
+        if LAZY_AFFILIATE:   # otherwise rows are wrapped at pull time; don't put a batch on the post path
+            try:
+                resolve_ahead()
+            except Exception as e:
+                print(f"[AFF][WARN] resolve_ahead: {e}", flush=True)
+        item = pop_next_pending()
+        if not item or item.get("aff_ok") == "1":
+            break
+        link, ok = to_affiliate(item.get("url",""))
+        if ok:
+            item["url"], item["aff_ok"] = link, "1"
+            break
+        if not REQUIRE_AFFILIATE:
+            break
+        print(f"[AFF] dropped {item.get('item_id')} at publish time: no affiliate link", flush=True)
+    # warm the next slots in the background so the following post doesn't wait on the API
+    if LAZY_AFFILIATE:
+        threading.Thread(target=resolve_ahead, kwargs={"blocking": False}, daemon=True).start()
+    return item
+
+def _pop_next_pending():
     if not PENDING_CSV.exists():
         return None
     with PENDING_CSV.open("r", newline="", encoding="utf-8") as f:
@@ -112,54 +306,26 @@ _UA_LIST = [
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
 ]
 def _sess():
-    s = requests.Session()
-    s.headers.update({
-        "User-Agent": random.choice(_UA_LIST),
-        "Accept-Language":"en-US,en;q=0.9",
-        "Accept":"text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-    })
-    return s
-
-def _fetch_html(url, s, timeout=(7,10)):
-    r = s.get(url, timeout=timeout, allow_redirects=True)
-    r.raise_for_status()
-    return r.text
-
-# Accept any xx.aliexpress.(com|us|...)/item/....html and also protocol-relative links
-_ITEM_RE = re.compile(r'(?:https?:)?//[a-z\-]*\.?aliexpress\.(?:com|us)/item/[^\s"<>]*?(\d{8,})\.html[^\s"<>]*', re.I)
-
-def _parse_item_links(html):
-    out, seen = [], set()
-    # Normal absolute or protocol-relative item URLs
-    for m in _ITEM_RE.finditer(html):
-        url, pid = m.group(0), m.group(1)
-        if url.startswith("//"):
-            url = "https:" + url
-        if url in seen: 
-            continue
-        seen.add(url)
-        out.append({"id": pid, "url": url})
-    # Mobile relative hrefs
-    for m in re.finditer(r'href=["\'](/item/(\d{8,})\.html)["\']', html):
-        pid = m.group(2); url = f"https://m.aliexpress.com/item/{pid}.html"
-        if url in seen: continue
-        seen.add(url); out.append({"id": pid, "url": url})
-    # data-href attributes commonly used in grid items
-    for m in re.finditer(r'data-href=["\'](//[^"\']*?/item/(\d{8,})\.html[^"\']*)["\']', html):
-        url, pid = m.group(1), m.group(2)
-        if url.startswith("//"): url = "https:" + url
-        if url in seen: continue
-        seen.add(url); out.append({"id": pid, "url": url})
-    # productId JSON — reconstruct URL
-    for m in re.finditer(r'["\']productId["\']\s*:\s*["\'](\d{8,})["\']', html):
-        pid = m.group(1); url = f"https://www.aliexpress.com/item/{pid}.html"
-        if url in seen: continue
-        seen.add(url); out.append({"id": pid, "url": url})
-    return out
+    # shared pooled session (keep-alive across pulls)
+    return get_session("scrape")
+
+def _fetch_raw(url, s, timeout=None):
+    timeout = timeout or timeout_for(url, (7,10))  # adaptive per host, (7,10) until it has samples
+    headers = {"User-Agent": random.choice(_UA_LIST), "Accept-Language":"en-US,en;q=0.9"}
+    # streamed with a size cap; captcha/interstitial pages abort after the first few KB
+    return fetch_capped(s, url, headers=headers, timeout=timeout, allow_redirects=True)
+
+def _fetch_html(url, s, timeout=None):
+    return _fetch_raw(url, s, timeout=timeout).text
 
-def _scrape_meta(url, s):
+_parse_item_links = ae_parse.item_links  # moved to ae_parse so it can run in a worker process
+
+def _scrape_meta(url, s, deadline=None):
     try:
-        h = _fetch_html(url, s, timeout=(5,8))
+        timeout = timeout_for(url, (5,8))
+        timeout = deadline.clip(timeout, floor=3.0) if deadline else timeout
+        with retry_budget():
+            h = _fetch_html(url, s, timeout=timeout)
         title = None
         m = re.search(r'property=["\']og:title["\'][^>]+content=["\']([^"\']+)["\']', h)
         if m: title = m.group(1)
@@ -169,15 +335,20 @@ def _scrape_meta(url, s):
         m = re.search(r'property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', h)
         if m: img = m.group(1)
         pid_match = re.search(r'(\d{8,})\.html', url); pid = pid_match.group(1) if pid_match else ""
+        SOURCES.record(url, "hit", len(h))
         return {"id": pid, "title": (title or "AliExpress product").strip(), "url": url, "image_url": img or "", "price": ""}
+    except (BlockedPage, BodyTooLarge) as e:
+        SOURCES.record(url, "blocked" if isinstance(e, BlockedPage) else "too_large")
+        print(f"[META][WARN] {url} -> {e}", flush=True)
+        return None
     except Exception as e:
+        SOURCES.record(url, "error")
         print(f"[META][WARN] {url} -> {e}", flush=True)
         return None
 
-def discover(query, limit=12):
-    s = _sess()
+def _search_urls(query):
     q = quote_plus(query)
-    urls = [
+    return [
         f"https://m.aliexpress.com/search.htm?keywords={q}&g=y&SortType=total_tranpro_desc",
         f"https://m.aliexpress.com/search?keywords={q}&g=y&SortType=total_tranpro_desc",
         f"https://m.aliexpress.com/wholesale/{q}.html?g=y&SortType=total_tranpro_desc",
@@ -188,53 +359,104 @@ def discover(query, limit=12):
     ] + [  # search engine HTML fallbacks
         f"https://duckduckgo.com/html/?q={quote_plus('site:aliexpress.com/item ' + query)}&s={off}" for off in [0,30,60,90]
     ]
+
+def _collect_links(query, limit=12, s=None, deadline=None, exclude_ids=frozenset()):
+    """Link-collection stage only: returns up to `limit` {"id","url"} dicts, unique by item id, none in exclude_ids."""
+    s = s or _sess()
     found = []
-    for u in urls:
+    for u in _search_urls(query):
+        if deadline and deadline.expired():
+            print(f"[DISCOVER][DEADLINE] '{query}' stopped with {len(found)} links", flush=True)
+            break
         try:
-            html = _fetch_html(u, s)
-            links = _parse_item_links(html)
-            found += links
+            timeout = timeout_for(u, (7,10))
+            with retry_budget():  # one budget per search URL, shared by urllib3 retries and 429 resends
+                r = _fetch_raw(u, s, timeout=deadline.clip(timeout) if deadline else timeout)
+            links = ae_parse.parse(ae_parse.item_links, r.content, r.encoding or "utf-8")
+            found += [l for l in links if l["id"] not in exclude_ids]
+            SOURCES.record(u, "hit" if links else "miss", len(r.content))
             if links:
                 print(f"[DISCOVER][HIT] {u} -> {len(links)} links", flush=True)
             else:
                 print(f"[DISCOVER][MISS] {u}", flush=True)
             if len(found) >= limit*2:
                 break
+        except BlockedPage as e:
+            SOURCES.record(u, "blocked")
+            print(f"[DISCOVER][BLOCKED] {u} -> {e}", flush=True)
+        except BodyTooLarge as e:
+            SOURCES.record(u, "too_large")
+            print(f"[DISCOVER][WARN] {u} -> {e}", flush=True)
         except Exception as e:
+            SOURCES.record(u, "error")
             print(f"[DISCOVER][WARN] {u} -> {e}", flush=True)
     uniq, seen = [], set()
     for it in found:
-        if it["url"] in seen: continue
-        seen.add(it["url"]); uniq.append(it["url"])
+        if it["id"] in seen: continue
+        seen.add(it["id"]); uniq.append(it)
         if len(uniq) >= limit: break
-    items = []
-    for u in uniq:
-        m = _scrape_meta(u, s)
-        if m: items.append(m)
-    print(f"[DISCOVER] '{query}' -> {len(items)} items", flush=True)
-    return items
+    return uniq
 
 # ======= Affiliate wrapping =======
+_AE_CLIENT = None
+_AE_CLIENT_LOCK = threading.Lock()
+
+def _ae_client():
+    """(make_many, details_many) or (None, None). The SDK is imported and the client built on first use, once."""
+    global _AE_CLIENT
+    if _AE_CLIENT is None:
+        with _AE_CLIENT_LOCK:
+            if _AE_CLIENT is None:
+                _AE_CLIENT = _aliexpress_api_client() or (None, None)
+    return _AE_CLIENT
+
 def _aliexpress_api_client():
     if not (AE_APP_KEY and AE_APP_SECRET and AE_TRACKING_ID):
         return None
     try:
         from aliexpress_api import AliexpressApi, models
-        lang_map = {k:getattr(models.Language,k) for k in dir(models.Language) if k.isupper()}
-        cur_map  = {k:getattr(models.Currency,k) for k in dir(models.Currency) if k.isupper()}
-        lang = lang_map.get(LANG, models.Language.EN)
-        cur  = cur_map.get(CURRENCY.upper(), models.Currency.USD)
+        # enum members are plain attributes: look them up directly instead of scanning dir()
+        lang = getattr(models.Language, LANG, None) or models.Language.EN
+        # members are plain code strings and the enum has no ILS: pass the code through as-is
+        cur  = getattr(models.Currency, AE_CURRENCY_CODE, None) or AE_CURRENCY_CODE
         api = AliexpressApi(AE_APP_KEY, AE_APP_SECRET, lang, cur, AE_TRACKING_ID, session=None)
-        def make(url: str):
-            try:
-                links = api.get_affiliate_links(url)
-                if links and getattr(links[0], "promotion_link", None):
-                    return links[0].promotion_link
-            except Exception as e:
-                print(f"[AEAPI][ERR] {e}", flush=True)
-            return None
+        def make_many(urls):
+            """{url: promotion link or None}; link.generate takes comma-separated source_values."""
+            out = dict.fromkeys(urls)
+            for i in range(0, len(urls), AFF_BATCH_SIZE):
+                chunk = urls[i:i+AFF_BATCH_SIZE]
+                try:
+                    links = api.get_affiliate_links(",".join(chunk)) or []
+                except Exception as e:
+                    print(f"[AEAPI][ERR] batch of {len(chunk)}: {e}", flush=True)
+                    continue
+                # same mapping as the REST client: exact echo, then product id, order only as a last resort
+                for u, link in match_links(chunk, ((getattr(l, "source_value", None), getattr(l, "promotion_link", None))
+                                                   for l in links)).items():
+                    out[u] = link
+            return out
+        def details_many(ids):
+            """{item_id: product, or None when AliExpress no longer returns it}; raises if a call fails."""
+            from aliexpress_api.errors import ProductsNotFoudException
+            out = dict.fromkeys(ids)
+            def fetch(chunk):
+                try:
+                    prods = api.get_products_details(chunk, country=SHIP_TO) or []
+                except ProductsNotFoudException:
+                    # one missing id can fail the whole call: split until the missing ones are isolated
+                    if len(chunk) > 1:
+                        fetch(chunk[:len(chunk)//2])
+                        fetch(chunk[len(chunk)//2:])
+                    return
+                for p in prods:
+                    pid = str(getattr(p, "product_id", "") or "")
+                    if pid in out:
+                        out[pid] = p
+            for i in range(0, len(ids), DETAIL_BATCH_SIZE):
+                fetch(ids[i:i+DETAIL_BATCH_SIZE])
+            return out
         print("[AEAPI] Ready", flush=True)
-        return make
+        return make_many, details_many
     except Exception as e:
         print(f"[AEAPI][WARN] {e}", flush=True)
         return None
@@ -250,25 +472,56 @@ def _s_click_fallback(url: str):
         target += f"?shipCountry={quote_plus(SHIP_TO)}"
     return f"{base}?aff_short_key={quote_plus(AE_AFF_SHORT_KEY)}&dl_target_url={quote_plus(target)}"
 
-AFF_MAKER = _aliexpress_api_client()
+def _affiliate_info_many(urls, deadline=None):
+    """{url: (link, ok, source, cached)}: persistent cache first, then one batched link.generate for the misses."""
+    us = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+    make_many = _ae_client()[0]
+    try:
+        cached = AFF_CACHE.get_many(us, AE_TRACKING_ID)
+    except Exception as e:
+        print(f"[AFF][CACHE][WARN] {e}", flush=True)
+        cached = {}
+    out = {}
+    for u, (link, source) in cached.items():
+        # s.click entries are only a stand-in: retry the API for them once it's configured
+        if source == "s.click" and make_many:
+            continue
+        out[u] = (link or u, source != "no-aff", source, True)
+    todo = [u for u in us if u not in out]
+    # Out of time: the s.click fallback needs no network call, so prefer it over the API
+    late = deadline is not None and deadline.expired() and bool(AE_AFF_SHORT_KEY)
+    api = make_many(todo) if (make_many and todo and not late) else {}
+    if api:
+        print(f"[AFF] API {sum(1 for v in api.values() if v)}/{len(todo)} in one batch ({len(us)-len(todo)} cached)", flush=True)
+    fresh = []
+    for u in todo:
+        link = api.get(u)
+        if link:
+            out[u] = (link, True, "api", False)
+        elif (link := _s_click_fallback(u)):
+            print(f"[AFF] s.click OK -> {link[:80]}...", flush=True)
+            out[u] = (link, True, "s.click", False)
+        else:
+            print(f"[AFF] NO-AFF {u[:80]}", flush=True)
+            out[u] = (u, False, "no-aff", False)
+        # an API failure while late/unconfigured isn't evidence the product can't be wrapped
+        if out[u][2] != "no-aff" or (make_many and not late):
+            fresh.append((u, out[u][0] if out[u][1] else "", out[u][2]))
+    try:
+        AFF_CACHE.put_many(fresh, AE_TRACKING_ID)
+    except Exception as e:
+        print(f"[AFF][CACHE][WARN] {e}", flush=True)
+    return out
+
+def to_affiliate_many(urls, deadline=None):
+    """{url: (link, ok)} for many URLs with one link.generate round trip per AFF_BATCH_SIZE."""
+    return {u: (link, ok) for u, (link, ok, _, _) in _affiliate_info_many(urls, deadline).items()}
 
-def to_affiliate(url: str):
+def to_affiliate(url: str, deadline=None):
     u = (url or "").strip()
     if not u:
         return u, False
-    if AFF_MAKER:
-        link = AFF_MAKER(u)
-        if link:
-            print(f"[AFF] API OK -> {link[:80]}...", flush=True)
-            return link, True
-        else:
-            print("[AFF] API FAIL", flush=True)
-    link = _s_click_fallback(u)
-    if link:
-        print(f"[AFF] s.click OK -> {link[:80]}...", flush=True)
-        return link, True
-    print("[AFF] NO-AFF", flush=True)
-    return u, False
+    return to_affiliate_many([u], deadline)[u]
 
 # ======= UI =======
 CATS = [
@@ -314,11 +567,12 @@ def send_item(item, chat_id):
         kb.add(types.InlineKeyboardButton(btn_txt, url=url))
     try:
         if img:
-            bot.send_photo(chat_id, img, caption=text, reply_markup=kb)
+            POST.send_photo(chat_id, img, caption=text, reply_markup=kb)
         else:
-            bot.send_message(chat_id, text, reply_markup=kb)
+            POST.send_message(chat_id, text, reply_markup=kb)
     except Exception:
-        bot.send_message(chat_id, text + "\n\n(תמונה לא נשלחה)", reply_markup=kb)
+        # throttling never gets here (the scheduler waits it out); this is a rejected image
+        POST.send_message(chat_id, text + "\n\n(תמונה לא נשלחה)", reply_markup=kb)
 
 # ======= Commands =======
 @bot.message_handler(commands=["start","menu"])
@@ -343,31 +597,251 @@ def cmd_status(m):
 def cmd_post(m):
     if is_locked():
         return bot.reply_to(m,"הבוט כבוי.")
-    item = pop_next_pending()
+    item = pop_next_ready()
     if not item:
         return bot.reply_to(m, "אין פריטים בתור.")
     target = TARGET_CHAT_ID or m.chat.id
     send_item(item, target)
     bot.reply_to(m, f"✅ פורסם. נותרו: {pending_count()}")
 
+@bot.message_handler(commands=["netstats"])
+def cmd_netstats(m):
+    bot.reply_to(m, f"🔌 HTTP pools\n{format_pool_stats()}\n\n⏱️ Rate limits\n{LIMITER.format_stats()}\n\n🛰️ Gateways\n{ae_gateways.format_stats()}\n\n⌛ Timeouts\n{ae_timeouts.format_stats()}\n\n🔎 Sources\n{SOURCES.format_stats()}\n\n🧦 Proxies\n{PROXIES.format_stats()}\n\n🔗 Affiliate cache\n{AFF_CACHE.stats()}\n\n🧠 API memo\n{MEMO.stats()}\n\n📤 Telegram sends\n{SCHEDULER.stats()}")
+
 @bot.message_handler(commands=["aff_test"])
 def cmd_aff_test(m):
     parts = (m.text or "").split(None,1)
     if len(parts) < 2:
         return bot.reply_to(m,"שימוש: /aff_test <url>")
     u = parts[1].strip()
-    aff, ok = to_affiliate(u)
-    bot.reply_to(m, f"{'✅' if ok else '⚠️ NO-AFF'}\n{aff}")
+    aff, ok, source, cached = _affiliate_info_many([u])[u]
+    bot.reply_to(m, f"{'✅' if ok else '⚠️ NO-AFF'} ({source}{', cache' if cached else ''})\n{aff}")
+
+@bot.message_handler(commands=["catalog"])
+def cmd_catalog(m):
+    parts = (m.text or "").split(None,1)
+    if len(parts) < 2:
+        return bot.reply_to(m, f"📚 בקטלוג: {CATALOG.count()} מוצרים\nשימוש: /catalog <מילת חיפוש>")
+    t0 = time.time()
+    hits = safe_search(parts[1], limit=10)
+    lines = [f"{h['item_id']} | {h['price'] or '-'} {h['currency']} | {h['title'][:60]}" for h in hits]
+    bot.reply_to(m, "\n".join(lines or ["אין תוצאות בקטלוג"]) + f"\n⏱️ {(time.time()-t0)*1000:.0f}ms")
 
 # ======= Callbacks =======
-def _discover_many(queries, limit_each=6):
-    res = []
+def _discover_links_many(queries, limit_each=6, total=12, deadline=None, exclude_ids=()):
+    # Stage 1: link collection for all queries in parallel
+    exclude_ids = {str(x) for x in exclude_ids}
+    workers = max(1, min(DISCOVER_WORKERS, len(queries)))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        per_query = list(ex.map(lambda q: _collect_links(q, limit=limit_each, deadline=deadline, exclude_ids=exclude_ids), queries))
+    # Stage 2: global dedupe by item id (query order kept), before any meta scraping
+    uniq, seen = [], set()
+    for links in per_query:
+        for it in links:
+            if it["id"] in seen: continue
+            seen.add(it["id"]); uniq.append(it)
+    uniq = uniq[:total]
+    print(f"[DISCOVER] {len(queries)} queries -> {sum(len(l) for l in per_query)} links, {len(uniq)} unique", flush=True)
+    return uniq
+
+_ITEM_POOL = ThreadPoolExecutor(max_workers=META_WORKERS, thread_name_prefix="pull-item")
+_AFF_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pull-aff")  # separate: item tasks wait on it
+# background warming gets its own small pools so it never queues ahead of a user's deadline-bound pull
+_WARM_ITEM_POOL = ThreadPoolExecutor(max_workers=max(1, WARM_WORKERS), thread_name_prefix="warm-item")
+_WARM_AFF_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warm-aff")
+
+def _batch_affiliate(aff, url, deadline):
+    """This URL's (link, ok) from the pull's batched link.generate future; single call if it isn't there in time."""
+    if aff is not None:
+        rem = deadline.remaining() if deadline else float("inf")
+        try:
+            res = aff.result(timeout=None if rem == float("inf") else max(0.5, rem))
+            if url in res:
+                return res[url]
+        except Exception as e:
+            print(f"[AFF][WARN] batch unavailable ({e.__class__.__name__}); wrapping singly", flush=True)
+    return to_affiliate(url, deadline)
+
+def _prepare_item(link, s, deadline=None, bump=None, aff=None):
+    """meta + affiliate for one link -> ready item, or None (no meta / affiliate required but missing)."""
+    bump = bump or (lambda **kw: None)
+    with retry_budget():  # meta + affiliate share one retry budget
+        it = _scrape_meta(link["url"], s, deadline)
+        if not it:
+            bump(meta_fail=1)
+            return None
+        bump(metas=1)
+        if LAZY_AFFILIATE:
+            # wrapped (batched + cached) by the pre-send stage, only if it actually gets posted
+            it["url"], it["aff_ok"] = _canonical_item_url(it["url"]), False
+            return it
+        url_aff, ok = _batch_affiliate(aff, it["url"], deadline)
+    it["url"] = url_aff
+    it["aff_ok"] = ok
+    bump(**({"aff_ok": 1} if ok else {"aff_fail": 1}))
+    return it if (ok or not REQUIRE_AFFILIATE) else None
+
+def _safe_result(f):
+    try:
+        return f.result()
+    except Exception as e:
+        print(f"[PULL][WARN] {e}", flush=True)
+        return None
+
+def _pull_category(queries, deadline=None, on_item=None, stats=None, on_progress=None,
+                   item_pool=None, aff_pool=None, total=12, exclude_ids=()):
+    """
+    Full pull for a category: links -> unique -> meta+affiliate per item.
+    on_item(item) is called from worker threads as soon as each item is ready,
+    including items that finish after the deadline. The return value is the
+    list of items ready when the deadline hit (everything, without a deadline).
+    stats is filled with live counters; on_progress(stats) fires on every change.
+    item_pool / aff_pool default to the interactive pools (_ITEM_POOL / _AFF_POOL).
+    At most `total` new items: ids already pending or in exclude_ids are skipped before scraping.
+    """
+    deadline = deadline or Deadline(None)
+    stats = stats if stats is not None else {}
+    stats.update({"links": 0, "metas": 0, "meta_fail": 0, "aff_ok": 0, "aff_fail": 0,
+                  "enqueued": 0, "finished": 0, "late": 0, "done": False})
+    lock = threading.Lock()
+    def bump(**kw):
+        with lock:
+            for k, v in kw.items():
+                stats[k] = stats.get(k, 0) + v
+            stats["done"] = stats["finished"] >= stats["links"] and "links_done" in stats
+        if on_progress:
+            on_progress(stats)
+    # ids already queued (or just enqueued from the warmer / catalog) are skipped before any scraping
+    links = _discover_links_many(queries, limit_each=6, total=total, deadline=deadline.sub(LINK_STAGE_SHARE),
+                                 exclude_ids=pending_ids() | set(exclude_ids))
+    stats["links_done"] = True
+    bump(links=len(links))
+    s = _sess()
+    # one link.generate round trip for the whole pull, running while the item pages are scraped
+    aff = (aff_pool or _AFF_POOL).submit(to_affiliate_many, [l["url"] for l in links], deadline) if (links and not LAZY_AFFILIATE) else None
+    def run(link):
+        it = None
+        try:
+            it = _prepare_item(link, s, deadline, bump, aff)
+            if it:
+                safe_upsert([it], source="pull")
+            if it and on_item:
+                on_item(it)
+                bump(enqueued=1)
+        finally:
+            bump(finished=1)
+        return it
+    futs = [(item_pool or _ITEM_POOL).submit(run, it) for it in links]
+    rem = deadline.remaining()
+    done, late = wait(futs, timeout=None if rem == float("inf") else rem)
+    ready = [r for r in (_safe_result(f) for f in futs if f in done) if r]
+    stats["late"] = len(late)
+    if late:
+        print(f"[PULL][DEADLINE] {len(ready)} ready, {len(late)} continue in background", flush=True)
+    return ready
+
+def _catalog_take(queries, n, exclude_ids=()):
+    """Up to n catalog items matching the category queries, as pending rows; skips queued ids and exclude_ids."""
+    out, exclude = [], pending_ids() | {str(x) for x in exclude_ids}
     for q in queries:
-        items = discover(q, limit=limit_each)
-        res += items
-        if len(res) >= 12:
+        if len(out) >= n:
             break
-    return res[:12]
+        for h in safe_search(q, limit=n - len(out), exclude_ids=exclude, require_aff=REQUIRE_AFFILIATE and not LAZY_AFFILIATE):
+            exclude.add(h["item_id"])
+            out.append({"id": h["item_id"], "title": h["title"], "url": h["aff_url"] or h["url"],
+                        "price": h["price"] or "", "image_url": h["image"], "aff_ok": bool(h["aff_url"])})
+    return out
+
+class _PullProgress:
+    """
+    One status message per pull, edited at most every PROGRESS_EDIT_SEC. Edits go through the
+    send scheduler (429s are waited out there) without blocking the pull: while one edit is
+    queued, later updates only mark the message dirty and the newest state follows it.
+    """
+    def __init__(self, chat_id, title="⏳ שואב פריטים…"):
+        self.chat_id = chat_id
+        self.title = title
+        self.msg = None
+        self.text = ""
+        self.stats = {}
+        self.next_ok = 0.0
+        self.timer = None
+        self.inflight = None   # Future of the queued edit
+        self.dirty = False
+        self.lock = threading.RLock()   # an edit that finishes at once calls back under it
+        try:
+            self.msg = OUT.send_message(chat_id, title)
+        except Exception as e:
+            print(f"[PROGRESS][WARN] {e}", flush=True)
+
+    def render(self):
+        st = self.stats
+        lines = [self.title if not st.get("done") else "✅ השאיבה הסתיימה",
+                 f"🔗 קישורים: {st.get('links', 0)}",
+                 f"📄 מטא: {st.get('metas', 0)} (נכשלו {st.get('meta_fail', 0)})",
+                 "💰 אפילייט: ייוצר לפני הפרסום" if LAZY_AFFILIATE else
+                 f"💰 אפילייט: {st.get('aff_ok', 0)} ✅ / {st.get('aff_fail', 0)} ⚠️",
+                 f"📥 נוספו לתור: {st.get('enqueued', 0)}"]
+        if st.get("done"):
+            lines.append(f"בתור: {pending_count()}")
+        return "\n".join(lines)
+
+    def update(self, stats=None):
+        if stats is not None:
+            self.stats = stats
+        with self.lock:
+            wait_s = self.next_ok - time.time()
+            if wait_s > 0:
+                # throttled: make sure the latest state still gets flushed
+                if self.timer is None:
+                    self.timer = threading.Timer(wait_s, self._flush_later)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+            self._edit()
+
+    def _flush_later(self):
+        with self.lock:
+            self.timer = None
+            self._edit()
+
+    def _edit(self):
+        if self.msg is None:
+            return
+        if self.inflight is not None and not self.inflight.done():
+            self.dirty = True
+            return
+        text = self.render()
+        if text == self.text:
+            return
+        self.next_ok = time.time() + PROGRESS_EDIT_SEC
+        self.inflight = SCHEDULER.submit(bot.edit_message_text, self.chat_id, text, self.chat_id,
+                                         self.msg.message_id, priority=PRIO_ADMIN)
+        self.inflight.add_done_callback(lambda f, text=text: self._edited(f, text))
+
+    def _edited(self, f, text):
+        e = f.exception()
+        if e is None:
+            self.text = text
+        elif "message is not modified" not in str(e):
+            print(f"[PROGRESS][WARN] {e}", flush=True)
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+        self.update()
+
+WARMER = None
+
+def start_warmer():
+    global WARMER
+    if not WARM_ENABLED:
+        print("[WARM] WARM_ENABLED=0 -> warmer disabled", flush=True)
+        return None
+    from ae_warmer import start_category_warmer
+    pull = lambda queries: _pull_category(queries, item_pool=_WARM_ITEM_POOL, aff_pool=_WARM_AFF_POOL)
+    WARMER = start_category_warmer(pull, CATS, known_ids_fn=pending_ids)
+    return WARMER
 
 @bot.callback_query_handler(func=lambda c: True)
 def on_cb(c):
@@ -395,7 +869,7 @@ def on_cb(c):
         if data == "post_now":
             if is_locked():
                 return bot.answer_callback_query(c.id,"כבוי.", show_alert=True)
-            item = pop_next_pending()
+            item = pop_next_ready()
             if not item:
                 return bot.answer_callback_query(c.id,"אין פריטים בתור", show_alert=True)
             send_item(item, TARGET_CHAT_ID or c.message.chat.id)
@@ -406,27 +880,41 @@ def on_cb(c):
                 return bot.answer_callback_query(c.id,"כבוי.", show_alert=True)
             cid = data.split(":",1)[1]
             queries = next((qs for k,_,qs in CATS if k==cid), [cid])
+            warm = WARMER.take(cid, 12) if WARMER else []
+            # local catalog next (milliseconds); the network only tops up what's still missing,
+            # skipping everything already queued (work() passes the count and ids below)
+            if len(warm) < 12:
+                # the warmer upserts its items into the catalog too: don't take them a second time
+                warm += _catalog_take(queries, 12 - len(warm), exclude_ids={w.get("id") for w in warm})
+            if len(warm) >= 12:
+                append_rows(warm)
+                try:
+                    bot.answer_callback_query(c.id, f"✅ נוספו {len(warm)}")
+                except Exception:
+                    pass
+                # lazy rows are wrapped only right before posting (pop_next_ready)
+                kind = "פריטים אפילייט" if all(w.get("aff_ok") for w in warm) else "פריטים"
+                OUT.send_message(c.message.chat.id, f"✅ נוספו {len(warm)} {kind}. בתור: {pending_count()}")
+                return
+            if warm:
+                append_rows(warm)
+                OUT.send_message(c.message.chat.id, f"✅ נוספו {len(warm)} פריטים מהקטלוג, משלים מהרשת…")
             try:
                 bot.answer_callback_query(c.id, "⏳ שואב פריטים…")
             except Exception:
                 pass
             def work():
                 try:
-                    items = _discover_many(queries, limit_each=6)
-                    affed = []
-                    for it in items:
-                        url_aff, ok = to_affiliate(it["url"])
-                        it["url"] = url_aff
-                        it["aff_ok"] = ok
-                        if ok or not REQUIRE_AFFILIATE:
-                            affed.append(it)
-                    if not affed:
-                        bot.send_message(c.message.chat.id, "ℹ️ לא נמצאו פריטים אפילייט כרגע, נסה שוב.")
-                        return
-                    append_rows(affed)
-                    bot.send_message(c.message.chat.id, f"✅ נוספו {len(affed)} פריטים אפילייט. בתור: {pending_count()}")
+                    progress = _PullProgress(c.message.chat.id)
+                    stats = {}
+                    # items are enqueued one by one as they become ready; the status message tracks it
+                    _pull_category(queries, Deadline(PULL_DEADLINE_SEC), on_item=lambda it: append_rows([it]),
+                                   stats=stats, on_progress=progress.update,
+                                   total=12 - len(warm), exclude_ids={w.get("id") for w in warm})
+                    if stats.get("done") and not stats.get("enqueued"):
+                        OUT.send_message(c.message.chat.id, "ℹ️ לא נמצאו פריטים אפילייט כרגע, נסה שוב.")
                 except Exception as e:
-                    bot.send_message(c.message.chat.id, f"שגיאה בשאיבה: {e}")
+                    OUT.send_message(c.message.chat.id, f"שגיאה בשאיבה: {e}")
             threading.Thread(target=work, daemon=True).start()
             return
     except Exception as e:
@@ -492,4 +980,5 @@ if __name__ == "__main__":
     if os.getenv("BOT_ALWAYS_ON","1") == "1":
         set_locked(False)
     setup_webhook()
+    start_warmer()
     run_server()
@@ -15,7 +15,16 @@ from telebot import types
 from telebot import types as _tb_types
 from aliexpress_affiliate import AliExpressAffiliateClient
 import time as _time_aff
+from ae_http import get_session
+from tg_filecache import send_cached
+from tg_send import ScheduledBot, PRIO_CHANNEL
+from tg_burst import BURST_SIZE, burst_due, digest_caption, send_burst
+try:
+    from ae_catalog import safe_upsert as CATALOG_UPSERT  # uploaded exports feed the local catalog
+except Exception:
+    CATALOG_UPSERT = None
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, time as dtime
 from zoneinfo import ZoneInfo
 import socket
@@ -37,6 +46,12 @@ PENDING_CSV = os.path.join(BASE_DIR, "products_queue_managed.csv")  # תור ה
 DELAY_FILE = os.path.join(BASE_DIR, "post_delay.txt")    # מרווח שידור
 PUBLIC_PRESET_FILE  = os.path.join(BASE_DIR, "public_target.preset")
 PRIVATE_PRESET_FILE = os.path.join(BASE_DIR, "private_target.preset")
+FANOUT_FILE = os.path.join(BASE_DIR, "fanout_targets.preset")  # יעדים נוספים לכל פוסט (שורה לכל יעד)
+DELIVERY_LOG = os.path.join(BASE_DIR, "delivery_log.csv")      # תיעוד מסירה לכל יעד
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", "8"))
+FANOUT_MAX_RETRIES = int(os.environ.get("FANOUT_MAX_RETRIES", "3"))  # ניסיונות חוזרים ליעדים שנכשלו
+PRICE_REFRESH_WINDOW = int(os.environ.get("PRICE_REFRESH_WINDOW", "10") or "0")  # פריטים קרובים בתור לכל קריאת productdetail (0 = כבוי)
+PRICE_REFRESH_AGE_MIN = float(os.environ.get("PRICE_REFRESH_AGE_MIN", "60") or "60")  # מחיר ישן מזה נבדק מחדש
 
 # דגלים
 SCHEDULE_FLAG_FILE = os.path.join(BASE_DIR, "schedule_enforced.flag")
@@ -53,6 +68,7 @@ if not BOT_TOKEN:
     print("[WARN] BOT_TOKEN חסר – הבוט ירוץ אבל לא יוכל להתחבר לטלגרם עד שתקבע ENV.", flush=True)
 
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+POST = ScheduledBot(bot, PRIO_CHANNEL)  # פרסומים לערוץ דרך מתזמן השליחה (429 / retry_after)
 
 
 print("🚀 Booting Telegram bot...", flush=True)
@@ -62,7 +78,7 @@ try:
 except Exception:
     pass
 print(f"HAS_BOT_TOKEN={'BOT_TOKEN' in os.environ}", flush=True)
-SESSION = requests.Session()
+SESSION = get_session("tg_media")  # pooled keep-alive session for media downloads
 # === Affiliates Inline Panel (init) ===
 try:
     AE = AliExpressAffiliateClient()  # Uses ENV: AE_APP_KEY / AE_APP_SECRET / AE_TRACKING_ID
@@ -82,7 +98,6 @@ def _require_ae(_msg_or_chat_id):
             pass
         return False
     return True
-SESSION.headers.update({"User-Agent": "TelegramPostBot/1.0"})
 IL_TZ = ZoneInfo("Asia/Jerusalem")
 
 def translate_missing_fields(csv_path):
@@ -495,8 +510,88 @@ def post_to_channel(product):
         print(f"[{datetime.now(tz=IL_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}] Failed to post: {e}", flush=True)
 
 
+# ========= PRE-SEND PRICE CHECK =========
+_REFRESH_LOCK = threading.Lock()
+
+def refresh_ahead(n=None) -> int:
+    """
+    When the next item's price is older than PRICE_REFRESH_AGE_MIN, re-read every stale item of the
+    next n (PRICE_REFRESH_WINDOW) with one productdetail/get call: SalePrice / OriginalPrice / Discount
+    are updated in place in the managed CSV and items AliExpress no longer returns are dropped.
+    PriceCheckedAt (epoch seconds) marks the check. Returns items touched.
+    """
+    n = PRICE_REFRESH_WINDOW if n is None else n
+    if AE is None or n <= 0:
+        return 0
+    with _REFRESH_LOCK:
+        with FILE_LOCK:
+            window = read_products(PENDING_CSV)[:n]
+        now = int(time.time())
+        def stale(p):
+            ts = str(p.get("PriceCheckedAt") or "")
+            return not ts.isdigit() or now - int(ts) > PRICE_REFRESH_AGE_MIN * 60
+        if not window or not stale(window[0]):
+            return 0  # the next post is fresh enough; check again when it isn't
+        ids = [i for i in dict.fromkeys(str(p.get("ItemId") or "").strip() for p in window if stale(p)) if i.isdigit()]
+        if not ids:
+            return 0
+        try:
+            res = AE.product_details(ids, chunk_size=len(ids), strict=True)   # network outside FILE_LOCK
+        except Exception as e:
+            print(f"[REFRESH][WARN] productdetail for {len(ids)} items: {e}", flush=True)
+            return 0
+        if not res:   # unparsable / empty answer: no evidence that anything is gone
+            print(f"[REFRESH][WARN] productdetail returned nothing for {len(ids)} items; keeping them", flush=True)
+            return 0
+        repriced = dropped = 0
+        with FILE_LOCK:
+            keep = []
+            for p in read_products(PENDING_CSV):
+                iid = str(p.get("ItemId") or "").strip()
+                if iid not in ids:
+                    keep.append(p)
+                    continue
+                d = res.get(iid)
+                if d is None:
+                    print(f"[REFRESH] dropped {iid}: no longer available", flush=True)
+                    dropped += 1
+                    continue
+                fresh = {"SalePrice": clean_price_text(d.get("target_sale_price")),
+                         "OriginalPrice": clean_price_text(d.get("target_original_price")),
+                         "Discount": str(d.get("discount") or "").strip()}
+                changed = [k for k, v in fresh.items() if v and v != p.get(k)]
+                for k in changed:
+                    p[k] = fresh[k]
+                repriced += bool(changed)
+                p["PriceCheckedAt"] = str(now)
+                keep.append(p)
+            write_products(PENDING_CSV, keep)
+        print(f"[REFRESH] {len(ids)} items in one call: {repriced} repriced, {dropped} dropped", flush=True)
+        return repriced + dropped
+
+def _refresh_before_send(n=None):
+    try:
+        refresh_ahead(n)
+    except Exception as e:
+        print(f"[REFRESH][WARN] refresh_ahead: {e}", flush=True)
+
+
 # ========= ATOMIC SEND =========
+LAST_FAILED_TARGETS = []   # יעדים שנכשלו בשליחה האחרונה (לדיווח למנהל)
+
+def _requeue_failed(rest, item, failed, source):
+    """Partial fan-out: the item goes back to the end of the queue for the failed targets only."""
+    tries = int(item.get("RetryCount") or 0) + 1
+    if tries > FANOUT_MAX_RETRIES:
+        print(f"[{datetime.now(tz=IL_TZ)}] {source}: giving up on {failed} for ItemId={item.get('ItemId', '')} after {tries - 1} retries", flush=True)
+        return rest
+    retry = dict(item, RetryTargets=",".join(str(t) for t in failed), RetryCount=str(tries))
+    print(f"[{datetime.now(tz=IL_TZ)}] {source}: re-queued ItemId={item.get('ItemId', '')} for {failed} (retry {tries}/{FANOUT_MAX_RETRIES})", flush=True)
+    return rest + [retry]
+
 def send_next_locked(source: str = "loop") -> bool:
+    global LAST_FAILED_TARGETS
+    _refresh_before_send()   # stale prices / dead items of the next slots, before the lock
     with FILE_LOCK:
         pending = read_products(PENDING_CSV)
         if not pending:
@@ -508,19 +603,26 @@ def send_next_locked(source: str = "loop") -> bool:
         title = (item.get("Title") or "").strip()[:120]
         print(f"[{datetime.now(tz=IL_TZ)}] {source}: sending ItemId={item_id} | Title={title}", flush=True)
 
+        rest = pending[1:]
         try:
-            post_to_channel(item)
+            failed = post_to_channel(item) or []
         except Exception as e:
             print(f"[{datetime.now(tz=IL_TZ)}] {source}: send FAILED: {e}", flush=True)
-            return False
+            LAST_FAILED_TARGETS = _retry_targets(item) or post_targets()
+            if not item.get("RetryTargets"):
+                return False
+            failed = LAST_FAILED_TARGETS   # a retry failing everywhere again goes to the back, not blocking the queue
+        LAST_FAILED_TARGETS = list(failed)
+        if failed:
+            rest = _requeue_failed(rest, item, failed, source)
 
         try:
-            write_products(PENDING_CSV, pending[1:])
+            write_products(PENDING_CSV, rest)
         except Exception as e:
             print(f"[{datetime.now(tz=IL_TZ)}] {source}: write FAILED, retry once: {e}", flush=True)
             time.sleep(0.2)
             try:
-                write_products(PENDING_CSV, pending[1:])
+                write_products(PENDING_CSV, rest)
             except Exception as e2:
                 print(f"[{datetime.now(tz=IL_TZ)}] {source}: write FAILED permanently: {e2}", flush=True)
                 return True
@@ -528,6 +630,41 @@ def send_next_locked(source: str = "loop") -> bool:
         print(f"[{datetime.now(tz=IL_TZ)}] {source}: sent & advanced queue", flush=True)
         return True
 
+def send_burst_locked(source: str = "burst") -> bool:
+    """
+    Catch-up: the next (up to BURST_SIZE) items with media as one album; fewer than 2 -> normal send.
+    A failed album falls back to the single-post path for the head item, so one bad item can't wedge the queue.
+    """
+    _refresh_before_send(max(PRICE_REFRESH_WINDOW, BURST_SIZE) if PRICE_REFRESH_WINDOW > 0 else 0)
+    with FILE_LOCK:
+        pending = read_products(PENDING_CSV)
+        batch = []
+        for item in pending[:BURST_SIZE]:
+            if item.get("RetryTargets") or _burst_media(item) is None:
+                break  # keep queue order: stop at the first item an album can't carry (or owes only some targets)
+            batch.append(item)
+
+        if len(batch) >= 2:
+            print(f"[{datetime.now(tz=IL_TZ)}] {source}: sending {len(batch)} items as one album", flush=True)
+            try:
+                failed = burst_to_channel(batch)
+            except Exception as e:
+                print(f"[{datetime.now(tz=IL_TZ)}] {source}: burst FAILED, single post instead: {e}", flush=True)
+            else:
+                rest = pending[len(batch):]
+                for item, f in zip(batch, failed):
+                    if f:   # left out of the album / a target failed: back of the queue for those targets
+                        rest = _requeue_failed(rest, item, f, source)
+                try:
+                    write_products(PENDING_CSV, rest)
+                except Exception as e:
+                    print(f"[{datetime.now(tz=IL_TZ)}] {source}: write FAILED permanently: {e}", flush=True)
+                print(f"[{datetime.now(tz=IL_TZ)}] {source}: sent {len(batch)} & advanced queue", flush=True)
+                return True
+
+    # FILE_LOCK isn't reentrant: the single-item fallback runs outside it
+    return send_next_locked(source)
+
 
 # ========= DELAY =========
 
@@ -759,11 +896,12 @@ def inline_menu():
         types.InlineKeyboardButton("🆕 בחר ערוץ ציבורי", callback_data="choose_public"),
         types.InlineKeyboardButton("🆕 בחר ערוץ פרטי", callback_data="choose_private"),
     )
+    kb.add(types.InlineKeyboardButton("📡 שדר לשני היעדים (ציבורי+פרטי)", callback_data="target_all"))
     # ביטול בחירה
     kb.add(types.InlineKeyboardButton("❌ בטל בחירת יעד", callback_data="choose_cancel"))
 
     kb.add(types.InlineKeyboardButton(
-        f"מרווח: ~{POST_DELAY_SECONDS//60} דק׳ | יעד: {CURRENT_TARGET}", callback_data="noop_info"
+        f"מרווח: ~{POST_DELAY_SECONDS//60} דק׳ | יעד: {targets_label()}", callback_data="noop_info"
     ))
     return kb
 
@@ -784,8 +922,11 @@ def on_inline_click(c):
         if not ok:
             bot.answer_callback_query(c.id, "אין פוסטים ממתינים או שגיאה בשליחה.", show_alert=True)
             return
+        text = "✅ נשלח הפריט הבא בתור."
+        if LAST_FAILED_TARGETS:
+            text += "\n⚠️ נכשל ביעדים: " + ", ".join(str(t) for t in LAST_FAILED_TARGETS) + " – הוחזר לתור עבורם."
         safe_edit_message(bot, chat_id=chat_id, message=c.message,
-                          new_text="✅ נשלח הפריט הבא בתור.", reply_markup=inline_menu(), cb_id=c.id)
+                          new_text=text, reply_markup=inline_menu(), cb_id=c.id)
 
     elif data == "skip_one":
         with FILE_LOCK:
@@ -825,7 +966,7 @@ def on_inline_click(c):
         now_il = datetime.now(tz=IL_TZ)
         schedule_line = "🕰️ מצב: מתוזמן (שינה פעיל)" if is_schedule_enforced() else "🟢 מצב: תמיד-פעיל"
         delay_line = f"⏳ מרווח נוכחי: {POST_DELAY_SECONDS//60} דק׳ ({POST_DELAY_SECONDS} שניות)"
-        target_line = f"🎯 יעד נוכחי: {CURRENT_TARGET}"
+        target_line = f"🎯 יעד נוכחי: {targets_label()}"
         if count == 0:
             text = f"{schedule_line}\n{delay_line}\n{target_line}\nאין פוסטים ממתינים ✅"
         else:
@@ -889,6 +1030,7 @@ def on_inline_click(c):
             bot.answer_callback_query(c.id, "לא הוגדר יעד ציבורי. בחר דרך '🆕 בחר ערוץ ציבורי'.", show_alert=True)
             return
         CURRENT_TARGET = resolve_target(v)
+        _save_fanout([])
         ok, details = check_and_probe_target(CURRENT_TARGET)
         safe_edit_message(bot, chat_id=chat_id, message=c.message,
                           new_text=f"🎯 עברתי לשדר ליעד הציבורי: {v}\n{details}",
@@ -900,11 +1042,24 @@ def on_inline_click(c):
             bot.answer_callback_query(c.id, "לא הוגדר יעד פרטי. בחר דרך '🆕 בחר ערוץ פרטי'.", show_alert=True)
             return
         CURRENT_TARGET = resolve_target(v)
+        _save_fanout([])
         ok, details = check_and_probe_target(CURRENT_TARGET)
         safe_edit_message(bot, chat_id=chat_id, message=c.message,
                           new_text=f"🔒 עברתי לשדר ליעד הפרטי: {v}\n{details}",
                           reply_markup=inline_menu(), cb_id=c.id)
 
+    elif data == "target_all":
+        pub, priv = _load_preset(PUBLIC_PRESET_FILE), _load_preset(PRIVATE_PRESET_FILE)
+        if pub is None or priv is None:
+            bot.answer_callback_query(c.id, "צריך להגדיר קודם יעד ציבורי וגם יעד פרטי.", show_alert=True)
+            return
+        CURRENT_TARGET = resolve_target(pub)
+        _save_fanout([priv])
+        lines = [check_and_probe_target(t)[1] for t in post_targets()]
+        safe_edit_message(bot, chat_id=chat_id, message=c.message,
+                          new_text="📡 משדר לכל היעדים במקביל:\n" + "\n".join(lines),
+                          reply_markup=inline_menu(), cb_id=c.id)
+
     elif data == "choose_public":
         EXPECTING_TARGET[c.from_user.id] = "public"
         safe_edit_message(bot, chat_id=chat_id, message=c.message,
@@ -1095,6 +1250,8 @@ def on_document(msg):
 
         # המרה (אם נדרש) + נורמליזציה
         rows = _rows_with_optional_usd_to_ils(rows_raw, convert_rate)
+        if CATALOG_UPSERT:
+            CATALOG_UPSERT(rows, source=f"upload:{filename}")
 
         # כתיבה + מיזוג
         with FILE_LOCK:
@@ -1240,7 +1397,7 @@ def pending_status(msg):
     now_il = datetime.now(tz=IL_TZ)
     schedule_line = "🕰️ מצב: מתוזמן (שינה פעיל)" if is_schedule_enforced() else "🟢 מצב: תמיד-פעיל"
     delay_line = f"⏳ מרווח נוכחי: {POST_DELAY_SECONDS//60} דק׳ ({POST_DELAY_SECONDS} שניות)"
-    target_line = f"🎯 יעד נוכחי: {CURRENT_TARGET}"
+    target_line = f"🎯 יעד נוכחי: {targets_label()}"
     if count == 0:
         bot.reply_to(msg, f"{schedule_line}\n{delay_line}\n{target_line}\nאין פוסטים ממתינים ✅")
         return
@@ -1313,7 +1470,10 @@ def auto_post_loop():
             DELAY_EVENT.clear()
             continue
 
-        send_next_locked("auto")
+        if burst_due(len(pending)):
+            send_burst_locked("auto-burst")   # תור עמוס / חלון ריכוז: עד 10 פריטים באלבום אחד
+        else:
+            send_next_locked("auto")
         print(f"[{datetime.now(tz=IL_TZ)}] פורסם. המתנה {delay} שניות", flush=True)
         DELAY_EVENT.wait(timeout=delay)
         DELAY_EVENT.clear()
@@ -1338,7 +1498,10 @@ def auto_post_loop():
             DELAY_EVENT.clear()
             continue
 
-        send_next_locked("loop")
+        if burst_due(len(pending)):
+            send_burst_locked("loop-burst")
+        else:
+            send_next_locked("loop")
 
         print(f"[{datetime.now(tz=IL_TZ)}] sleeping for {POST_DELAY_SECONDS}s (or until delay changed)", flush=True)
         DELAY_EVENT.wait(timeout=POST_DELAY_SECONDS)
@@ -1361,7 +1524,59 @@ def _debug_log_everything(msg):
 
 # ========= MAIN =========
 
-# === Safe override: robust post_to_channel ===
+# === Safe override: robust post_to_channel (fan-out to every target) ===
+_FANOUT_POOL = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+_DELIVERY_LOCK = threading.Lock()
+
+def _load_fanout():
+    """Extra targets: FANOUT_FILE (one per line) + POST_TARGETS env (comma separated)."""
+    raw = (_load_preset(FANOUT_FILE) or "").splitlines() + os.environ.get("POST_TARGETS", "").split(",")
+    return [t.strip() for t in raw if t.strip()]
+
+def _save_fanout(targets):
+    _save_preset(FANOUT_FILE, "\n".join(str(t) for t in targets))
+
+def post_targets():
+    out, seen = [], set()
+    for t in [CURRENT_TARGET] + _load_fanout():
+        t = resolve_target(t)
+        if str(t) not in seen:
+            seen.add(str(t))
+            out.append(t)
+    return out
+
+def targets_label():
+    ts = post_targets()
+    return str(ts[0]) if len(ts) == 1 else " + ".join(str(t) for t in ts)
+
+def _retry_targets(product):
+    """Targets a re-queued item still owes (RetryTargets column), or [] for a fresh item."""
+    return [resolve_target(t) for t in (product.get("RetryTargets") or "").split(",") if t.strip()]
+
+def _record_delivery(product, results):
+    now = datetime.now(tz=IL_TZ).strftime("%Y-%m-%d %H:%M:%S")
+    item_id = (product.get("ItemId") or "").strip()
+    with _DELIVERY_LOCK:
+        new = not os.path.exists(DELIVERY_LOG)
+        with open(DELIVERY_LOG, "a", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            if new:
+                w.writerow(["ts", "ItemId", "target", "ok", "message_id", "error"])
+            for t, (ok, info) in results.items():
+                w.writerow([now, item_id, t, "1" if ok else "0", info if ok else "", "" if ok else info])
+
+def _post_one(target, post_text, image_url, video_url, caption_txt, _is_url):
+    # Prefer MP4 video (media goes by cached file_id when Telegram already has it)
+    if video_url.lower().endswith(".mp4") and _is_url(video_url):
+        return send_cached(POST, target, "video", video_url, SESSION, caption=caption_txt)
+
+    # Else image
+    if _is_url(image_url):
+        return send_cached(POST, target, "photo", image_url, SESSION, caption=caption_txt)
+
+    # Fallback: text only
+    return POST.send_message(target, caption_txt)
+
 def post_to_channel(product):
     from urllib.parse import urlparse
 
@@ -1376,30 +1591,77 @@ def post_to_channel(product):
     video_url = (product.get('Video Url') or "").strip()
     buy_link = (product.get('BuyLink') or "").strip()
 
-    target = resolve_target(CURRENT_TARGET)
-
     # Require at least a valid buy link so פוסט לא ייצא ריק
     if not _is_url(buy_link):
         raise ValueError("Missing/invalid BuyLink URL")
 
     caption_txt = (post_text + "\n" + buy_link).strip()
+    args = (post_text, image_url, video_url, caption_txt, _is_url)
 
-    # Prefer MP4 video
+    def deliver(target):
+        try:
+            m = _post_one(target, *args)
+            return True, str(getattr(m, "message_id", "") or "")
+        except Exception as e:
+            print(f"[FANOUT] {target}: {e}", flush=True)
+            return False, str(e)[:200]
+
+    targets = _retry_targets(product) or post_targets()
+    # first target uploads the media once; the rest reuse its file_id, concurrently (scheduler paces per chat)
+    results = {targets[0]: deliver(targets[0])}
+    futs = {t: _FANOUT_POOL.submit(deliver, t) for t in targets[1:]}
+    for t, fut in futs.items():
+        results[t] = fut.result()
+    _record_delivery(product, results)
+    if len(targets) > 1:
+        print(f"[FANOUT] {product.get('ItemId', '')}: {sum(ok for ok, _ in results.values())}/{len(targets)} targets", flush=True)
+    if not any(ok for ok, _ in results.values()):
+        raise RuntimeError("; ".join(f"{t}: {info}" for t, (_, info) in results.items()))
+    return [t for t, (ok, _) in results.items() if not ok]
+
+def _burst_media(product):
+    """(kind, url) an album can carry, or None (no media / no valid BuyLink)."""
+    def _is_url(u):
+        return bool(re.match(r"https?://[^/\s]+", (u or "").strip()))
+    if not _is_url(product.get("BuyLink")):
+        return None
+    video_url = (product.get("Video Url") or "").strip()
     if video_url.lower().endswith(".mp4") and _is_url(video_url):
-        resp = SESSION.get(video_url, timeout=20)
-        resp.raise_for_status()
-        bot.send_video(target, resp.content, caption=caption_txt)
-        return
+        return "video", video_url
+    image_url = (product.get("ImageURL") or "").strip()
+    return ("photo", image_url) if _is_url(image_url) else None
 
-    # Else image
-    if _is_url(image_url):
-        resp = SESSION.get(image_url, timeout=20)
-        resp.raise_for_status()
-        bot.send_photo(target, resp.content, caption=caption_txt)
-        return
+def burst_to_channel(products):
+    """
+    One send_media_group per target with a shared digest caption; delivery recorded per item and target.
+    Returns the failed targets of each product (in order); raises only if nothing was delivered anywhere.
+    """
+    items = [_burst_media(p) for p in products]
+    entries = [{"title": p.get("Title", ""), "price": p.get("SalePrice", ""), "discount": p.get("Discount", ""),
+                "link": p.get("BuyLink", ""), "currency": p.get("Currency", "")} for p in products]
 
-    # Fallback: text only
-    bot.send_message(target, caption=caption_txt)
+    def caption(indexes):
+        return digest_caption([entries[i] for i in indexes])
+
+    def deliver(target):
+        try:
+            sent = send_burst(POST, target, items, caption, SESSION)
+        except Exception as e:
+            print(f"[BURST] {target}: {e}", flush=True)
+            return [(False, str(e)[:200])] * len(products)
+        return [(True, str(getattr(sent[i], "message_id", "") or "")) if i in sent else (False, "left out of the album")
+                for i in range(len(products))]
+
+    targets = post_targets()
+    results = {targets[0]: deliver(targets[0])}
+    futs = {t: _FANOUT_POOL.submit(deliver, t) for t in targets[1:]}
+    for t, fut in futs.items():
+        results[t] = fut.result()
+    for i, p in enumerate(products):
+        _record_delivery(p, {t: r[i] for t, r in results.items()})
+    if not any(ok for r in results.values() for ok, _ in r):
+        raise RuntimeError("; ".join(f"{t}: {r[0][1]}" for t, r in results.items()))
+    return [[t for t, r in results.items() if not r[i][0]] for i in range(len(products))]
 
 if __name__ == "__main__":
     # Single-instance lock
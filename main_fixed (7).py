@@ -64,6 +64,9 @@ if not BOT_TOKEN:
     sys.exit(1)
 
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+from tg_send import ScheduledBot, PRIO_CHANNEL
+from tg_burst import BURST_SIZE, burst_due, digest_caption, send_burst
+POST = ScheduledBot(bot, PRIO_CHANNEL)  # פרסומים לערוץ דרך מתזמן השליחה (429 / retry_after)
 
 # ========= מניעת ריבוי אינסטנסים (409) =========
 try:
@@ -210,12 +213,22 @@ def append_to_queue(rows: List[Dict[str, Any]]) -> int:
 
 # ========= AliExpress Affiliate Client =========
 SESSION = None
+MEDIA_SESSION = None   # הורדת תמונות לאלבום (העלאה כ-bytes, לא URL)
 try:
-    import requests
-    SESSION = requests.Session()
+    from ae_http import get_session
+    from ae_timeouts import timeout_for, retry_budget
+    from ae_memo import memoized
+    SESSION = get_session("ae_api")
+    MEDIA_SESSION = get_session("tg_media")
 except Exception:
     pass  # נשתמש ב-requests כשיהיה זמין
 
+CATALOG = None
+try:
+    from ae_catalog import CATALOG, safe_upsert, safe_search, safe_mark_queued
+except Exception:
+    pass  # בלי קטלוג מקומי: כל חיפוש הולך לרשת
+
 class AliExpressAffiliateClient:
     """
     לקוח אפיליאייטים מלא: חתימה HMAC-SHA256 וקריאה ל-/sync (Business API).
@@ -244,6 +257,11 @@ class AliExpressAffiliateClient:
     def _call(self, method: str, biz_params: Dict[str, Any]) -> Dict[str, Any]:
         if SESSION is None:
             raise RuntimeError("requests not available in this environment.")
+        biz = {k: v for k, v in biz_params.items() if v is not None}
+        # אותה קריאה בתוך AE_MEMO_TTL_SEC (או כזו שכבר בדרך) — בקשת רשת אחת
+        return memoized(self.app_key, method, biz, lambda: self._send(method, biz))
+
+    def _send(self, method: str, biz: Dict[str, Any]) -> Dict[str, Any]:
         frame = {
             "app_key": self.app_key,
             "method": method,
@@ -252,9 +270,10 @@ class AliExpressAffiliateClient:
             "timestamp": int(time.time() * 1000),
             "v": "1.0",
         }
-        merged = {**frame, **{k: v for k, v in biz_params.items() if v is not None}}
+        merged = {**frame, **biz}
         merged["sign"] = self._sign({k: merged[k] for k in merged if k != "sign"})
-        r = SESSION.get(self._ENDPOINT, params=merged, timeout=30)
+        with retry_budget():
+            r = SESSION.get(self._ENDPOINT, params=merged, timeout=timeout_for(self._ENDPOINT, 30))
         r.raise_for_status()
         return r.json()
 
@@ -359,10 +378,10 @@ def try_post_row(row: Dict[str, Any]) -> bool:
         if not CHANNEL_ID:
             print("WARNING: חסר CHANNEL_ID — לא ניתן לשלוח לערוץ.", flush=True)
             return False
-        bot.send_message(CHANNEL_ID, msg, disable_web_page_preview=False)
+        POST.send_message(CHANNEL_ID, msg, disable_web_page_preview=False)
         img = (row.get("Image Url") or "").strip()
         if img:
-            bot.send_photo(CHANNEL_ID, img)
+            POST.send_photo(CHANNEL_ID, img)
         return True
     except telebot.apihelper.ApiTelegramException as e:
         print(f"[{now_str()}] Telegram API error: {e}", flush=True)
@@ -390,6 +409,50 @@ def post_next_from_queue() -> (bool, str):
         else:
             return False, "שליחה נכשלה (ראה לוג)."
 
+def post_burst_from_queue() -> (bool, str):
+    """
+    עד BURST_SIZE פריטים עם תמונה וקישור כאלבום אחד (send_media_group); פחות מ-2 — פרסום רגיל.
+    אלבום שנכשל — פרסום רגיל של הפריט הבא, כדי שפריט תקול אחד לא יתקע את התור.
+    """
+    st = read_state()
+    with FILE_LOCK:
+        q = read_queue()
+        idx = int(st.get("index", 0))
+        batch = []
+        for row in q[idx:idx + BURST_SIZE]:
+            img = (row.get("Image Url") or "").strip()
+            if not img.startswith("http") or not (row.get("Promotion Url") or "").strip():
+                break  # שומרים על סדר התור
+            batch.append(row)
+        if len(batch) < 2 or MEDIA_SESSION is None:
+            return post_next_from_queue()
+        if not CHANNEL_ID:
+            return False, "חסר CHANNEL_ID"
+        entries = [{
+            "title": nfc((r.get("Title") or r.get("Product Desc") or "").strip()),
+            "price": (r.get("Discount Price") or r.get("Sale Price") or "").strip(),
+            "discount": (r.get("Discount") or "").strip(),
+            "link": (r.get("Promotion Url") or "").strip(),
+            "currency": (r.get("Currency") or "").strip(),
+        } for r in batch]
+        try:
+            sent = send_burst(POST, CHANNEL_ID, [("photo", (r.get("Image Url") or "").strip()) for r in batch],
+                              lambda ix: digest_caption([entries[i] for i in ix], currency=AE_TARGET_CURRENCY),
+                              MEDIA_SESSION)
+        except Exception as e:
+            print(f"[{now_str()}] burst error, posting singly: {e}", flush=True)
+            return post_next_from_queue()
+        for i, r in enumerate(batch):
+            if i in sent:
+                append_processed(r)
+            elif try_post_row(r):   # נשאר מחוץ לאלבום (תמונה לא ירדה) — פרסום רגיל
+                append_processed(r)
+            else:
+                print(f"[{now_str()}] burst: item #{idx + i + 1} not posted, skipped", flush=True)
+        st["index"] = idx + len(batch)
+        write_state(st)
+        return True, f"פורסמו {len(sent)} פריטים באלבום (עד #{st['index']} מתוך {len(q)})"
+
 # ========= תפריט /start =========
 def make_main_kb() -> types.ReplyKeyboardMarkup:
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -504,12 +567,27 @@ def do_fetch_keyword(m: types.Message):
         bot.reply_to(m, nfc("לא התקבלה מילת חיפוש"))
         return
     try:
-        res = AE.search_products(kw, page_size=10)
-        items = res.get("items", [])
-        if not items:
+        rows = []
+        # קודם מהקטלוג המקומי (מילישניות), הרשת רק משלימה את החסר
+        if CATALOG is not None:
+            queued = {(r.get("ProductId") or "").strip() for r in read_queue()}
+            for h in safe_search(kw, limit=10, exclude_ids=queued, require_aff=True):
+                rows.append({
+                    "ProductId": h["item_id"],
+                    "Image Url": h["image"],
+                    "Product Desc": h["description"] or h["title"],
+                    "Opening": "",
+                    "Title": h["title"],
+                    "Strengths": "",
+                    "Promotion Url": h["aff_url"],
+                })
+        local = len(rows)
+        items = AE.search_products(kw, page_size=10 - local).get("items", []) if local < 10 else []
+        if CATALOG is not None and items:
+            safe_upsert(items, source="fetch_keyword")
+        if not items and not rows:
             bot.reply_to(m, nfc(f"לא נמצאו פריטים ל: {kw}"))
             return
-        rows = []
         for it in items:
             rows.append({
                 "ProductId": it.get("productId") or it.get("product_id") or "",
@@ -521,7 +599,10 @@ def do_fetch_keyword(m: types.Message):
                 "Promotion Url": it.get("promotionUrl") or it.get("promotion_url") or "",
             })
         added = append_to_queue(rows)
-        bot.reply_to(m, nfc(f"נוספו {added} פריטים לתור מתוך החיפוש ל־“{kw}”"))
+        if CATALOG is not None:
+            safe_mark_queued([r["ProductId"] for r in rows])
+        src = f" ({local} מהקטלוג)" if local else ""
+        bot.reply_to(m, nfc(f"נוספו {added} פריטים לתור מתוך החיפוש ל־“{kw}”{src}"))
     except Exception as e:
         bot.reply_to(m, nfc(f"שגיאה במשיכה: {e}"))
 
@@ -631,7 +712,8 @@ def poster_loop():
             DELAY_EVENT.wait(timeout=60)
             DELAY_EVENT.clear()
             continue
-        ok, info = post_next_from_queue()
+        left = len(read_queue()) - int(read_state().get("index", 0))
+        ok, info = post_burst_from_queue() if burst_due(left) else post_next_from_queue()
         print(f"[{now_str()}] Auto-post: {info}", flush=True)
         DELAY_EVENT.wait(timeout=delay if ok else 30)
         DELAY_EVENT.clear()
@@ -0,0 +1,18 @@
+import os, sys
+import importlib.util
+import pytest
+
+# the bot's modules live flat at the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """A fresh "main_all_fixed (1).py" module whose queue and data files live in tmp_path."""
+    monkeypatch.chdir(tmp_path)   # BASE_DIR is "." — keep the queue (and the boot-time CSV scan) in tmp
+    monkeypatch.setenv("BOT_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("POST_TARGETS", "@chan1")
+    spec = importlib.util.spec_from_file_location("main_all_fixed", os.path.join(ROOT, "main_all_fixed (1).py"))
+    m = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(m)
+    return m
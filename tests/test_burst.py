@@ -0,0 +1,96 @@
+import types
+import pytest
+from telebot.apihelper import ApiTelegramException
+import tg_burst
+from tg_burst import digest_caption, send_burst, CAPTION_MAX
+from tg_filecache import FileIdCache
+
+class Resp:
+    def __init__(self, url):
+        self.url = url
+        self.content = url.encode()
+    def raise_for_status(self):
+        if "bad" in self.url:
+            raise IOError("404 " + self.url)
+
+class Session:
+    def __init__(self):
+        self.fetched = []
+    def get(self, url, timeout=None):
+        self.fetched.append(url)
+        return Resp(url)
+
+class Bot:
+    token = "1:x"
+    def __init__(self, reject=False):
+        self.groups, self.reject = [], reject
+    def send_media_group(self, chat_id, media):
+        self.groups.append(media)
+        if self.reject and any(isinstance(m.media, str) for m in media):
+            raise ApiTelegramException("sendMediaGroup", "", {"error_code": 400, "description": "Bad Request: wrong file identifier"})
+        return [types.SimpleNamespace(message_id=n, photo=[types.SimpleNamespace(file_id=f"fid{len(self.groups)}-{n}")])
+                for n, _ in enumerate(media)]
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    c = FileIdCache(str(tmp_path / "files.db"))
+    monkeypatch.setattr(tg_burst, "FILE_IDS", c)
+    return c
+
+ITEMS = [("photo", "https://cdn/a.jpg"), ("photo", "https://cdn/b.jpg"), ("photo", "https://cdn/c.jpg")]
+
+def test_uploads_bytes_then_reuses_file_ids(cache):
+    bot, session = Bot(), Session()
+    sent = send_burst(bot, 5, ITEMS, "cap", session)
+    assert sorted(sent) == [0, 1, 2]
+    assert [m.media for m in bot.groups[0]] == [b"https://cdn/a.jpg", b"https://cdn/b.jpg", b"https://cdn/c.jpg"]
+    assert bot.groups[0][0].caption == "cap"
+    send_burst(bot, 6, ITEMS, "cap", session)
+    assert [m.media for m in bot.groups[1]] == ["fid1-0", "fid1-1", "fid1-2"]
+    assert len(session.fetched) == 3           # second target: no downloads
+
+def test_bad_media_left_out_and_caption_follows():
+    bot = Bot()
+    items = [("photo", "https://cdn/bad.jpg")] + ITEMS[1:]
+    sent = send_burst(bot, 5, items, lambda ix: ",".join(map(str, ix)), Session())
+    assert sorted(sent) == [1, 2]
+    assert bot.groups[0][0].caption == "1,2"
+    with pytest.raises(ValueError):
+        send_burst(bot, 5, items[:2], "cap", Session())
+
+def test_rejected_file_id_is_dropped_and_reuploaded(cache):
+    bot = Bot(reject=True)
+    cache.put(["https://cdn/a.jpg"], "1", "photo", "stale")
+    sent = send_burst(bot, 5, ITEMS[:2], "cap", Session())
+    assert len(sent) == 2 and len(bot.groups) == 2
+    assert all(isinstance(m.media, bytes) for m in bot.groups[1])
+    assert cache.get("https://cdn/a.jpg", "1", "photo") == "fid2-0"
+
+def test_digest_caption_currency_and_length():
+    entries = [{"title": "x" * 300, "price": "12.90", "link": "https://s.click/1"},
+               {"title": "y", "price": "3", "currency": "USD"}]
+    cap = digest_caption(entries * 5, currency="ILS")
+    assert "12.90 ₪" in cap and "3 $" in cap and 'ש"ח' not in cap
+    visible = cap.replace('<a href="https://s.click/1">', "").replace("</a>", "")
+    assert len(visible) <= CAPTION_MAX
+
+def _product(n):
+    return {"ItemId": str(n), "Title": f"t{n}", "ImageURL": f"https://cdn/{n}.jpg", "BuyLink": f"https://s.click/{n}"}
+
+def test_failed_album_falls_back_to_single_post(app, monkeypatch):
+    app.write_products(app.PENDING_CSV, [_product(1), _product(2), _product(3)])
+    singles = []
+    monkeypatch.setattr(app, "burst_to_channel", lambda batch: (_ for _ in ()).throw(RuntimeError("caption too long")))
+    monkeypatch.setattr(app, "post_to_channel", lambda item: singles.append(item["ItemId"]) or [])
+    assert app.send_burst_locked("test")
+    assert singles == ["1"]
+    assert [p["ItemId"] for p in app.read_products(app.PENDING_CSV)] == ["2", "3"]
+
+def test_items_left_out_of_album_are_requeued(app, monkeypatch):
+    app.write_products(app.PENDING_CSV, [_product(1), _product(2), _product(3), _product(4)])
+    monkeypatch.setattr(app, "BURST_SIZE", 3)
+    monkeypatch.setattr(app, "burst_to_channel", lambda batch: [["@chan1"], [], []])
+    assert app.send_burst_locked("test")
+    rows = app.read_products(app.PENDING_CSV)
+    assert [p["ItemId"] for p in rows] == ["4", "1"]
+    assert rows[1]["RetryTargets"] == "@chan1"
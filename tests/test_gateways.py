@@ -0,0 +1,74 @@
+import time, threading
+import pytest
+import ae_gateways
+from ae_gateways import GatewayPool
+
+@pytest.fixture(autouse=True)
+def fast_hedge(monkeypatch):
+    monkeypatch.setattr(ae_gateways, "HEDGE_DEFAULT_SEC", 0.2)
+
+def _half_open(pool, gw):
+    st = pool._stats[gw]
+    st.fails = ae_gateways.CB_FAILURES
+    st.open_until = time.time() - 1   # cool-down over
+
+def test_failures_open_the_circuit():
+    pool = GatewayPool("t", ["a", "b"])
+    def fn(gw):
+        if gw == "a":
+            raise IOError("down")
+        return gw
+    for _ in range(ae_gateways.CB_FAILURES):
+        assert pool.call(fn) == "b"
+    assert pool.stats()["a"]["state"] == "open"
+    assert pool._order() == ["b"]
+
+def test_unlaunched_half_open_gateway_keeps_its_trial():
+    pool = GatewayPool("t", ["a", "b"])
+    _half_open(pool, "b")
+    assert pool._order() == ["a", "b"]
+    # "a" answers before the hedge fires: "b" is ordered but never launched
+    assert pool.call(lambda gw: gw) == "a"
+    assert not pool._stats["b"].trial_inflight
+    assert pool._order() == ["a", "b"]
+
+def test_half_open_trial_runs_when_primary_is_slow():
+    pool = GatewayPool("t", ["a", "b"])
+    _half_open(pool, "b")
+    release = threading.Event()
+    def fn(gw):
+        if gw == "a":
+            release.wait(2)
+        return gw
+    assert pool.call(fn) == "b"
+    release.set()
+    st = pool._stats["b"]
+    assert st.state(time.time()) == "closed" and not st.trial_inflight
+
+def test_only_one_trial_at_a_time():
+    pool = GatewayPool("t", ["a"])
+    _half_open(pool, "a")
+    started, release = threading.Event(), threading.Event()
+    def slow(gw):
+        started.set()
+        release.wait(2)
+        return gw
+    t = threading.Thread(target=pool.call, args=(slow,))
+    t.start()
+    assert started.wait(2)
+    assert pool._stats["a"].trial_inflight
+    assert not pool._claim("a")
+    release.set()
+    t.join(2)
+    assert not pool._stats["a"].trial_inflight
+    assert pool.stats()["a"]["state"] == "closed"
+
+def test_failed_trial_reopens():
+    pool = GatewayPool("t", ["a"])
+    _half_open(pool, "a")
+    def fail(gw):
+        raise IOError("still down")
+    with pytest.raises(RuntimeError):
+        pool.call(fail)
+    st = pool._stats["a"]
+    assert st.state(time.time()) == "open" and not st.trial_inflight
@@ -0,0 +1,113 @@
+import random, threading, time, types
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import pytest
+import requests
+import ae_proxies
+from ae_http import CountingAdapter
+from ae_proxies import ProxyPool
+
+class StandIn:
+    """A local forward proxy stand-in: answers every proxied request itself, with a per-host status."""
+    def __init__(self, name, delay=0.0):
+        self.name, self.delay = name, delay
+        self.blocked = set()        # hosts this proxy answers 403 for
+        self.hits, self.active, self.peak = [], 0, 0
+        self._lock = threading.Lock()
+        stand_in = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host = urlparse(self.path).hostname   # proxied requests carry the absolute URL
+                with stand_in._lock:
+                    stand_in.hits.append(host)
+                    stand_in.active += 1
+                    stand_in.peak = max(stand_in.peak, stand_in.active)
+                time.sleep(stand_in.delay)
+                with stand_in._lock:
+                    stand_in.active -= 1
+                body = stand_in.name.encode()
+                self.send_response(403 if host in stand_in.blocked else 200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *a):
+                pass
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def stand_ins():
+    made = []
+    def make(name, delay=0.0):
+        made.append(StandIn(name, delay))
+        return made[-1]
+    yield make
+    for s in made:
+        s.server.shutdown()
+        s.server.server_close()
+
+def _session(pool):
+    s = requests.Session()
+    s.trust_env = False
+    s.mount("http://", CountingAdapter(max_retries=0, proxy_pool=pool))
+    return s
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ae_proxies, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+def test_choice_is_weighted_by_health_per_host(stand_ins, monkeypatch):
+    monkeypatch.setattr(ae_proxies, "QUARANTINE_FAILS", 1000)   # weights only, no quarantine
+    monkeypatch.setattr(ae_proxies, "random", random.Random(7))
+    a, b = stand_ins("a"), stand_ins("b")
+    b.blocked.add("shop.test")
+    pool = ProxyPool([a.url, b.url])
+    s = _session(pool)
+    for _ in range(20):                          # warm-up: b gets 403s from shop.test
+        s.get("http://shop.test/x", timeout=5)
+    got = [s.get("http://shop.test/x", timeout=5).text for _ in range(40)]
+    assert got.count("a") >= 36
+    got = [s.get("http://other.test/x", timeout=5).text for _ in range(40)]
+    assert got.count("b") >= 10                  # b's block on shop.test doesn't count against other.test
+    st = pool.stats()
+    assert st[f"{ae_proxies._label(b.url)} shop.test"]["success"] < 0.5 < st[f"{ae_proxies._label(a.url)} shop.test"]["success"]
+    assert st[f"{ae_proxies._label(b.url)} other.test"]["success"] > 0.7
+
+def test_quarantine_backs_off_exponentially_then_releases(stand_ins, monkeypatch, clock):
+    # deterministic chooser: the first live proxy
+    monkeypatch.setattr(ae_proxies, "random", types.SimpleNamespace(choices=lambda live, weights: [live[0]]))
+    a, b = stand_ins("a"), stand_ins("b")
+    b.blocked.add("shop.test")
+    pool = ProxyPool([b.url, a.url])
+    s = _session(pool)
+    key = f"{ae_proxies._label(b.url)} shop.test"
+    def get():
+        return s.get("http://shop.test/x", timeout=5).text
+    assert [get() for _ in range(ae_proxies.QUARANTINE_FAILS)] == ["b"] * ae_proxies.QUARANTINE_FAILS
+    assert pool.stats()[key]["quarantined"] == ae_proxies.BACKOFF_SEC
+    assert get() == "a"                          # quarantined: traffic moves to a
+    clock[0] += ae_proxies.BACKOFF_SEC
+    assert [get() for _ in range(ae_proxies.QUARANTINE_FAILS)] == ["b"] * ae_proxies.QUARANTINE_FAILS
+    assert pool.stats()[key]["quarantined"] == 2 * ae_proxies.BACKOFF_SEC   # second time: doubled
+    clock[0] += 2 * ae_proxies.BACKOFF_SEC - 1
+    assert get() == "a"
+    clock[0] += 1
+    b.blocked.clear()                            # unblocked during the cool-down
+    assert get() == "b"
+    h = pool._health[(b.url, "shop.test")]
+    assert (h.quarantines, h.until, h.fails) == (0, 0.0, 0)
+
+def test_concurrent_workers_spread_across_proxies(stand_ins, monkeypatch):
+    monkeypatch.setattr(ae_proxies, "random", random.Random(3))
+    proxies = [stand_ins(n, delay=0.3) for n in "abc"]
+    pool = ProxyPool([p.url for p in proxies])
+    s = _session(pool)
+    with ThreadPoolExecutor(max_workers=6) as ex:
+        got = list(ex.map(lambda i: s.get(f"http://shop.test/{i}", timeout=5).text, range(6)))
+    assert sorted(set(got)) == ["a", "b", "c"]
+    assert max(p.peak for p in proxies) <= 4
+    assert all(n == 0 for n in pool._inflight.values())   # every choice was released
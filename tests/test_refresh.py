@@ -0,0 +1,52 @@
+import time
+
+class AE:
+    def __init__(self, details):
+        self.details, self.calls = details, []
+    def product_details(self, ids, chunk_size=None, strict=False):
+        self.calls.append(list(ids))
+        return {i: d for i, d in self.details.items() if i in ids}
+
+def _product(n, price="10"):
+    return {"ItemId": str(n), "Title": f"t{n}", "SalePrice": price, "Discount": "10%", "BuyLink": f"https://s.click/{n}"}
+
+def _ids(app):
+    return [p["ItemId"] for p in app.read_products(app.PENDING_CSV)]
+
+def test_window_refreshed_in_one_call(app, monkeypatch):
+    app.write_products(app.PENDING_CSV, [_product(n) for n in (1, 2, 3, 4)])
+    ae = AE({"1": {"target_sale_price": "ILS 8.50", "discount": "35%"}, "3": {"target_sale_price": "10"}})
+    monkeypatch.setattr(app, "AE", ae)
+    assert app.refresh_ahead(3) == 2
+    assert ae.calls == [["1", "2", "3"]]
+    rows = app.read_products(app.PENDING_CSV)
+    assert [p["ItemId"] for p in rows] == ["1", "3", "4"]     # 2 is gone; 4 is outside the window
+    assert (rows[0]["SalePrice"], rows[0]["Discount"]) == ("8.50", "35%")
+    assert rows[0]["PriceCheckedAt"] and not rows[2].get("PriceCheckedAt")
+
+def test_fresh_head_skips_the_call(app, monkeypatch):
+    head = dict(_product(1), PriceCheckedAt=str(int(time.time())))
+    app.write_products(app.PENDING_CSV, [head, _product(2)])
+    ae = AE({})
+    monkeypatch.setattr(app, "AE", ae)
+    assert app.refresh_ahead(5) == 0 and ae.calls == []
+
+def test_failed_or_empty_answer_drops_nothing(app, monkeypatch):
+    app.write_products(app.PENDING_CSV, [_product(1), _product(2)])
+    monkeypatch.setattr(app, "AE", AE({}))
+    assert app.refresh_ahead(5) == 0
+    class Down(AE):
+        def product_details(self, ids, chunk_size=None, strict=False):
+            assert strict
+            raise IOError("timeout")
+    monkeypatch.setattr(app, "AE", Down({}))
+    assert app.refresh_ahead(5) == 0
+    assert _ids(app) == ["1", "2"]
+
+def test_send_path_refreshes_first(app, monkeypatch):
+    app.write_products(app.PENDING_CSV, [_product(1), _product(2)])
+    monkeypatch.setattr(app, "AE", AE({"2": {"target_sale_price": "5"}}))
+    sent = []
+    monkeypatch.setattr(app, "post_to_channel", lambda item: sent.append(item["ItemId"]) or [])
+    assert app.send_next_locked("test")
+    assert sent == ["2"] and _ids(app) == []
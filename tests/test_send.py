@@ -0,0 +1,87 @@
+import time
+import pytest
+from requests.exceptions import ConnectionError as NetError
+from telebot.apihelper import ApiTelegramException
+import tg_send
+from tg_send import SendScheduler, ScheduledBot, retry_after_of, PRIO_CHANNEL, PRIO_ADMIN
+
+@pytest.fixture(autouse=True)
+def fast_chats(monkeypatch):
+    monkeypatch.setattr(tg_send, "TG_CHAT_RATE", 1000.0)
+    monkeypatch.setattr(tg_send, "TG_GROUP_PER_MIN", 60000.0)
+
+def _tg_error(code, description, params=None):
+    result = {"error_code": code, "description": description}
+    if params:
+        result["parameters"] = params
+    return ApiTelegramException("sendMessage", "", result)
+
+def test_retry_after_parsing():
+    assert retry_after_of(_tg_error(429, "Too Many Requests", {"retry_after": 3})) == 3
+    assert retry_after_of(_tg_error(429, "Too Many Requests: retry after 7")) == 7
+    assert retry_after_of(_tg_error(400, "Bad Request")) == 0
+    assert retry_after_of(ValueError("x")) == 0
+
+def test_429_waits_and_keeps_chat_order():
+    sched = SendScheduler(workers=2)
+    sent, state = [], {"first": True}
+    def send(chat, text):
+        if text == "a" and state["first"]:
+            state["first"] = False
+            raise _tg_error(429, "Too Many Requests", {"retry_after": 1})
+        sent.append((text, time.monotonic()))
+        return text
+    t0 = time.monotonic()
+    fa = sched.submit(send, 5, 5, "a")
+    fb = sched.submit(send, 5, 5, "b")
+    assert fa.result(5) == "a" and fb.result(5) == "b"
+    assert [t for t, _ in sent] == ["a", "b"]          # b never overtakes the throttled a
+    assert sent[0][1] - t0 >= 1.0
+    assert sched.stats()["429s"] == 1 and sched.stats()["failed"] == 0
+
+def test_network_errors_retry_then_fail(monkeypatch):
+    monkeypatch.setattr(tg_send, "TG_SEND_RETRIES", 2)
+    sched = SendScheduler(workers=1)
+    calls = []
+    def send(chat):
+        calls.append(chat)
+        raise NetError("reset")
+    with pytest.raises(NetError):
+        sched.call(send, 5, 5)
+    assert len(calls) == 2 and sched.stats()["failed"] == 1
+
+def test_bad_request_is_not_retried():
+    sched = SendScheduler(workers=1)
+    calls = []
+    def send(chat):
+        calls.append(chat)
+        raise _tg_error(400, "Bad Request: chat not found")
+    with pytest.raises(ApiTelegramException):
+        sched.call(send, 5, 5)
+    assert calls == [5]
+
+def test_channel_posts_go_before_admin_messages():
+    sched = SendScheduler(workers=1)
+    order = []
+    # both chats become sendable at the same moment: priority decides who goes first
+    at = time.monotonic() + 0.2
+    sched._next_at.update({"2": at, "-3": at})
+    admin = sched.submit(order.append, 2, 2, priority=PRIO_ADMIN)
+    post = sched.submit(order.append, -3, -3, priority=PRIO_CHANNEL)
+    admin.result(5), post.result(5)
+    assert order == [-3, 2]
+
+def test_scheduled_bot_routes_by_chat_id():
+    class Bot:
+        def send_message(self, chat_id, text):
+            return ("msg", chat_id, text)
+        def edit_message_text(self, text, chat_id, message_id):
+            return ("edit", chat_id, message_id)
+        def get_me(self):
+            return "me"
+    sched = SendScheduler(workers=1)
+    b = ScheduledBot(Bot(), scheduler=sched)
+    assert b.send_message(4, "hi") == ("msg", 4, "hi")
+    assert b.edit_message_text("t", 4, 9) == ("edit", 4, 9)
+    assert b.get_me() == "me"
+    assert sched.stats()["sent"] == 2
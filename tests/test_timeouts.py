@@ -0,0 +1,56 @@
+import types
+import pytest
+import ae_timeouts
+from ae_timeouts import record, timeout_for, retry_budget, take_retry
+
+URL = "https://slow.example.com/x"
+
+@pytest.fixture(autouse=True)
+def fresh_hosts(monkeypatch):
+    monkeypatch.setattr(ae_timeouts, "_HOSTS", {})
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ae_timeouts, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+def _kill(url=URL):
+    for _ in range(ae_timeouts.TIMEOUT_DEAD_AFTER):
+        record(url, ok=False)
+
+def test_default_until_samples_then_adaptive():
+    assert timeout_for(URL, (7, 10)) == (7, 10)
+    for _ in range(ae_timeouts.TIMEOUT_MIN_SAMPLES):
+        record(URL, 2.0)
+    assert timeout_for(URL, (7, 10)) == (5.0, 5.0)   # 2.0 * 2.5
+
+def test_dead_host_gets_floor_then_one_probe(clock):
+    floor = (ae_timeouts.TIMEOUT_FLOOR_SEC,) * 2
+    _kill()
+    assert timeout_for(URL, (7, 10)) == floor
+    clock[0] += ae_timeouts.TIMEOUT_PROBE_SEC
+    assert timeout_for(URL, (7, 10)) == (7, 10)      # the probe: full timeout
+    assert timeout_for(URL, (7, 10)) == floor        # only one per interval
+    record(URL, ok=False)                            # probe failed: wait another interval
+    clock[0] += ae_timeouts.TIMEOUT_PROBE_SEC - 1
+    assert timeout_for(URL, (7, 10)) == floor
+    clock[0] += 1
+    assert timeout_for(URL, (7, 10)) == (7, 10)
+    record(URL, 6.0)                                 # slow but alive: back to normal
+    assert timeout_for(URL, (7, 10)) == (7, 10)
+    assert timeout_for(URL, (7, 10)) == (7, 10)
+
+def test_stats_do_not_spend_the_probe(clock):
+    _kill()
+    clock[0] += ae_timeouts.TIMEOUT_PROBE_SEC
+    ae_timeouts.format_stats()
+    assert timeout_for(URL, (7, 10)) == (7, 10)
+
+def test_nested_budgets_share_one_counter():
+    with retry_budget(2) as outer:
+        with retry_budget(5) as inner:
+            assert inner is outer
+            assert take_retry() and take_retry()
+            assert not take_retry()
+    assert take_retry()   # no operation open: always allowed
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Burst / digest posting: up to BURST_SIZE queue items in one send_media_group.
+
+Triggered when the queue holds at least BURST_QUEUE_DEPTH items (0 = off) or
+the clock is inside BURST_WINDOW ("HH:MM-HH:MM", Asia/Jerusalem, may cross
+midnight). The album's first media carries one compact caption listing every
+item (title, price, discount, link), trimmed to Telegram's 1024-char limit.
+Media go the way tg_filecache.send_cached sends single posts: by cached
+file_id, else downloaded here and uploaded as bytes (never a bare URL for
+Telegram to fetch). Media that can't be downloaded are left out of the album
+and reported back to the caller; the returned file_ids are cached.
+"""
+import os, html, hashlib
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from telebot import types
+from tg_filecache import FILE_IDS, _bot_id, _file_id, _rejected
+
+BURST_SIZE = max(2, min(10, int(os.getenv("BURST_SIZE", "10"))))   # media group limit is 10
+BURST_QUEUE_DEPTH = int(os.getenv("BURST_QUEUE_DEPTH", "0"))
+BURST_WINDOW = (os.getenv("BURST_WINDOW") or "").strip()
+BURST_CURRENCY = (os.getenv("BOT_CURRENCY") or "ILS").strip()
+CAPTION_MAX = 1024
+CURRENCY_SYMBOLS = {"ILS": "₪", "USD": "$", "EUR": "€", "GBP": "£"}
+TZ = ZoneInfo("Asia/Jerusalem")
+
+def _hhmm(s: str):
+    h, _, m = s.strip().partition(":")
+    return int(h) * 60 + int(m or 0)
+
+def in_window(now: datetime = None, window: str = None) -> bool:
+    window = BURST_WINDOW if window is None else window
+    if "-" not in window:
+        return False
+    try:
+        start, end = (_hhmm(x) for x in window.split("-", 1))
+    except ValueError:
+        return False
+    now = now or datetime.now(TZ)
+    cur = now.hour * 60 + now.minute
+    return start <= cur < end if start <= end else (cur >= start or cur < end)
+
+def burst_due(depth: int, now: datetime = None) -> bool:
+    if depth < 2:
+        return False
+    return (BURST_QUEUE_DEPTH > 0 and depth >= BURST_QUEUE_DEPTH) or in_window(now)
+
+def digest_caption(entries, header: str = "🔥 ריכוז דילים", currency: str = None) -> str:
+    """
+    entries: dicts with title / price / discount / link and optionally currency
+    (code or symbol; falls back to `currency`, then BURST_CURRENCY). Visible text kept under CAPTION_MAX.
+    """
+    def money(e):
+        cur = (e.get("currency") or currency or BURST_CURRENCY).strip()
+        return f"{e['price']} {CURRENCY_SYMBOLS.get(cur.upper(), cur)}".strip()
+    def line(i, e, title):
+        extra = " · ".join(x for x in (money(e) if e.get("price") else "",
+                                       f"-{e['discount']}" if e.get("discount") else "") if x)
+        t = html.escape(title)
+        t = f'<a href="{html.escape(e["link"], quote=True)}">{t}</a>' if e.get("link") else t
+        return f"{i}. {t}" + (f" — {extra}" if extra else ""), len(f"{i}. {title}") + (len(extra) + 3 if extra else 0)
+    budget = CAPTION_MAX - len(header) - 2
+    per = max(12, budget // max(1, len(entries)) - 1)
+    lines = [header, ""]
+    for i, e in enumerate(entries, 1):
+        title = " ".join(str(e.get("title") or "").split())
+        text, visible = line(i, e, title)
+        if visible > per:   # trim the title, never the price / link
+            cut = max(8, len(title) - (visible - per) - 1)
+            text, visible = line(i, e, title[:cut].rstrip() + "…")
+        lines.append(text)
+    return "\n".join(lines)
+
+def _media(kind, media, caption=None):
+    cls = types.InputMediaVideo if kind == "video" else types.InputMediaPhoto
+    return cls(media, caption=caption, parse_mode="HTML") if caption else cls(media)
+
+def _prepare(bid, kind, url, session, timeout, use_cache=True):
+    """(media, keys): a cached file_id, else the downloaded bytes (as send_cached does) and the keys for its new id."""
+    if use_cache:
+        fid = FILE_IDS.get(url, bid, kind)
+        if fid:
+            return fid, []
+    resp = session.get(url, timeout=timeout)
+    resp.raise_for_status()
+    data = resp.content
+    digest = "sha1:" + hashlib.sha1(data).hexdigest()
+    fid = FILE_IDS.get(digest, bid, kind) if use_cache else None
+    if fid:
+        return fid, [url]
+    return data, [url, digest]
+
+def send_burst(bot, chat_id, items, caption, session, timeout=20):
+    """
+    items: (kind, url) pairs (photo / video). One send_media_group; returns {item index: Message}.
+    caption: str, or fn(indexes of the items that made the album) -> str.
+    Items whose media can't be downloaded are left out; fewer than 2 left raises ValueError.
+    """
+    bid = _bot_id(bot)
+    def build(use_cache):
+        ready = []
+        for i, (kind, url) in enumerate(items):
+            try:
+                media, keys = _prepare(bid, kind, url, session, timeout, use_cache)
+            except Exception as e:
+                print(f"[BURST] {kind} {url}: {e}; left out of the album", flush=True)
+                continue
+            ready.append((i, kind, media, keys))
+        if len(ready) < 2:
+            raise ValueError(f"only {len(ready)} of {len(items)} media available for an album")
+        text = caption([i for i, _, _, _ in ready]) if callable(caption) else caption
+        return ready, [_media(kind, media, text if n == 0 else None) for n, (_, kind, media, _) in enumerate(ready)]
+    ready, group = build(True)
+    try:
+        msgs = bot.send_media_group(chat_id, group)
+    except Exception as e:
+        cached = [media for _, _, media, _ in ready if isinstance(media, str)]
+        if not cached or not _rejected(e):
+            raise
+        print(f"[BURST] cached media rejected ({e}); re-uploading", flush=True)
+        FILE_IDS.rejected += 1
+        for fid in cached:
+            FILE_IDS.drop(fid, bid)
+        ready, group = build(False)
+        msgs = bot.send_media_group(chat_id, group)
+    sent = {}
+    for (i, kind, media, keys), m in zip(ready, msgs or []):
+        sent[i] = m
+        if isinstance(media, str):
+            FILE_IDS.hits += 1
+        else:
+            FILE_IDS.uploads += 1
+        fid = _file_id(m, kind)
+        if fid and keys:
+            FILE_IDS.put(keys, bid, kind, fid)
+    return sent
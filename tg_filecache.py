@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent Telegram file_id cache for product photos / videos.
+
+After the first upload Telegram returns a file_id; sending that id again costs
+no download and no upload. Entries are keyed per bot (file_ids are only valid
+for the bot that got them) on the media URL and on the sha1 of the bytes, so
+the same picture behind two URLs is uploaded once too.
+
+send_cached(bot, chat_id, "photo"|"video", url, session, caption=...) tries a
+cached id first; if Telegram rejects it (expired / wrong file identifier) the
+entry is dropped and the media is downloaded and uploaded as before.
+"""
+import os, time, hashlib, sqlite3, threading
+from telebot.apihelper import ApiTelegramException
+
+TG_FILE_CACHE_DB = os.getenv("TG_FILE_CACHE_DB") or os.path.join(os.getenv("BOT_DATA_DIR") or os.getenv("DATA_DIR") or "data", "tg_files.db")
+MAX_ENTRIES = int(os.getenv("TG_FILE_CACHE_MAX", "20000"))
+
+def _bot_id(bot) -> str:
+    return str(getattr(bot, "token", "") or "").split(":", 1)[0]
+
+def _file_id(msg, kind: str):
+    if kind == "photo" and getattr(msg, "photo", None):
+        return msg.photo[-1].file_id            # largest size
+    for attr in (kind, "video", "animation", "document"):   # Telegram may convert a video to animation/document
+        obj = getattr(msg, attr, None)
+        if obj is not None and not isinstance(obj, list) and getattr(obj, "file_id", None):
+            return obj.file_id
+    return None
+
+def _rejected(e: Exception) -> bool:
+    """Telegram refusing a file_id (as opposed to flood limits or network errors)."""
+    if not isinstance(e, ApiTelegramException) or e.error_code != 400:
+        return False
+    d = (e.description or "").lower()
+    return "file" in d or "wrong type of the web page content" in d
+
+class FileIdCache:
+    def __init__(self, path: str = TG_FILE_CACHE_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.uploads = 0
+        self.rejected = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            c = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("""CREATE TABLE IF NOT EXISTS tg_files (
+                key TEXT NOT NULL, bot_id TEXT NOT NULL, kind TEXT NOT NULL, file_id TEXT NOT NULL,
+                created_at REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (key, bot_id, kind))""")
+            c.execute("CREATE INDEX IF NOT EXISTS tg_files_lru ON tg_files(last_used)")
+            self._conn = c
+        return self._conn
+
+    def get(self, key: str, bot_id: str, kind: str):
+        if not key:
+            return None
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT file_id FROM tg_files WHERE key=? AND bot_id=? AND kind=?",
+                             (key, bot_id, kind)).fetchone()
+            if row:
+                with db:
+                    db.execute("UPDATE tg_files SET last_used=? WHERE key=? AND bot_id=? AND kind=?",
+                               (time.time(), key, bot_id, kind))
+        return row[0] if row else None
+
+    def put(self, keys, bot_id: str, kind: str, file_id: str):
+        now = time.time()
+        rows = [(k, bot_id, kind, file_id, now, now) for k in keys if k]
+        if not rows or not file_id:
+            return
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO tg_files VALUES (?,?,?,?,?,?)", rows)
+                n = db.execute("SELECT COUNT(*) FROM tg_files").fetchone()[0]
+                if n > MAX_ENTRIES:
+                    drop = n - int(MAX_ENTRIES * 0.9)
+                    db.execute("DELETE FROM tg_files WHERE rowid IN "
+                               "(SELECT rowid FROM tg_files ORDER BY last_used LIMIT ?)", (drop,))
+
+    def drop(self, file_id: str, bot_id: str):
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM tg_files WHERE file_id=? AND bot_id=?", (file_id, bot_id))
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = self._db().execute("SELECT COUNT(*) FROM tg_files").fetchone()[0]
+        return {"entries": n, "hits": self.hits, "uploads": self.uploads, "rejected": self.rejected}
+
+FILE_IDS = FileIdCache()
+
+def _send(bot, kind, chat_id, media, **kw):
+    fn = bot.send_video if kind == "video" else bot.send_photo
+    return fn(chat_id, media, **kw)
+
+def _try_cached(bot, kind, chat_id, key, bid, **kw):
+    fid = FILE_IDS.get(key, bid, kind)
+    if not fid:
+        return None
+    try:
+        msg = _send(bot, kind, chat_id, fid, **kw)
+        FILE_IDS.hits += 1
+        return msg
+    except Exception as e:
+        if not _rejected(e):
+            raise
+        print(f"[TGFILE] cached {kind} rejected ({e}); re-uploading", flush=True)
+        FILE_IDS.rejected += 1
+        FILE_IDS.drop(fid, bid)
+        return None
+
+def send_cached(bot, chat_id, kind: str, url: str, session, timeout=20, **kw):
+    """send_photo / send_video of the media at url, by cached file_id when possible. Returns the Message."""
+    bid = _bot_id(bot)
+    msg = _try_cached(bot, kind, chat_id, url, bid, **kw)
+    if msg is not None:
+        return msg
+    resp = session.get(url, timeout=timeout)
+    resp.raise_for_status()
+    data = resp.content
+    digest = "sha1:" + hashlib.sha1(data).hexdigest()
+    msg = _try_cached(bot, kind, chat_id, digest, bid, **kw)
+    if msg is not None:
+        FILE_IDS.put([url], bid, kind, _file_id(msg, kind))
+        return msg
+    msg = _send(bot, kind, chat_id, data, **kw)
+    FILE_IDS.uploads += 1
+    fid = _file_id(msg, kind)
+    if fid:
+        FILE_IDS.put([url, digest], bid, kind, fid)
+    return msg
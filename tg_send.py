@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Outbound Telegram send scheduler.
+
+Every send goes through one dispatcher:
+  - per-chat FIFO queues, one message in flight per chat, so a chat's
+    messages keep their order;
+  - per-chat spacing: TG_CHAT_RATE msgs/sec for private chats,
+    TG_GROUP_PER_MIN msgs/min for groups / channels;
+  - a global token bucket (TG_GLOBAL_RATE msgs/sec);
+  - priorities: among chats that may send now, the lowest priority value
+    goes first (PRIO_CHANNEL posts before PRIO_ADMIN chatter);
+  - a 429 holds that chat for exactly retry_after seconds and puts the message
+    back at the head of its queue. Throttling never drops a message; only real
+    errors (bad request, network after TG_SEND_RETRIES tries) reach the caller.
+
+ScheduledBot(bot, priority) is a drop-in for the send_* / reply_to /
+edit_* / copy / forward calls of a TeleBot: each call blocks until sent and
+returns what the bot returned.
+"""
+import os, re, time, heapq, itertools, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.exceptions import ConnectionError as NetError, Timeout
+from telebot.apihelper import ApiTelegramException
+from ae_ratelimit import TokenBucket, parse_retry_after
+
+PRIO_CHANNEL = 0
+PRIO_ADMIN = 10
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_GROUP_PER_MIN = float(os.getenv("TG_GROUP_PER_MIN", "20"))
+TG_SEND_WORKERS = int(os.getenv("TG_SEND_WORKERS", "4"))
+TG_SEND_RETRIES = int(os.getenv("TG_SEND_RETRIES", "3"))   # network errors only; 429s are retried forever
+
+_RA_RE = re.compile(r"retry after (\d+)", re.I)
+
+def retry_after_of(e) -> float:
+    """Seconds Telegram asked us to wait, or 0 when e isn't a 429."""
+    if not isinstance(e, ApiTelegramException) or e.error_code != 429:
+        return 0.0
+    ra = ((e.result_json or {}).get("parameters") or {}).get("retry_after")
+    if ra is None:
+        m = _RA_RE.search(e.description or "")
+        ra = m.group(1) if m else None
+    return parse_retry_after(ra) or 1.0
+
+def _is_group(chat_id) -> bool:
+    return isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+
+def _interval(chat_id) -> float:
+    return 60.0 / TG_GROUP_PER_MIN if _is_group(chat_id) else 1.0 / TG_CHAT_RATE
+
+class _Job:
+    __slots__ = ("fn", "args", "kw", "chat_id", "chat", "priority", "seq", "future", "tries")
+
+    def __init__(self, fn, args, kw, chat_id, priority, seq):
+        self.fn, self.args, self.kw = fn, args, kw
+        self.chat_id, self.chat = chat_id, str(chat_id)
+        self.priority, self.seq = priority, seq
+        self.future = Future()
+        self.tries = 0
+
+class SendScheduler:
+    def __init__(self, workers: int = TG_SEND_WORKERS):
+        self._queues = {}        # chat -> list of jobs (head = next)
+        self._next_at = {}       # chat -> monotonic time the chat may send again
+        self._busy = set()
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._global = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tg-send")
+        self._thread = None
+        self.sent = 0
+        self.throttled = 0
+        self.failed = 0
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch, name="tg-dispatch", daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, chat_id, *args, priority: int = PRIO_ADMIN, **kw) -> Future:
+        """Queue fn(*args, **kw) as a send to chat_id; the Future resolves with its result."""
+        job = _Job(fn, args, kw, chat_id, priority, next(self._seq))
+        with self._cond:
+            self._start()
+            self._queues.setdefault(job.chat, []).append(job)
+            self._cond.notify()
+        return job.future
+
+    def call(self, fn, chat_id, *args, priority: int = PRIO_ADMIN, **kw):
+        return self.submit(fn, chat_id, *args, priority=priority, **kw).result()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                ready, wake = [], None
+                for chat, q in self._queues.items():
+                    if not q or chat in self._busy:
+                        continue
+                    t = self._next_at.get(chat, 0.0)
+                    if t <= now:
+                        heapq.heappush(ready, (q[0].priority, q[0].seq, chat))
+                    else:
+                        wake = t if wake is None else min(wake, t)
+                if not ready:
+                    self._cond.wait(timeout=None if wake is None else wake - now)
+                    continue
+                _, _, chat = ready[0]
+                job = self._queues[chat].pop(0)
+                if not self._queues[chat]:
+                    del self._queues[chat]
+                self._busy.add(chat)
+                self._next_at[chat] = now + _interval(job.chat_id)
+            self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        self._global.acquire()
+        delay = 0.0
+        try:
+            result = job.fn(*job.args, **job.kw)
+        except Exception as e:
+            ra = retry_after_of(e)
+            job.tries += 1
+            if ra:
+                self.throttled += 1
+                delay = ra
+                print(f"[TGSEND] 429 for {job.chat}: retry in {ra:.0f}s", flush=True)
+            elif isinstance(e, (NetError, Timeout)) and job.tries < TG_SEND_RETRIES:
+                delay = min(30.0, 2.0 ** job.tries)   # network hiccup: back off and resend
+                print(f"[TGSEND] {job.chat}: {e}; retry {job.tries}/{TG_SEND_RETRIES - 1} in {delay:.0f}s", flush=True)
+            else:
+                self.failed += 1
+                job.future.set_exception(e)
+            if delay:
+                with self._cond:
+                    self._queues.setdefault(job.chat, []).insert(0, job)   # keep its place in the chat's order
+                    self._next_at[job.chat] = time.monotonic() + delay
+        else:
+            self.sent += 1
+            job.future.set_result(result)
+        finally:
+            with self._cond:
+                self._busy.discard(job.chat)
+                self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = sum(len(q) for q in self._queues.values())
+        return {"sent": self.sent, "queued": queued, "429s": self.throttled, "failed": self.failed,
+                "global_waited_sec": self._global.stats()["waited_sec"]}
+
+SCHEDULER = SendScheduler()
+
+# chat_id position per routed method (name -> (positional index, keyword))
+_ROUTED = {
+    "send_message": (0, "chat_id"), "send_photo": (0, "chat_id"), "send_video": (0, "chat_id"),
+    "send_document": (0, "chat_id"), "send_animation": (0, "chat_id"), "send_media_group": (0, "chat_id"),
+    "copy_message": (0, "chat_id"), "forward_message": (0, "chat_id"),
+    "edit_message_reply_markup": (0, "chat_id"),
+    "edit_message_text": (1, "chat_id"), "edit_message_caption": (1, "chat_id"),
+}
+
+class ScheduledBot:
+    """TeleBot stand-in: routed calls go through SCHEDULER with this priority; everything else passes through."""
+    def __init__(self, bot, priority: int = PRIO_ADMIN, scheduler: SendScheduler = None):
+        self._bot = bot
+        self._priority = priority
+        self._sched = scheduler or SCHEDULER
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        if name == "reply_to":
+            return lambda message, *a, **kw: self._sched.call(attr, message.chat.id, message, *a,
+                                                              priority=self._priority, **kw)
+        if name not in _ROUTED:
+            return attr
+        pos, key = _ROUTED[name]
+        def routed(*a, **kw):
+            chat = kw.get(key) if key in kw else (a[pos] if len(a) > pos else None)
+            return self._sched.call(attr, chat, *a, priority=self._priority, **kw)
+        return routed